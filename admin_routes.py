@@ -2,7 +2,12 @@ from flask import Blueprint, render_template, request, jsonify, redirect, url_fo
 from flask_login import login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from app import db
-from models import User, Server, ServerMembership, Channel, Message, DirectMessage, UserActivity, SystemMetrics, UserSession
+from cache import cache, invalidate
+from db_routing import read_replica
+from db_profiling import query_stats
+from jobs import PRIORITY_LOW, job
+from deletion import schedule_server_deletion, schedule_user_deletion
+from models import User, Server, ServerMembership, Channel, Message, DirectMessage, UserActivity, SystemMetrics, UserSession, Job
 from datetime import datetime, timedelta
 from sqlalchemy import func, desc, and_, or_
 import json
@@ -20,6 +25,7 @@ def is_super_admin():
 
 @admin.route('/admin')
 @login_required
+@read_replica
 def admin_panel():
     """Main admin panel with intelligent analytics"""
     if not is_admin():
@@ -146,7 +152,7 @@ def manage_users():
     page = request.args.get('page', 1, type=int)
     search = request.args.get('search', '')
     
-    query = User.query
+    query = User.query.filter(User.deleting.is_(False))
     if search:
         query = query.filter(
             db.or_(
@@ -192,6 +198,7 @@ def ban_user(user_id):
         user.banned_at = datetime.now()
         
         db.session.commit()
+        invalidate(User, user_id)
         
         username = getattr(user, 'username', None) or getattr(user, 'email', 'Unknown User')
         return jsonify({'success': True, 'message': f'User {username} has been banned'})
@@ -218,6 +225,7 @@ def unban_user(user_id):
         user.banned_at = None
         
         db.session.commit()
+        invalidate(User, user_id)
         
         username = getattr(user, 'username', None) or getattr(user, 'email', 'Unknown User')
         return jsonify({'success': True, 'message': f'User {username} has been unbanned'})
@@ -243,10 +251,10 @@ def delete_user(user_id):
             return jsonify({'error': 'Cannot delete other super admins'}), 403
         
         username = getattr(user, 'username', None) or getattr(user, 'email', 'Unknown User')
-        db.session.delete(user)
-        db.session.commit()
+        # Signed out and hidden now; the account and everything it owns is removed by a background job
+        job_id = schedule_user_deletion(user)
         
-        return jsonify({'success': True, 'message': f'User {username} has been deleted'})
+        return jsonify({'success': True, 'message': f'User {username} has been deleted', 'job_id': job_id})
         
     except Exception as e:
         db.session.rollback()
@@ -323,7 +331,7 @@ def manage_servers():
     page = request.args.get('page', 1, type=int)
     search = request.args.get('search', '')
     
-    query = Server.query
+    query = Server.query.filter(Server.deleting.is_(False))
     if search:
         query = query.filter(Server.name.contains(search))
     
@@ -441,10 +449,52 @@ def delete_server(server_id):
     server = Server.query.get_or_404(server_id)
     server_name = server.name
     
-    db.session.delete(server)
-    db.session.commit()
+    # Hidden now; its contents are removed in batches by a background job
+    job_id = schedule_server_deletion(server)
     
-    return jsonify({'success': True, 'message': f'Server {server_name} has been deleted'})
+    return jsonify({'success': True, 'message': f'Server {server_name} has been deleted', 'job_id': job_id})
+
+@admin.route('/admin/jobs/<int:job_id>')
+@login_required
+def job_status(job_id):
+    """Status and progress of a background job (e.g. a server or user deletion)"""
+    if not is_admin():
+        return jsonify({'error': 'Access denied'}), 403
+    
+    job_row = Job.query.get_or_404(job_id)
+    return jsonify({
+        'id': job_row.id,
+        'name': job_row.name,
+        'status': job_row.status,
+        'attempts': job_row.attempts,
+        'progress': json.loads(job_row.progress) if job_row.progress else None,
+        'last_error': job_row.last_error.strip().splitlines()[-1] if job_row.last_error else None,
+        'created_at': job_row.created_at.isoformat(),
+        'finished_at': job_row.finished_at.isoformat() if job_row.finished_at else None
+    })
+
+@admin.route('/admin/cache-stats')
+@login_required
+def cache_stats():
+    """Hit/miss metrics for the read-through lookup cache"""
+    if not is_admin():
+        return jsonify({'error': 'Access denied'}), 403
+    
+    return jsonify(cache.snapshot())
+
+@admin.route('/admin/query-stats', methods=['GET', 'DELETE'])
+@login_required
+def query_stats_view():
+    """Per-endpoint query counts and DB time from sampled requests, plus the slowest statements"""
+    if not is_admin():
+        return jsonify({'error': 'Access denied'}), 403
+    
+    if request.method == 'DELETE':
+        query_stats.reset()
+        return jsonify({'success': True})
+    
+    limit = request.args.get('limit', 20, type=int)
+    return jsonify(query_stats.snapshot(limit=limit))
 
 @admin.route('/admin/audit-logs')
 @login_required
@@ -460,6 +510,7 @@ def audit_logs():
 
 @admin.route('/admin/analytics/api/realtime')
 @login_required
+@read_replica
 def realtime_analytics():
     """Real-time analytics API endpoint"""
     if not is_admin():
@@ -501,6 +552,7 @@ def realtime_analytics():
 
 @admin.route('/admin/analytics/api/activity-chart')
 @login_required
+@read_replica
 def activity_chart_data():
     """Activity chart data for the last 24 hours"""
     if not is_admin():
@@ -530,6 +582,7 @@ def activity_chart_data():
 
 @admin.route('/admin/analytics/api/user-growth')
 @login_required
+@read_replica
 def user_growth_data():
     """User growth data for the last 30 days"""
     if not is_admin():
@@ -555,6 +608,7 @@ def user_growth_data():
 def track_activity(user_id, activity_type, activity_data=None, server_id=None, channel_id=None):
     """Helper function to track user activity"""
     try:
+        # A single INSERT: queueing it would cost the job row's INSERT on top
         activity = UserActivity(
             user_id=user_id,
             activity_type=activity_type,
@@ -570,6 +624,11 @@ def track_activity(user_id, activity_type, activity_data=None, server_id=None, c
     except Exception as e:
         print(f"Error tracking activity: {e}")
 
+@job('record_activity', priority=PRIORITY_LOW)
+def record_activity(**fields):
+    """Rows are written inline now; this drains jobs queued by earlier releases"""
+    db.session.add(UserActivity(**fields))
+
 def create_user_session(user_id):
     """Create or update user session"""
     try:
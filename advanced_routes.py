@@ -7,6 +7,9 @@ from flask import Blueprint, request, jsonify, render_template, redirect, url_fo
 from flask_login import login_required, current_user
 from app import db
 from models import *
+from cache import cached_get, cached_get_or_404
+from db_routing import read_replica
+from jobs import job
 import json
 import secrets
 import hashlib
@@ -66,9 +69,13 @@ def has_permission(user_id, server_id, permission):
     if not user_id or not server_id:
         return False
     
+    # A server being deleted takes no new roles, channels or emojis
+    server = cached_get(Server, server_id)
+    if server is None or server.deleting:
+        return False
+    
     # Server owner has all permissions
-    server = Server.query.get(server_id)
-    if server and server.owner_id == user_id:
+    if server.owner_id == user_id:
         return True
     
     membership = ServerMembership.query.filter_by(
@@ -94,7 +101,7 @@ def has_permission(user_id, server_id, permission):
 @login_required
 def manage_roles(server_id):
     """Role management interface"""
-    server = Server.query.get_or_404(server_id)
+    server = cached_get_or_404(Server, server_id)
     
     if not has_permission(current_user.id, server_id, 'MANAGE_ROLES'):
         flash('You do not have permission to manage roles.', 'error')
@@ -122,10 +129,11 @@ def create_role(server_id):
     )
     
     db.session.add(role)
-    db.session.commit()
+    db.session.flush()
     
-    # Log action
+    # Log action (same transaction as the role)
     log_audit_action(server_id, current_user.id, 10, str(role.id), 'Role created')
+    db.session.commit()
     
     return jsonify({'success': True, 'role_id': role.id})
 
@@ -151,12 +159,12 @@ def edit_role(server_id, role_id):
     role.hoist = data.get('hoist', role.hoist)
     role.mentionable = data.get('mentionable', role.mentionable)
     
-    db.session.commit()
-    
     # Log changes
     changes = json.dumps({'old': old_values, 'new': data})
     log_audit_action(server_id, current_user.id, 11, str(role.id), 'Role updated', changes)
     
+    db.session.commit()
+    
     return jsonify({'success': True})
 
 @advanced.route('/server/<int:server_id>/roles/<int:role_id>/delete', methods=['POST'])
@@ -178,13 +186,12 @@ def delete_role(server_id, role_id):
                 membership.roles = json.dumps(roles)
     
     db.session.delete(role)
-    db.session.commit()
-    
     log_audit_action(server_id, current_user.id, 12, str(role.id), 'Role deleted')
+    db.session.commit()
     
     return jsonify({'success': True})
 
-@advanced.route('/server/<int:server_id>/members/<user_id>/roles', methods=['POST'])
+@advanced.route('/server/<int:server_id>/members/<int:user_id>/roles', methods=['POST'])
 @login_required
 def assign_role(server_id, user_id):
     """Assign role to member"""
@@ -207,9 +214,8 @@ def assign_role(server_id, user_id):
         roles.remove(role_id)
     
     membership.roles = json.dumps(roles)
-    db.session.commit()
-    
     log_audit_action(server_id, current_user.id, 25, user_id, f'Role {action}ed')
+    db.session.commit()
     
     return jsonify({'success': True})
 
@@ -218,7 +224,7 @@ def assign_role(server_id, user_id):
 @login_required
 def create_thread(channel_id):
     """Create new thread"""
-    channel = Channel.query.get_or_404(channel_id)
+    channel = cached_get_or_404(Channel, channel_id)
     
     if not has_permission(current_user.id, channel.server_id, 'CREATE_PUBLIC_THREADS'):
         return jsonify({'error': 'No permission'}), 403
@@ -258,7 +264,7 @@ def archive_thread(thread_id):
 @login_required
 def manage_emojis(server_id):
     """Emoji management interface"""
-    server = Server.query.get_or_404(server_id)
+    server = cached_get_or_404(Server, server_id)
     
     if not has_permission(current_user.id, server_id, 'MANAGE_EMOJIS_AND_STICKERS'):
         flash('You do not have permission to manage emojis.', 'error')
@@ -304,10 +310,12 @@ def upload_emoji(server_id):
         animated=file.filename.lower().endswith('.gif')
     )
     
+    # Thumbnails are generated in the background once this commits (thumbnails.py)
     db.session.add(emoji)
-    db.session.commit()
+    db.session.flush()
     
     log_audit_action(server_id, current_user.id, 60, str(emoji.id), 'Emoji created')
+    db.session.commit()
     
     return jsonify({'success': True, 'emoji_id': emoji.id})
 
@@ -316,7 +324,7 @@ def upload_emoji(server_id):
 @login_required
 def create_webhook(channel_id):
     """Create webhook for channel"""
-    channel = Channel.query.get_or_404(channel_id)
+    channel = cached_get_or_404(Channel, channel_id)
     
     if not has_permission(current_user.id, channel.server_id, 'MANAGE_WEBHOOKS'):
         return jsonify({'error': 'No permission'}), 403
@@ -348,10 +356,10 @@ def execute_webhook(token):
     webhook = Webhook.query.filter_by(token=token).first_or_404()
     data = request.get_json()
     
-    # Create message from webhook
+    # Create message from webhook, attributed to the server owner
     message = Message(
         content=data.get('content', ''),
-        author_id='webhook',  # Special webhook user
+        author_id=webhook.server.owner_id,
         channel_id=webhook.channel_id,
         message_type='webhook'
     )
@@ -366,7 +374,7 @@ def execute_webhook(token):
 @login_required
 def manage_commands(server_id):
     """Manage slash commands"""
-    server = Server.query.get_or_404(server_id)
+    server = cached_get_or_404(Server, server_id)
     
     if not has_permission(current_user.id, server_id, 'MANAGE_GUILD'):
         flash('You do not have permission to manage commands.', 'error')
@@ -395,8 +403,8 @@ def handle_interaction():
             })
         elif command_name == 'serverinfo':
             server_id = data.get('guild_id')
-            server = Server.query.get(server_id)
-            if server:
+            server = cached_get(Server, server_id)
+            if server and not server.deleting:
                 return jsonify({
                     'type': 4,
                     'data': {
@@ -459,7 +467,7 @@ def notification_settings():
     """Notification settings"""
     settings = NotificationSettings.query.filter_by(user_id=current_user.id).all()
     servers = Server.query.join(ServerMembership).filter(
-        ServerMembership.user_id == current_user.id
+        ServerMembership.user_id == current_user.id, Server.deleting.is_(False)
     ).all()
     
     return render_template('settings/notifications.html', settings=settings, servers=servers)
@@ -579,7 +587,7 @@ def decline_friend(friendship_id):
 @login_required
 def server_events(server_id):
     """Server events interface"""
-    server = Server.query.get_or_404(server_id)
+    server = cached_get_or_404(Server, server_id)
     events = ScheduledEvent.query.filter_by(server_id=server_id).order_by(
         ScheduledEvent.scheduled_start_time
     ).all()
@@ -613,7 +621,7 @@ def create_event(server_id):
 
 # Utility Functions
 def log_audit_action(server_id, user_id, action_type, target_id=None, reason=None, changes=None):
-    """Log action to audit log"""
+    """Add an audit log entry to the caller's transaction; the caller commits it with the change it records"""
     log = AuditLog(
         server_id=server_id,
         user_id=user_id,
@@ -624,6 +632,11 @@ def log_audit_action(server_id, user_id, action_type, target_id=None, reason=Non
     )
     db.session.add(log)
 
+@job('write_audit_log')
+def write_audit_log(**fields):
+    """Entries are written inline now; this drains jobs queued by earlier releases"""
+    db.session.add(AuditLog(**fields))
+
 # Presence Update
 @advanced.route('/api/presence/update', methods=['POST'])
 @login_required
@@ -650,9 +663,10 @@ def update_presence():
 # Server Analytics
 @advanced.route('/server/<int:server_id>/analytics')
 @login_required
+@read_replica
 def server_analytics(server_id):
     """Server analytics dashboard"""
-    server = Server.query.get_or_404(server_id)
+    server = cached_get_or_404(Server, server_id)
     
     if not has_permission(current_user.id, server_id, 'VIEW_GUILD_INSIGHTS'):
         flash('You do not have permission to view analytics.', 'error')
@@ -9,16 +9,18 @@ from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from urllib.parse import urlparse
 
-# Configure logging with reduced verbosity for performance
+# Configure logging; WARNING by default to keep request handling quiet (LOG_LEVEL=INFO/DEBUG to investigate)
 logging.basicConfig(
-    level=logging.WARNING,  # Reduced from INFO to WARNING
+    level=getattr(logging, os.environ.get('LOG_LEVEL', 'WARNING').upper(), logging.WARNING),
     format='%(levelname)s - %(message)s'  # Simplified format
 )
 
 class Base(DeclarativeBase):
     pass
 
-db = SQLAlchemy(model_class=Base)
+# RoutingSession lets read-only views use a replica bind when one is configured
+from db_routing import RoutingSession
+db = SQLAlchemy(model_class=Base, session_options={'class_': RoutingSession})
 
 # Create the app
 app = Flask(__name__)
@@ -29,10 +31,9 @@ app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 app.config['WTF_CSRF_ENABLED'] = True
 app.config['PERMANENT_SESSION_LIFETIME'] = 3600  # 1 hour
 
-# Use SQLite for reliable local development
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///communicationx.db"
-
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {}
+# DATABASE_URL selects the backend (SQLite for local development when unset)
+from db_engine import configure_database
+configure_database(app)
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
 # Simplified rate limiting for better performance
@@ -44,6 +45,23 @@ limiter = Limiter(
 
 # Initialize extensions
 db.init_app(app)
+
+# Per-page query budgets (set QUERY_BUDGET_ENFORCE=1 to fail, or =warn to log)
+from db_profiling import init_query_budgets, init_query_profiling
+app.config['QUERY_BUDGET_ENFORCE'] = os.environ.get('QUERY_BUDGET_ENFORCE')
+init_query_budgets(app)
+
+# Per-request SQL profiling: sampled requests get a Server-Timing header and feed /admin/query-stats
+app.config['QUERY_PROFILE_SAMPLE_RATE'] = float(os.environ.get('QUERY_PROFILE_SAMPLE_RATE', 0.05))
+app.config['QUERY_PROFILE_TOP_N'] = int(os.environ.get('QUERY_PROFILE_TOP_N', 5))
+app.config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', 250))
+init_query_profiling(app)
+
+# Read-through cache for hot lookups (cache.py); set CACHE_REDIS_URL to share it between workers
+app.config['CACHE_LOCAL_SIZE'] = int(os.environ.get('CACHE_LOCAL_SIZE', 2048))
+app.config['CACHE_LOCAL_TTL'] = int(os.environ.get('CACHE_LOCAL_TTL', 30))
+app.config['CACHE_SHARED_TTL'] = int(os.environ.get('CACHE_SHARED_TTL', 300))
+app.config['CACHE_REDIS_URL'] = os.environ.get('CACHE_REDIS_URL')
 socketio = SocketIO(app, 
                    cors_allowed_origins="*", 
                    async_mode='threading',
@@ -52,26 +70,22 @@ socketio = SocketIO(app,
                    ping_timeout=60,
                    ping_interval=25)
 
-# Force database initialization with all new models
+# Runtime metrics in Prometheus text format on /metrics; METRICS_TOKEN requires a bearer token,
+# without it only loopback clients may scrape
+from metrics import init_metrics
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+init_metrics(app, db, socketio)
+
+# Bring the schema up to date without touching existing data
 def init_database():
-    """Initialize database tables with all Discord-like features"""
+    """Apply pending schema migrations; a no-op (single query) when the schema is current.
+
+    A stale or half-migrated schema must not serve traffic, so any failure stops the process.
+    """
     with app.app_context():
         try:
-            # Import all models to register them
-            import models  # noqa: F401
-            
-            # Drop all tables and recreate to ensure new schema
-            db.drop_all()
-            db.create_all()
-            
-            # Database tables created successfully
-            logging.warning("Database tables created successfully")
-            
-            db.session.commit()
-            logging.warning("Database recreated with Discord-like features")
-            
+            from schema_migrations import init_schema
+            init_schema()
         except Exception as e:
-            logging.error(f"Database initialization error: {e}")
-
-# Initialize database immediately
-init_database()
+            logging.exception(f"Database initialization error: {e}")
+            raise SystemExit(1) from e
@@ -0,0 +1,134 @@
+"""
+Hot/cold message storage for CommunicationX
+Moves channel messages older than MESSAGE_ARCHIVE_DAYS into message_archive in batches so the
+messages table and its indexes only hold recent traffic; history reads merge both tables
+"""
+
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import and_, delete, exists, insert, or_, select
+from sqlalchemy.orm import joinedload, selectinload
+
+from app import app, db
+from fragments import invalidate_message
+from models import (Message, MessageArchive, MessageAttachment, Embed, MessageReport,
+                    MessageReaction, MessageReactionCount, MessageReadStatus)
+
+DEFAULT_ARCHIVE_DAYS = int(os.environ.get('MESSAGE_ARCHIVE_DAYS', 90))
+DEFAULT_BATCH_SIZE = 1000
+
+def _archivable_ids(cutoff, batch_size):
+    """Oldest messages past the cutoff that carry nothing the archive cannot represent"""
+    return db.session.execute(
+        select(Message.id)
+        .where(
+            Message.created_at < cutoff,
+            Message.is_pinned.isnot(True),
+            Message.file_data.is_(None),
+            ~exists().where(MessageAttachment.message_id == Message.id),
+            ~exists().where(Embed.message_id == Message.id),
+            ~exists().where(MessageReport.message_id == Message.id),
+        )
+        .order_by(Message.id)
+        .limit(batch_size)
+    ).scalars().all()
+
+def _archive_batch(message_ids):
+    """Copy one batch into message_archive and delete it from the hot tables in one transaction"""
+    summaries = {}
+    for message_id, emoji, count in db.session.execute(
+        select(MessageReactionCount.message_id, MessageReactionCount.emoji, MessageReactionCount.count)
+        .where(MessageReactionCount.message_id.in_(message_ids))
+    ):
+        summaries.setdefault(message_id, {})[emoji] = count
+
+    rows = db.session.execute(
+        select(Message.id, Message.content, Message.author_id, Message.channel_id, Message.created_at,
+               Message.edited_at, Message.reply_to_id, Message.message_type)
+        .where(Message.id.in_(message_ids))
+    ).mappings().all()
+
+    archived_at = datetime.now()
+    db.session.execute(insert(MessageArchive), [
+        dict(row,
+             reaction_summary=json.dumps(summaries[row['id']]) if row['id'] in summaries else None,
+             archived_at=archived_at)
+        for row in rows
+    ])
+
+    # Children first, then the messages themselves
+    for model in (MessageReaction, MessageReactionCount, MessageReadStatus):
+        db.session.execute(delete(model).where(model.message_id.in_(message_ids)))
+    db.session.execute(delete(Message).where(Message.id.in_(message_ids)))
+    db.session.commit()
+    # Bulk deletes skip the session's flush hooks; archived rows render under their own key
+    for message_id in message_ids:
+        invalidate_message(message_id)
+    return len(rows)
+
+def archive_old_messages(older_than_days=DEFAULT_ARCHIVE_DAYS, batch_size=DEFAULT_BATCH_SIZE, max_batches=None):
+    """Move messages older than the cutoff to message_archive; returns the number moved"""
+    cutoff = datetime.now() - timedelta(days=older_than_days)
+    moved = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        message_ids = _archivable_ids(cutoff, batch_size)
+        if not message_ids:
+            break
+        try:
+            moved += _archive_batch(message_ids)
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"Message archival batch failed: {e}")
+            raise
+        batches += 1
+    if moved:
+        logging.warning(f"Archived {moved} messages older than {cutoff:%Y-%m-%d}")
+    return moved
+
+def reaction_summary(archived_message):
+    """{emoji: count} stored on an archived message"""
+    return json.loads(archived_message.reaction_summary) if archived_message.reaction_summary else {}
+
+def _before(model, before, before_id):
+    """Keyset condition: strictly older than (before, before_id), or than `before` alone"""
+    if before_id is None:
+        return model.created_at < before
+    return or_(model.created_at < before, and_(model.created_at == before, model.id < before_id))
+
+def channel_history(channel_id, limit=50, before=None, before_id=None):
+    """Newest `limit` messages of a channel across the hot table and the archive, oldest first"""
+    query = Message.query.options(
+        joinedload(Message.author),
+        selectinload(Message.attachments),
+    ).filter(Message.channel_id == channel_id)
+    if before is not None:
+        query = query.filter(_before(Message, before, before_id))
+    messages = query.order_by(Message.created_at.desc(), Message.id.desc()).limit(limit).all()
+
+    # Pinned or attachment-bearing messages stay hot, so old hot rows can be older than archived
+    # ones: both tables are always read with the same keyset bound and merged by time
+    archived = MessageArchive.query.options(joinedload(MessageArchive.author)).filter(
+        MessageArchive.channel_id == channel_id
+    )
+    if before is not None:
+        archived = archived.filter(_before(MessageArchive, before, before_id))
+    messages.extend(archived.order_by(MessageArchive.created_at.desc(), MessageArchive.id.desc()).limit(limit).all())
+    messages.sort(key=lambda message: (message.created_at, message.id), reverse=True)
+    del messages[limit:]
+
+    messages.reverse()
+    return messages
+
+@app.cli.command('archive-messages')
+@click.option('--days', default=DEFAULT_ARCHIVE_DAYS, show_default=True, help='Archive messages older than this many days')
+@click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True)
+@click.option('--max-batches', default=None, type=int, help='Stop after this many batches')
+def archive_messages_command(days, batch_size, max_batches):
+    """Move old channel messages from the hot messages table into message_archive"""
+    moved = archive_old_messages(days, batch_size, max_batches)
+    click.echo(f"archived {moved} messages older than {days} days")
@@ -0,0 +1,293 @@
+"""
+Benchmark harness for the CommunicationX messaging hot paths
+Seeds a scratch database with datagen, drives the real routes through the Flask test client and the
+Socket.IO handlers through the Socket.IO test client, and reports latency percentiles,
+throughput and SQL statements per operation. Runs can be saved and compared to a baseline:
+
+    python benchmark.py --users 200 --servers 20 --messages 20000 --save bench-baseline.json
+    python benchmark.py --baseline bench-baseline.json
+
+The database is a temporary SQLite file unless --database-url (or BENCHMARK_DATABASE_URL)
+names another scratch database; never point it at production, it is seeded and written to.
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+OPERATIONS = (
+    'send_message', 'server_view', 'dm_conversation', 'mark_message_read',
+    'typing', 'upload_file', 'download_file',
+)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--database-url', default=os.environ.get('BENCHMARK_DATABASE_URL'),
+                        help='Scratch database to seed (default: a temporary SQLite file)')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--servers', type=int, default=10)
+    parser.add_argument('--channels', type=int, default=3, help='Channels per server')
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--dms', type=int, default=1000)
+    parser.add_argument('--clients', type=int, default=8, help='Distinct logged-in users driving the operations')
+    parser.add_argument('--iterations', type=int, default=200, help='Measured iterations per operation')
+    parser.add_argument('--warmup', type=int, default=10, help='Unmeasured iterations per operation')
+    parser.add_argument('--ops', default=','.join(OPERATIONS), help='Comma-separated subset of: ' + ', '.join(OPERATIONS))
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save', help='Write the results to this JSON file')
+    parser.add_argument('--baseline', help='Compare against a JSON file written by --save')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed p50/p99 slowdown against the baseline (0.2 = 20%%)')
+    return parser.parse_args(argv)
+
+def load_app(database_url):
+    """Import the application against the scratch database; must run before anything imports app"""
+    os.environ['DATABASE_URL'] = database_url
+    os.environ.setdefault('REPL_ID', 'benchmark')
+    # Measurement must not be skewed by sampling headers or rejected by budgets
+    os.environ['QUERY_PROFILE_SAMPLE_RATE'] = '0'
+    os.environ.pop('QUERY_BUDGET_ENFORCE', None)
+    # Job worker polls would land in the per-operation query counts
+    os.environ['JOB_WORKERS'] = '0'
+    sys.path.insert(0, BASE_DIR)
+
+    import main  # noqa: F401  (registers routes, sockets and blueprints)
+    import jinja2
+    from app import app, limiter
+
+    limiter.enabled = False
+    # Templates live next to the modules in this checkout
+    app.jinja_loader = jinja2.ChoiceLoader([app.jinja_loader, jinja2.FileSystemLoader(BASE_DIR)])
+    return app
+
+def seed(args):
+    """Generate the fixture with datagen; returns the ids the operations need"""
+    from sqlalchemy import insert, select
+    from app import db
+    from datagen import generate
+    from models import ServerMembership
+
+    data = generate(users=args.users, servers=args.servers, channels_per_server=args.channels,
+                    messages=args.messages, dms=args.dms, seed=args.seed)
+
+    # Clients are the most active users and belong to every server, so every operation is allowed
+    client_ids = data['user_ids'][:args.clients]
+    existing = set(db.session.execute(
+        select(ServerMembership.user_id, ServerMembership.server_id).where(ServerMembership.user_id.in_(client_ids))
+    ).all())
+    missing = [{'user_id': user_id, 'server_id': server_id}
+               for user_id in client_ids for server_id in data['server_ids'] if (user_id, server_id) not in existing]
+    if missing:
+        db.session.execute(insert(ServerMembership), missing)
+    db.session.commit()
+
+    return {
+        'user_ids': data['user_ids'],
+        'client_ids': client_ids,
+        'server_ids': data['server_ids'],
+        'channels': data['channels'],
+        'message_ids': data['message_ids'],
+    }
+
+class Client:
+    """A logged-in user with an HTTP test client and a connected Socket.IO test client"""
+
+    def __init__(self, app, socketio, user_id):
+        self.user_id = user_id
+        self.http = app.test_client()
+        with self.http.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+        self.socket = socketio.test_client(app, flask_test_client=self.http)
+
+class Workload:
+    """One callable per operation; each returns the response status (or 'ok' for socket events)"""
+
+    def __init__(self, app, fixture, rng):
+        from app import socketio
+        self.app = app
+        self.rng = rng
+        self.fixture = fixture
+        self.clients = [Client(app, socketio, user_id) for user_id in fixture['client_ids']]
+        self.file_ids = []
+        self._counter = 0
+
+    def _client(self):
+        return self.rng.choice(self.clients)
+
+    def _server(self):
+        return self.rng.choice(self.fixture['server_ids'])
+
+    def send_message(self):
+        self._counter += 1
+        response = self._client().http.post(
+            f'/server/{self._server()}/send_message', data={'message': f'bench send {self._counter}'})
+        return response.status_code
+
+    def server_view(self):
+        return self._client().http.get(f'/server/{self._server()}').status_code
+
+    def dm_conversation(self):
+        client = self._client()
+        other = self.rng.choice([c.user_id for c in self.clients if c.user_id != client.user_id] or self.fixture['user_ids'])
+        return client.http.get(f'/dm/{other}').status_code
+
+    def mark_message_read(self):
+        self._client().socket.emit('mark_message_read', {'message_id': self.rng.choice(self.fixture['message_ids'])})
+        return 'ok'
+
+    def typing(self):
+        channel_id, _ = self.rng.choice(self.fixture['channels'])
+        client = self._client()
+        client.socket.emit('typing', {'channel_id': channel_id})
+        client.socket.emit('stop_typing', {'channel_id': channel_id})
+        return 'ok'
+
+    def upload_file(self):
+        import io
+        self._counter += 1
+        payload = os.urandom(self.rng.randint(1024, 64 * 1024))
+        response = self._client().http.post(
+            f'/upload_file/{self._server()}',
+            data={'file': (io.BytesIO(payload), f'bench_{self._counter}.bin')},
+            content_type='multipart/form-data')
+        return response.status_code
+
+    def download_file(self):
+        if not self.file_ids:
+            from app import db
+            from models import SharedFile
+            with self.app.app_context():
+                self.file_ids = db.session.execute(
+                    db.select(SharedFile.id).where(SharedFile.original_filename.like('bench_%'))
+                ).scalars().all()
+            if not self.file_ids:
+                self.upload_file()
+                return self.download_file()
+        return self._client().http.get(f'/download_file/{self.rng.choice(self.file_ids)}').status_code
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+def run_operation(workload, name, iterations, warmup):
+    from db_profiling import QueryCounter
+
+    operation = getattr(workload, name)
+    for _ in range(warmup):
+        operation()
+
+    latencies = []
+    statuses = {}
+    queries = 0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        with QueryCounter() as counter:
+            op_started = time.perf_counter()
+            status = operation()
+            latencies.append((time.perf_counter() - op_started) * 1000)
+        queries += counter.count
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'iterations': iterations,
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'mean_ms': round(statistics.fmean(latencies), 3) if latencies else 0.0,
+        'ops_per_sec': round(iterations / elapsed, 1) if elapsed else 0.0,
+        'queries_per_op': round(queries / iterations, 2) if iterations else 0.0,
+        'statuses': statuses,
+    }
+
+def compare(results, baseline, tolerance):
+    """Regressions against the baseline: slower p50/p99 beyond tolerance or more queries per op"""
+    regressions = []
+    for name, result in results['operations'].items():
+        before = baseline.get('operations', {}).get(name)
+        if not before:
+            continue
+        for metric in ('p50_ms', 'p99_ms'):
+            if before[metric] and result[metric] > before[metric] * (1 + tolerance):
+                regressions.append(f"{name} {metric}: {before[metric]} -> {result[metric]}")
+        if result['queries_per_op'] > before['queries_per_op']:
+            regressions.append(f"{name} queries_per_op: {before['queries_per_op']} -> {result['queries_per_op']}")
+    return regressions
+
+def print_report(results, baseline=None):
+    header = f"{'operation':<20}{'p50 ms':>10}{'p99 ms':>10}{'ops/s':>10}{'queries':>10}  statuses"
+    print(header)
+    print('-' * len(header))
+    for name, result in results['operations'].items():
+        line = (f"{name:<20}{result['p50_ms']:>10.2f}{result['p99_ms']:>10.2f}"
+                f"{result['ops_per_sec']:>10.1f}{result['queries_per_op']:>10.2f}  {result['statuses']}")
+        before = (baseline or {}).get('operations', {}).get(name)
+        if before and before['p50_ms']:
+            line += f"  (p50 {(result['p50_ms'] / before['p50_ms'] - 1) * 100:+.0f}% vs baseline)"
+        print(line)
+
+def main(argv=None):
+    args = parse_args(argv)
+    operations = [op.strip() for op in args.ops.split(',') if op.strip()]
+    unknown = set(operations) - set(OPERATIONS)
+    if unknown:
+        raise SystemExit(f"unknown operations: {', '.join(sorted(unknown))}")
+
+    database_url = args.database_url or 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='cx-bench-'), 'bench.db')
+    app = load_app(database_url)
+    rng = random.Random(args.seed)
+
+    with app.app_context():
+        seed_started = time.perf_counter()
+        fixture = seed(args)
+        seed_seconds = time.perf_counter() - seed_started
+
+    # Outside any app context, so every request gets its own context and session like in production
+    workload = Workload(app, fixture, rng)
+    results = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'backend': database_url.split(':', 1)[0],
+        'parameters': {key: getattr(args, key) for key in
+                       ('users', 'servers', 'channels', 'messages', 'dms', 'clients', 'iterations', 'warmup', 'seed')},
+        'seed_seconds': round(seed_seconds, 2),
+        'operations': {},
+    }
+    for name in operations:
+        results['operations'][name] = run_operation(workload, name, args.iterations, args.warmup)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    print(f"seeded {args.users} users, {args.servers} servers, {args.messages} messages in {results['seed_seconds']}s "
+          f"({results['backend']})")
+    print_report(results, baseline)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"saved {args.save}")
+
+    if baseline:
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION  {regression}")
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
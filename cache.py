@@ -0,0 +1,471 @@
+"""
+Read-through cache for hot primary-key lookups (Server, Channel, User) and server access checks
+Two tiers: an in-process LRU with a short TTL, backed by a shared cache (Redis when
+CACHE_REDIS_URL is set and redis is installed, otherwise an in-process stand-in). With Redis,
+invalidations are also published so every worker drops its local copy at once; without it each
+process caches on its own, which is only coherent with a single worker process.
+
+Every invalidation also bumps a per-key generation in the shared tier. Read-through lookups note
+the generation before querying and store their result only if it is unchanged, so a read that
+raced with a ban or membership change cannot put the old row back. Cached rows leave out
+credential columns (UNCACHED_COLUMNS), which load from the database when accessed
+"""
+
+import logging
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from flask import abort
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app import db
+from models import User, Server, Channel, ServerMembership
+
+# Models whose rows are cached by primary key
+CACHED_MODELS = (User, Server, Channel)
+
+# Credentials never go into the shared cache; they load from the database on access
+UNCACHED_COLUMNS = {
+    User: ('password_hash', 'bot_token'),
+    Server: ('password_hash',),
+}
+
+_MISSING = object()
+
+class LRUCache:
+    """Thread-safe LRU with a per-entry TTL"""
+
+    def __init__(self, maxsize=2048, ttl=30):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return _MISSING
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return _MISSING
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+class LocalSharedCache:
+    """In-process stand-in for the shared tier; stores pickled values like Redis would"""
+
+    def __init__(self, ttl=300):
+        self._store = LRUCache(maxsize=100000, ttl=ttl)
+        self._generations = LRUCache(maxsize=100000, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        raw = self._store.get(key)
+        return _MISSING if raw is _MISSING else pickle.loads(raw)
+
+    def generation(self, key):
+        generation = self._generations.get(key)
+        return 0 if generation is _MISSING else generation
+
+    def set(self, key, value, generation=None):
+        """Store value; with a generation, only if no invalidation happened since it was read"""
+        with self._lock:
+            if generation is not None and self.generation(key) != generation:
+                return False
+            self._store.set(key, pickle.dumps(value))
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._store.delete(key)
+            self._generations.set(key, self.generation(key) + 1)
+
+    def clear(self):
+        self._store.clear()
+        self._generations.clear()
+
+class RedisSharedCache:
+    """Shared tier backed by Redis so every worker sees the same entries"""
+
+    # SET only while the key's generation is still the one the caller read (KEYS: value, generation)
+    SET_IF_GENERATION = """
+        if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[2] then return 0 end
+        redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[3])
+        return 1
+    """
+
+    def __init__(self, url, ttl=300, prefix='cx:'):
+        import redis
+        self._client = redis.Redis.from_url(url)
+        self._set_if_generation = self._client.register_script(self.SET_IF_GENERATION)
+        self.ttl = ttl
+        self.prefix = prefix
+        self.channel = prefix + 'invalidate'
+
+    def _generation_key(self, key):
+        return f"{self.prefix}generation:{key}"
+
+    def get(self, key):
+        raw = self._client.get(self.prefix + key)
+        return _MISSING if raw is None else pickle.loads(raw)
+
+    def generation(self, key):
+        return int(self._client.get(self._generation_key(key)) or 0)
+
+    def set(self, key, value, generation=None):
+        """Store value; with a generation, only if no invalidation happened since it was read"""
+        if generation is None:
+            self._client.set(self.prefix + key, pickle.dumps(value), ex=self.ttl)
+            return True
+        return bool(self._set_if_generation(
+            keys=[self.prefix + key, self._generation_key(key)], args=[pickle.dumps(value), generation, self.ttl]))
+
+    def delete(self, key):
+        pipeline = self._client.pipeline()
+        pipeline.delete(self.prefix + key)
+        pipeline.incr(self._generation_key(key))
+        pipeline.expire(self._generation_key(key), self.ttl)
+        pipeline.execute()
+
+    def clear(self):
+        for key in self._client.scan_iter(self.prefix + '*'):
+            self._client.delete(key)
+
+    def publish(self, key):
+        """Tell every worker to drop key from its local tier"""
+        self._client.publish(self.channel, key)
+
+    def subscribe(self, on_invalidate, on_reconnect):
+        """Call on_invalidate(key) for each published invalidation, on a daemon thread.
+
+        Messages sent while the connection was down are lost, so on_reconnect() runs before
+        listening again (the local tier is short-lived and simply cleared).
+        """
+        def listen():
+            delay = 1
+            while True:
+                try:
+                    pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+                    pubsub.subscribe(self.channel)
+                    on_reconnect()
+                    delay = 1
+                    for message in pubsub.listen():
+                        on_invalidate(message['data'].decode())
+                except Exception as e:
+                    logging.warning(f"Cache invalidation subscriber lost its connection: {e}")
+                    time.sleep(delay)
+                    delay = min(delay * 2, 30)
+
+        threading.Thread(target=listen, name='cache-invalidations', daemon=True).start()
+
+class TwoTierCache:
+    """Local LRU in front of a shared cache, with hit/miss accounting"""
+
+    def __init__(self):
+        self.local = LRUCache()
+        self.shared = LocalSharedCache()
+        # Per-key invalidation counts of this process, guarding the local tier like the shared one
+        self._local_generations = LRUCache(maxsize=100000, ttl=300)
+        self._local_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.reset_stats()
+
+    def configure(self, local_size, local_ttl, shared_ttl, redis_url=None):
+        self.local = LRUCache(maxsize=local_size, ttl=local_ttl)
+        self.shared = LocalSharedCache(ttl=shared_ttl)
+        self._local_generations = LRUCache(maxsize=100000, ttl=shared_ttl)
+        if redis_url:
+            try:
+                self.shared = RedisSharedCache(redis_url, ttl=shared_ttl)
+            except ImportError:
+                logging.warning("CACHE_REDIS_URL is set but redis is not installed; using the local shared cache")
+            else:
+                # Bans, deletions and membership changes made in another worker apply here at once
+                self.shared.subscribe(self._remote_invalidation, self.local.clear)
+
+    def reset_stats(self):
+        self.stats = {'local_hits': 0, 'shared_hits': 0, 'misses': 0, 'invalidations': 0,
+                      'remote_invalidations': 0, 'stale_sets': 0, 'errors': 0}
+
+    def _remote_invalidation(self, key):
+        self._count('remote_invalidations')
+        self._drop_local(key)
+
+    def _local_generation(self, key):
+        generation = self._local_generations.get(key)
+        return 0 if generation is _MISSING else generation
+
+    def _drop_local(self, key):
+        with self._local_lock:
+            self.local.delete(key)
+            self._local_generations.set(key, self._local_generation(key) + 1)
+
+    def _count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is not _MISSING:
+            self._count('local_hits')
+            return value
+        try:
+            value = self.shared.get(key)
+        except Exception as e:
+            # The shared tier is an optimisation; never fail a request because of it
+            logging.warning(f"Shared cache get failed for {key}: {e}")
+            self._count('errors')
+            value = _MISSING
+        if value is _MISSING:
+            self._count('misses')
+            return _MISSING
+        self._count('shared_hits')
+        self.local.set(key, value)
+        return value
+
+    def generation(self, key):
+        """Invalidation counts of key; read before loading a value that is then passed to set()"""
+        try:
+            shared = self.shared.generation(key)
+        except Exception as e:
+            logging.warning(f"Shared cache generation failed for {key}: {e}")
+            self._count('errors')
+            shared = None
+        return self._local_generation(key), shared
+
+    def set(self, key, value, generation=None):
+        """Cache value; with a generation, only if key was not invalidated since that generation was read"""
+        local_generation, shared_generation = generation or (None, None)
+        try:
+            stored = self.shared.set(key, value, shared_generation)
+        except Exception as e:
+            logging.warning(f"Shared cache set failed for {key}: {e}")
+            self._count('errors')
+            stored = True
+        with self._local_lock:
+            if stored and (local_generation is None or local_generation == self._local_generation(key)):
+                self.local.set(key, value)
+                return
+        # Loaded before a concurrent change committed; caching it would undo the invalidation
+        self._count('stale_sets')
+
+    def delete(self, key):
+        self._count('invalidations')
+        self._drop_local(key)
+        try:
+            self.shared.delete(key)
+            if isinstance(self.shared, RedisSharedCache):
+                self.shared.publish(key)
+        except Exception as e:
+            logging.warning(f"Shared cache delete failed for {key}: {e}")
+            self._count('errors')
+
+    def clear(self):
+        self.local.clear()
+        self._local_generations.clear()
+        self.shared.clear()
+
+    def snapshot(self):
+        """Hit/miss counters plus derived ratios, for the admin stats endpoint"""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        lookups = stats['local_hits'] + stats['shared_hits'] + stats['misses']
+        stats['lookups'] = lookups
+        stats['hit_ratio'] = round((lookups - stats['misses']) / lookups, 4) if lookups else 0.0
+        stats['local_entries'] = len(self.local)
+        stats['local_evictions'] = self.local.evictions
+        stats['shared_backend'] = type(self.shared).__name__
+        return stats
+
+cache = TwoTierCache()
+
+def init_cache(app):
+    """Size the cache tiers from app config"""
+    cache.configure(
+        local_size=app.config.get('CACHE_LOCAL_SIZE', 2048),
+        local_ttl=app.config.get('CACHE_LOCAL_TTL', 30),
+        shared_ttl=app.config.get('CACHE_SHARED_TTL', 300),
+        redis_url=app.config.get('CACHE_REDIS_URL'),
+    )
+
+def _row_key(model, ident):
+    return f"{model.__tablename__}:{ident}"
+
+def _membership_key(user_id, server_id):
+    return f"membership:{user_id}:{server_id}"
+
+def _access_key(user_id):
+    return f"server_access:{user_id}"
+
+def _row_values(obj):
+    uncached = UNCACHED_COLUMNS.get(type(obj), ())
+    return {attr.key: getattr(obj, attr.key) for attr in inspect(obj).mapper.column_attrs if attr.key not in uncached}
+
+def _attach(model, values):
+    """Rebuild a row from cached column values and attach it to the current session without a query"""
+    obj = inspect(model).class_manager.new_instance()
+    for key, value in values.items():
+        set_committed_value(obj, key, value)
+    make_transient_to_detached(obj)
+    obj = db.session.merge(obj, load=False)
+    uncached = UNCACHED_COLUMNS.get(model)
+    if uncached:
+        # Loaded by primary key on first access
+        db.session.expire(obj, uncached)
+    return obj
+
+def cached_get(model, ident):
+    """Session.get() through the cache; returns None when the row does not exist"""
+    if ident is None:
+        return None
+    identity = db.session.identity_key(model, ident)
+    if identity in db.session.identity_map:
+        return db.session.identity_map[identity]
+
+    key = _row_key(model, ident)
+    values = cache.get(key)
+    if values is not _MISSING:
+        return _attach(model, values)
+
+    generation = cache.generation(key)
+    obj = db.session.get(model, ident)
+    if obj is not None:
+        cache.set(key, _row_values(obj), generation)
+    return obj
+
+def cached_get_many(model, idents):
+    """{ident: row} for a batch of primary keys: identity map, then cache, then one IN query for the rest"""
+    found = {}
+    missing = {}
+    for ident in dict.fromkeys(idents):
+        if ident is None:
+            continue
+        identity = db.session.identity_key(model, ident)
+        if identity in db.session.identity_map:
+            found[ident] = db.session.identity_map[identity]
+            continue
+        key = _row_key(model, ident)
+        values = cache.get(key)
+        if values is _MISSING:
+            missing[ident] = cache.generation(key)
+        else:
+            found[ident] = _attach(model, values)
+
+    if missing:
+        primary_key = inspect(model).primary_key[0]
+        for obj in db.session.query(model).filter(primary_key.in_(list(missing))):
+            ident = inspect(obj).identity[0]
+            cache.set(_row_key(model, ident), _row_values(obj), missing[ident])
+            found[ident] = obj
+    return found
+
+def cached_get_or_404(model, ident):
+    """Like Model.query.get_or_404 but served from the cache when possible; rows being deleted are gone already"""
+    obj = cached_get(model, ident)
+    if obj is None or getattr(obj, 'deleting', False):
+        abort(404)
+    return obj
+
+def is_server_member(user_id, server_id):
+    """Cached ServerMembership existence check"""
+    key = _membership_key(user_id, server_id)
+    is_member = cache.get(key)
+    if is_member is _MISSING:
+        generation = cache.generation(key)
+        is_member = db.session.query(
+            ServerMembership.query.filter_by(user_id=user_id, server_id=server_id).exists()
+        ).scalar()
+        cache.set(key, is_member, generation)
+    return is_member
+
+def accessible_server_ids(user_id):
+    """Ids of every server the user belongs to or owns, computed once and cached until it changes"""
+    key = _access_key(user_id)
+    server_ids = cache.get(key)
+    if server_ids is _MISSING:
+        generation = cache.generation(key)
+        member_ids = db.session.query(ServerMembership.server_id).filter(ServerMembership.user_id == user_id)
+        owned_ids = db.session.query(Server.id).filter(Server.owner_id == user_id)
+        server_ids = frozenset(row[0] for row in member_ids.union(owned_ids))
+        cache.set(key, server_ids, generation)
+    return server_ids
+
+def can_access_server(user_id, server_id):
+    """Member-or-owner access check without touching the database on the hot path"""
+    return server_id in accessible_server_ids(user_id)
+
+def invalidate(model, ident):
+    """Drop a cached row; call after changing it outside the ORM unit of work"""
+    cache.delete(_row_key(model, ident))
+
+def invalidate_membership(user_id, server_id):
+    """Drop cached membership and access data after a join, leave or kick"""
+    cache.delete(_membership_key(user_id, server_id))
+    invalidate_access(user_id)
+
+def invalidate_access(user_id):
+    """Drop the cached set of servers a user can open (e.g. after an owned server is removed)"""
+    cache.delete(_access_key(user_id))
+
+def _keys_for(obj):
+    keys = []
+    if isinstance(obj, CACHED_MODELS):
+        ident = inspect(obj).identity
+        if ident:
+            keys.append(_row_key(type(obj), ident[0]))
+    if isinstance(obj, Server):
+        # Creating, deleting or transferring a server changes its owners' access sets
+        history = inspect(obj).attrs.owner_id.history
+        for owner_id in history.sum():
+            keys.append(_access_key(owner_id))
+    elif isinstance(obj, ServerMembership):
+        keys.append(_membership_key(obj.user_id, obj.server_id))
+        keys.append(_access_key(obj.user_id))
+    return keys
+
+@event.listens_for(Server.owner_id, 'set', active_history=True)
+def _track_previous_owner(target, value, oldvalue, initiator):
+    """No-op; registering with active_history keeps the previous owner in the attribute history"""
+
+# Safety net: anything written through the ORM is invalidated once the transaction commits,
+# so a rolled-back change never evicts and a concurrent reader cannot re-cache pre-commit data.
+@event.listens_for(Session, 'after_flush')
+def _collect_invalidations(session, flush_context):
+    pending = session.info.setdefault('cache_invalidate', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        pending.update(_keys_for(obj))
+
+@event.listens_for(Session, 'after_commit')
+def _apply_invalidations(session):
+    for key in session.info.pop('cache_invalidate', ()):
+        cache.delete(key)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_invalidations(session):
+    session.info.pop('cache_invalidate', None)
@@ -1,216 +1,296 @@
 """
-Database configuration optimized for large-scale data storage (1TB+)
-Implements advanced PostgreSQL features for performance and scalability
+Database tuning for large-scale data storage (1TB+)
+`flask db-tune` detects the backend and applies server settings, table storage options and
+monitoring views idempotently: anything already in place is left alone and reported as such
 """
 
+import logging
+
+import click
 from sqlalchemy import text
+
 from app import db, app
-import logging
 
-def configure_database_for_large_scale():
-    """Configure PostgreSQL database for optimal large-scale performance"""
-    
-    with app.app_context():
-        try:
-            # Enable advanced PostgreSQL features for large datasets
-            optimization_queries = [
-                # Configure connection pooling and memory
-                "ALTER SYSTEM SET shared_buffers = '4GB';",
-                "ALTER SYSTEM SET effective_cache_size = '12GB';",
-                "ALTER SYSTEM SET maintenance_work_mem = '1GB';",
-                "ALTER SYSTEM SET checkpoint_completion_target = 0.9;",
-                "ALTER SYSTEM SET wal_buffers = '64MB';",
-                "ALTER SYSTEM SET default_statistics_target = 500;",
-                
-                # Optimize for large table operations
-                "ALTER SYSTEM SET random_page_cost = 1.1;",
-                "ALTER SYSTEM SET effective_io_concurrency = 200;",
-                "ALTER SYSTEM SET max_worker_processes = 8;",
-                "ALTER SYSTEM SET max_parallel_workers_per_gather = 4;",
-                "ALTER SYSTEM SET max_parallel_workers = 8;",
-                
-                # Enable compression for large data
-                "ALTER SYSTEM SET wal_compression = on;",
-                "ALTER SYSTEM SET log_min_duration_statement = 1000;",
-                
-                # Configure autovacuum for large tables
-                "ALTER SYSTEM SET autovacuum_max_workers = 4;",
-                "ALTER SYSTEM SET autovacuum_vacuum_scale_factor = 0.1;",
-                "ALTER SYSTEM SET autovacuum_analyze_scale_factor = 0.05;",
-            ]
-            
-            # Execute optimization queries (will require restart to take effect)
-            for query in optimization_queries:
-                try:
-                    db.session.execute(text(query))
-                    db.session.commit()
-                except Exception as e:
-                    logging.warning(f"Could not execute {query}: {e}")
-                    db.session.rollback()
-            
-            logging.info("Database optimization configuration applied")
-            
-        except Exception as e:
-            logging.error(f"Error configuring database: {e}")
-
-def create_large_data_tables():
-    """Create optimized table structures for large-scale data"""
-    # Skip expensive operations for faster startup
-    return
-    
-    with app.app_context():
-        try:
-            # Create message archive table for old messages (partition-like behavior)
-            archive_table_sql = """
-            CREATE TABLE IF NOT EXISTS message_archive (
-                id BIGSERIAL PRIMARY KEY,
-                original_message_id BIGINT NOT NULL,
-                content TEXT NOT NULL,
-                author_id VARCHAR NOT NULL,
-                channel_id INTEGER NOT NULL,
-                created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
-                archived_at TIMESTAMP WITHOUT TIME ZONE DEFAULT NOW(),
-                message_type VARCHAR(20) DEFAULT 'text'
-            );
-            
-            CREATE INDEX IF NOT EXISTS idx_archive_channel_date 
-            ON message_archive(channel_id, created_at);
-            
-            CREATE INDEX IF NOT EXISTS idx_archive_author_date 
-            ON message_archive(author_id, created_at);
-            """
-            
-            # Create file storage metadata table for external file references
-            file_metadata_sql = """
-            CREATE TABLE IF NOT EXISTS file_metadata (
-                id BIGSERIAL PRIMARY KEY,
-                file_hash VARCHAR(64) UNIQUE NOT NULL,
-                storage_path VARCHAR(1000) NOT NULL,
-                compression_type VARCHAR(20),
-                original_size BIGINT NOT NULL,
-                compressed_size BIGINT,
-                created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT NOW()
-            );
-            
-            CREATE INDEX IF NOT EXISTS idx_file_hash ON file_metadata(file_hash);
-            CREATE INDEX IF NOT EXISTS idx_file_size ON file_metadata(original_size);
-            """
-            
-            # Create user activity log for analytics
-            activity_log_sql = """
-            CREATE TABLE IF NOT EXISTS user_activity_log (
-                id BIGSERIAL PRIMARY KEY,
-                user_id VARCHAR NOT NULL,
-                activity_type VARCHAR(50) NOT NULL,
-                details JSONB,
-                created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT NOW()
-            );
-            
-            CREATE INDEX IF NOT EXISTS idx_activity_user_date 
-            ON user_activity_log(user_id, created_at);
-            
-            CREATE INDEX IF NOT EXISTS idx_activity_type_date 
-            ON user_activity_log(activity_type, created_at);
-            
-            CREATE INDEX IF NOT EXISTS idx_activity_details 
-            ON user_activity_log USING GIN(details);
-            """
-            
-            # Execute table creation
-            for sql in [archive_table_sql, file_metadata_sql, activity_log_sql]:
-                db.session.execute(text(sql))
-                db.session.commit()
-            
-            logging.info("Large-scale data tables created successfully")
-            
-        except Exception as e:
-            logging.error(f"Error creating large data tables: {e}")
-            db.session.rollback()
-
-def setup_table_compression():
-    """Enable table compression for large data storage"""
-    # Skip for faster startup
-    return
-    
-    with app.app_context():
-        try:
-            # Enable compression on large tables
-            compression_queries = [
-                "ALTER TABLE messages SET (toast_tuple_target = 128);",
-                "ALTER TABLE direct_messages SET (toast_tuple_target = 128);",
-                "ALTER TABLE shared_files SET (toast_tuple_target = 128);",
-                "ALTER TABLE message_archive SET (toast_tuple_target = 128);",
-            ]
-            
-            for query in compression_queries:
-                try:
-                    db.session.execute(text(query))
-                    db.session.commit()
-                except Exception as e:
-                    logging.warning(f"Could not apply compression: {e}")
-                    db.session.rollback()
-            
-            logging.info("Table compression configured")
-            
-        except Exception as e:
-            logging.error(f"Error setting up compression: {e}")
-
-def create_performance_monitoring():
-    """Set up performance monitoring for large-scale operations"""
-    # Skip for faster startup
-    return
-    
-    with app.app_context():
+# Server settings applied with ALTER SYSTEM; values are written the way SHOW reports them
+# so an already-tuned server compares equal and is left alone
+POSTGRES_SETTINGS = {
+    # Memory
+    'shared_buffers': '4GB',
+    'effective_cache_size': '12GB',
+    'maintenance_work_mem': '1GB',
+    'checkpoint_completion_target': '0.9',
+    'wal_buffers': '64MB',
+    'default_statistics_target': '500',
+
+    # Large table operations
+    'random_page_cost': '1.1',
+    'effective_io_concurrency': '200',
+    'max_worker_processes': '8',
+    'max_parallel_workers_per_gather': '4',
+    'max_parallel_workers': '8',
+
+    # WAL compression and slow statement logging
+    'wal_compression': 'on',
+    'log_min_duration_statement': '1s',
+
+    # Autovacuum for large tables
+    'autovacuum_max_workers': '4',
+    'autovacuum_vacuum_scale_factor': '0.1',
+    'autovacuum_analyze_scale_factor': '0.05',
+}
+
+# Tables with large text/blob columns: a lower TOAST target compresses and moves them out of line sooner
+COMPRESSED_TABLES = ('messages', 'direct_messages', 'shared_files', 'message_archive')
+TOAST_TUPLE_TARGET = 128
+
+POSTGRES_VIEWS = {
+    'table_sizes': """
+        SELECT
+            schemaname,
+            tablename,
+            pg_size_pretty(pg_total_relation_size(format('%I.%I', schemaname, tablename))) AS size,
+            pg_total_relation_size(format('%I.%I', schemaname, tablename)) AS size_bytes
+        FROM pg_tables
+        WHERE schemaname = current_schema()
+        ORDER BY size_bytes DESC
+    """,
+    'index_usage': """
+        SELECT
+            schemaname,
+            relname AS tablename,
+            indexrelname AS indexname,
+            idx_scan,
+            idx_tup_read,
+            idx_tup_fetch,
+            pg_size_pretty(pg_relation_size(indexrelid)) AS size
+        FROM pg_stat_user_indexes
+        ORDER BY idx_scan DESC
+    """,
+}
+
+# pg_stat_statements renamed its timing columns in PostgreSQL 13
+SLOW_QUERIES_VIEW = """
+    SELECT
+        query,
+        calls,
+        {total} AS total_time,
+        {mean} AS mean_time,
+        rows
+    FROM pg_stat_statements
+    WHERE {mean} > 1000
+    ORDER BY {mean} DESC
+"""
+
+def _new_report():
+    return {'changed': [], 'pending_restart': [], 'unchanged': [], 'skipped': [], 'failed': []}
+
+def _same_setting(current, wanted):
+    if current is None:
+        return False
+    current = str(current).strip().lower()
+    wanted = str(wanted).strip().lower()
+    if current == wanted:
+        return True
+    # Boolean-ish settings: wal_compression reports its algorithm (pglz) once enabled on 15+
+    if wanted in ('on', 'true'):
+        return current not in ('off', 'false', '0')
+    return False
+
+def _pending_settings(connection):
+    """Values written by ALTER SYSTEM that are waiting for a reload or restart"""
+    try:
+        rows = connection.execute(text(
+            "SELECT name, setting FROM pg_file_settings "
+            "WHERE sourcefile LIKE '%postgresql.auto.conf' AND error IS NULL"
+        ))
+        return {name: setting for name, setting in rows}
+    except Exception as e:
+        # pg_file_settings is superuser-only; without it a re-run may repeat ALTER SYSTEM
+        logging.info(f"Could not read pg_file_settings: {e}")
+        return {}
+
+def tune_postgres_settings(connection, report, dry_run=False):
+    """ALTER SYSTEM for settings that differ from POSTGRES_SETTINGS, then reload"""
+    pending = _pending_settings(connection)
+    contexts = dict(connection.execute(text(
+        "SELECT name, context FROM pg_settings WHERE name = ANY(:names)"
+    ), {'names': list(POSTGRES_SETTINGS)}).all())
+
+    reload_needed = False
+    for name, value in POSTGRES_SETTINGS.items():
+        if name not in contexts:
+            report['skipped'].append(f"setting {name} (unknown to this server version)")
+            continue
+        current = connection.execute(text(f"SHOW {name}")).scalar()
+        if _same_setting(current, value):
+            report['unchanged'].append(f"setting {name}")
+            continue
+        if _same_setting(pending.get(name), value):
+            report['pending_restart'].append(f"setting {name}: {current} -> {value}")
+            continue
+        if not dry_run:
+            try:
+                connection.execute(text(f"ALTER SYSTEM SET {name} = '{value}'"))
+            except Exception as e:
+                # Managed services (RDS, Neon, ...) refuse ALTER SYSTEM; tune through their console instead
+                report['failed'].append(f"setting {name}: {e.__class__.__name__}")
+                logging.warning(f"Could not set {name}: {e}")
+                continue
+        reload_needed = True
+        if contexts[name] == 'postmaster':
+            report['pending_restart'].append(f"setting {name}: {current} -> {value}")
+        else:
+            report['changed'].append(f"setting {name}: {current} -> {value}")
+
+    if reload_needed and not dry_run:
+        connection.execute(text("SELECT pg_reload_conf()"))
+
+def setup_table_compression(connection, report, dry_run=False):
+    """Lower toast_tuple_target on the large-payload tables that do not have it yet"""
+    option = f"toast_tuple_target={TOAST_TUPLE_TARGET}"
+    rows = connection.execute(text(
+        "SELECT c.relname, c.reloptions FROM pg_class c "
+        "JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE n.nspname = current_schema() AND c.relkind = 'r' AND c.relname = ANY(:tables)"
+    ), {'tables': list(COMPRESSED_TABLES)}).all()
+    existing = {name: options or [] for name, options in rows}
+
+    for table in COMPRESSED_TABLES:
+        if table not in existing:
+            report['skipped'].append(f"compression {table} (no such table)")
+        elif option in existing[table]:
+            report['unchanged'].append(f"compression {table}")
+        else:
+            if not dry_run:
+                connection.execute(text(f"ALTER TABLE {table} SET ({option})"))
+            report['changed'].append(f"compression {table}: {option}")
+
+def _slow_queries_view(connection, report, dry_run=False):
+    """slow_queries definition for the installed pg_stat_statements, installing it when available"""
+    installed = connection.execute(text(
+        "SELECT 1 FROM pg_extension WHERE extname = 'pg_stat_statements'"
+    )).scalar()
+    if not installed:
+        available = connection.execute(text(
+            "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_stat_statements'"
+        )).scalar()
+        if not available:
+            report['skipped'].append("view slow_queries (pg_stat_statements not available)")
+            return None
+        if dry_run:
+            report['changed'].append("extension pg_stat_statements: installed")
+            return SLOW_QUERIES_VIEW.format(total='total_exec_time', mean='mean_exec_time')
         try:
-            # Create performance monitoring views
-            monitoring_sql = """
-            -- View for table sizes
-            CREATE OR REPLACE VIEW table_sizes AS
-            SELECT 
-                schemaname,
-                tablename,
-                pg_size_pretty(pg_total_relation_size(schemaname||'.'||tablename)) as size,
-                pg_total_relation_size(schemaname||'.'||tablename) as size_bytes
-            FROM pg_tables 
-            WHERE schemaname = 'public'
-            ORDER BY pg_total_relation_size(schemaname||'.'||tablename) DESC;
-            
-            -- View for index usage
-            CREATE OR REPLACE VIEW index_usage AS
-            SELECT 
-                schemaname,
-                tablename,
-                indexname,
-                idx_scan,
-                idx_tup_read,
-                idx_tup_fetch
-            FROM pg_stat_user_indexes
-            ORDER BY idx_scan DESC;
-            
-            -- View for slow queries monitoring
-            CREATE OR REPLACE VIEW slow_queries AS
-            SELECT 
-                query,
-                calls,
-                total_time,
-                mean_time,
-                rows
-            FROM pg_stat_statements
-            WHERE mean_time > 1000
-            ORDER BY mean_time DESC;
-            """
-            
-            db.session.execute(text(monitoring_sql))
-            db.session.commit()
-            
-            logging.info("Performance monitoring views created")
-            
+            connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_stat_statements"))
         except Exception as e:
-            logging.warning(f"Could not create monitoring views: {e}")
-            db.session.rollback()
-
-if __name__ == "__main__":
-    configure_database_for_large_scale()
-    create_large_data_tables()
-    setup_table_compression()
-    create_performance_monitoring()
\ No newline at end of file
+            report['failed'].append(f"extension pg_stat_statements: {e.__class__.__name__}")
+            logging.warning(f"Could not install pg_stat_statements: {e}")
+            return None
+        report['changed'].append("extension pg_stat_statements: installed")
+
+    renamed = connection.execute(text(
+        "SELECT 1 FROM information_schema.columns "
+        "WHERE table_name = 'pg_stat_statements' AND column_name = 'mean_exec_time'"
+    )).scalar()
+    if renamed:
+        return SLOW_QUERIES_VIEW.format(total='total_exec_time', mean='mean_exec_time')
+    return SLOW_QUERIES_VIEW.format(total='total_time', mean='mean_time')
+
+def _view_definition(connection, name):
+    return connection.execute(text(
+        "SELECT pg_get_viewdef(c.oid) FROM pg_class c "
+        "JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE n.nspname = current_schema() AND c.relkind = 'v' AND c.relname = :name"
+    ), {'name': name}).scalar()
+
+def _ensure_view(connection, name, select_sql, report, dry_run=False):
+    """Create or update a view, reporting whether its definition actually changed"""
+    select_sql = select_sql.strip()
+    before = _view_definition(connection, name)
+    if dry_run:
+        if before is None:
+            report['changed'].append(f"view {name}: created")
+        else:
+            report['unchanged'].append(f"view {name} (definition compared on apply)")
+        return
+    try:
+        connection.execute(text(f"CREATE OR REPLACE VIEW {name} AS {select_sql}"))
+    except Exception:
+        # CREATE OR REPLACE cannot drop or retype columns; rebuild the view instead
+        connection.execute(text(f"DROP VIEW IF EXISTS {name}"))
+        connection.execute(text(f"CREATE VIEW {name} AS {select_sql}"))
+    after = _view_definition(connection, name)
+    if before is None:
+        report['changed'].append(f"view {name}: created")
+    elif before != after:
+        report['changed'].append(f"view {name}: updated")
+    else:
+        report['unchanged'].append(f"view {name}")
+
+def create_performance_monitoring(connection, report, dry_run=False):
+    """table_sizes, index_usage and (with pg_stat_statements) slow_queries views"""
+    if connection.dialect.name != 'postgresql':
+        # SQLite keeps no size or usage statistics a view could expose (dbstat is barred from views)
+        for name in ('table_sizes', 'index_usage', 'slow_queries'):
+            report['skipped'].append(f"view {name} (PostgreSQL only)")
+        return
+    for name, select_sql in POSTGRES_VIEWS.items():
+        _ensure_view(connection, name, select_sql, report, dry_run)
+    slow_queries_sql = _slow_queries_view(connection, report, dry_run)
+    if slow_queries_sql:
+        _ensure_view(connection, 'slow_queries', slow_queries_sql, report, dry_run)
+
+def tune_sqlite(connection, report, dry_run=False):
+    """Collect planner statistics; the WAL/synchronous pragmas are set per connection in db_engine"""
+    has_stats = connection.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'"
+    )).scalar()
+    if not has_stats:
+        if not dry_run:
+            connection.execute(text("ANALYZE"))
+        report['changed'].append("statistics: ANALYZE (first run)")
+    else:
+        if not dry_run:
+            # Re-analyzes only the tables whose statistics have gone stale
+            connection.execute(text("PRAGMA optimize"))
+        report['unchanged'].append("statistics (PRAGMA optimize)")
+
+    journal_mode = connection.execute(text("PRAGMA journal_mode")).scalar()
+    if journal_mode != 'wal':
+        report['failed'].append(f"journal_mode is {journal_mode}, expected wal")
+
+def tune_database(engine=None, dry_run=False):
+    """Apply every tuning step for the current backend; returns the change report"""
+    engine = engine or db.engine
+    report = _new_report()
+    # ALTER SYSTEM and CREATE EXTENSION refuse to run inside a transaction block
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        backend = connection.dialect.name
+        if backend == 'postgresql':
+            tune_postgres_settings(connection, report, dry_run)
+            setup_table_compression(connection, report, dry_run)
+        elif backend == 'sqlite':
+            tune_sqlite(connection, report, dry_run)
+        else:
+            report['skipped'].append(f"backend {backend} has no tuning profile")
+            return report
+        create_performance_monitoring(connection, report, dry_run)
+    return report
+
+@app.cli.command('db-tune')
+@click.option('--dry-run', is_flag=True, help='Report what would change without applying it')
+def db_tune_command(dry_run):
+    """Apply database settings, storage options and monitoring views for this backend"""
+    report = tune_database(dry_run=dry_run)
+    verb = 'would change' if dry_run else 'changed'
+    for item in report['changed']:
+        click.echo(f"{verb}  {item}")
+    for item in report['pending_restart']:
+        click.echo(f"restart required  {item}")
+    for item in report['skipped']:
+        click.echo(f"skipped  {item}")
+    for item in report['failed']:
+        click.echo(f"FAILED  {item}", err=True)
+    click.echo(f"{len(report['changed'])} changed, {len(report['unchanged'])} already in place")
+    if report['failed']:
+        raise SystemExit(1)
@@ -0,0 +1,311 @@
+"""
+Synthetic data generator for CommunicationX
+Bulk-loads large, realistic fixtures: Zipf-distributed server and channel activity, a friendship
+graph that direct messages follow, reactions (with their summary rows) and read receipts.
+Rows go in with executemany, or COPY on PostgreSQL, in committed batches. Timestamps are anchored to EPOCH and ids start
+after the existing rows, so the same seed into an empty database always produces the same dataset.
+Generate into a scratch database:
+
+    flask datagen --users 100000 --servers 2000 --messages 10000000 --seed 7
+"""
+
+import csv
+import io
+import logging
+import random
+import time
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+import click
+from sqlalchemy import func, select, text
+
+from app import app, db
+from models import (User, Friendship, Server, Channel, ServerMembership, Message, DirectMessage,
+                    MessageReaction, MessageReactionCount, MessageReadStatus)
+
+DEFAULT_BATCH_SIZE = 10000
+
+# Generated history ends here rather than at now(), so reruns with one seed match row for row
+EPOCH = datetime(2025, 1, 1)
+
+EMOJIS = ['👍', '❤️', '😂', '🔥', '🎉', '😮', '😢', '👀', '✅', '🙏', '💯', '🤔']
+
+WORDS = (
+    'the a to and of is it you that in we for on this with be are have not do can just so but '
+    'was what get if like will about all out up one now time when know think good make see '
+    'deploy build server channel call voice message bug fix test review merge release tonight '
+    'tomorrow meeting lunch game stream music link screen share update docs ship ready done'
+).split()
+
+class ZipfSampler:
+    """Draws indexes 0..n-1 with P(i) proportional to 1 / (i + 1) ** exponent, or to explicit weights"""
+
+    def __init__(self, n=0, exponent=1.1, rng=None, weights=None):
+        if weights is None:
+            weights = [1.0 / (i + 1) ** exponent for i in range(n)]
+        self._cumulative = list(accumulate(weights))
+        self._total = self._cumulative[-1] if self._cumulative else 0.0
+        self.rng = rng or random.Random()
+
+    def __len__(self):
+        return len(self._cumulative)
+
+    def sample(self):
+        return bisect_left(self._cumulative, self.rng.random() * self._total)
+
+class BulkWriter:
+    """Writes row tuples to a table with COPY (psycopg2) or executemany, filling column defaults"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.use_copy = connection.dialect.name == 'postgresql' and connection.dialect.driver == 'psycopg2'
+        self.rows_written = {}
+
+    @staticmethod
+    def _scalar_defaults(table, provided):
+        """Static column defaults for the columns the generator does not set, so COPY matches the ORM"""
+        defaults = {}
+        for column in table.columns:
+            if column.name in provided or column.default is None:
+                continue
+            if column.default.is_scalar:
+                defaults[column.name] = column.default.arg
+        return defaults
+
+    def write(self, model, columns, rows):
+        table = model.__table__
+        if not rows:
+            return
+        defaults = self._scalar_defaults(table, set(columns))
+        all_columns = list(columns) + list(defaults)
+        default_values = tuple(defaults.values())
+
+        if self.use_copy:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for row in rows:
+                writer.writerow(tuple(row) + default_values)
+            buffer.seek(0)
+            cursor = self.connection.connection.cursor()
+            try:
+                cursor.copy_expert(
+                    f"COPY {table.name} ({', '.join(all_columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+            finally:
+                cursor.close()
+        else:
+            self.connection.execute(
+                table.insert(), [dict(zip(all_columns, tuple(row) + default_values)) for row in rows])
+        self.rows_written[table.name] = self.rows_written.get(table.name, 0) + len(rows)
+
+def _next_id(connection, model):
+    return (connection.execute(select(func.max(model.__table__.c.id))).scalar() or 0) + 1
+
+def _reset_sequences(connection, models):
+    """Explicit ids bypass PostgreSQL sequences; move them past the generated rows"""
+    if connection.dialect.name != 'postgresql':
+        return
+    for model in models:
+        table = model.__table__.name
+        connection.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+            f"COALESCE((SELECT MAX(id) FROM {table}), 0) + 1, false)"
+        ))
+
+def _sentence(rng):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 24)))
+
+def _skewed(rng, items, skew=2.0):
+    """Pick from items favouring the front: a cheap power-law stand-in for per-server activity"""
+    return items[int(len(items) * rng.random() ** skew)]
+
+def generate(users=1000, servers=50, channels_per_server=4, messages=100000, dms=20000,
+             friends_per_user=8, servers_per_user=3, reaction_rate=0.15, read_rate=0.3,
+             zipf_exponent=1.1, days=180, seed=1, batch_size=DEFAULT_BATCH_SIZE, engine=None, progress=None):
+    """Generate a dataset into the configured database; returns ids and per-table row counts
+
+    Low ids are the popular ones: user 0 has the most friends and memberships, server 0 the most
+    members and traffic, and the first channel of each server is its busiest.
+    """
+    engine = engine or db.engine
+    rng = random.Random(seed)
+    end = EPOCH
+    start = end - timedelta(days=days)
+    span = (end - start).total_seconds()
+    progress = progress or (lambda message: None)
+    started = time.perf_counter()
+
+    with engine.connect() as connection:
+        writer = BulkWriter(connection)
+
+        # Users
+        first_user = _next_id(connection, User)
+        user_ids = list(range(first_user, first_user + users))
+        for offset in range(0, users, batch_size):
+            writer.write(User, ('id', 'username', 'email', 'first_name', 'status', 'created_at', 'last_seen',
+                                'updated_at'), [
+                (user_id, f'user{user_id}', f'user{user_id}@example.test', f'User{user_id}',
+                 rng.choice(('online', 'away', 'offline')),
+                 start + timedelta(seconds=rng.random() * span * 0.5), end, end)
+                for user_id in user_ids[offset:offset + batch_size]
+            ])
+        connection.commit()
+        progress(f"users: {users}")
+
+        # Friendships: popular users collect most edges; DMs then follow the edges
+        popularity = ZipfSampler(users, zipf_exponent, rng)
+        pairs = set()
+        for user_id in user_ids:
+            for _ in range(rng.randint(0, friends_per_user * 2)):
+                friend_id = user_ids[popularity.sample()]
+                if friend_id != user_id:
+                    pairs.add((min(user_id, friend_id), max(user_id, friend_id)))
+        edges = sorted(pairs)
+        rng.shuffle(edges)
+        for offset in range(0, len(edges), batch_size):
+            writer.write(Friendship, ('user_id', 'friend_id', 'status', 'created_at', 'accepted_at'), [
+                (a, b, 'accepted', start, start) for a, b in edges[offset:offset + batch_size]
+            ])
+        connection.commit()
+        progress(f"friendships: {len(edges)}")
+
+        # Servers and memberships: a few huge servers, a long tail of small ones
+        first_server = _next_id(connection, Server)
+        server_ids = list(range(first_server, first_server + servers))
+        writer.write(Server, ('id', 'name', 'owner_id', 'is_public', 'created_at'), [
+            (server_id, f'Server {server_id}', user_ids[popularity.sample()], False, start)
+            for server_id in server_ids
+        ])
+        server_popularity = ZipfSampler(servers, zipf_exponent, rng)
+        members = {server_id: set() for server_id in server_ids}
+        for user_id in user_ids:
+            for _ in range(max(1, int(rng.expovariate(1 / servers_per_user)))):
+                members[server_ids[server_popularity.sample()]].add(user_id)
+        membership_rows = [
+            (user_id, server_id, start + timedelta(seconds=rng.random() * span * 0.5))
+            for server_id, user_set in members.items() for user_id in sorted(user_set)
+        ]
+        for offset in range(0, len(membership_rows), batch_size):
+            writer.write(ServerMembership, ('user_id', 'server_id', 'joined_at'), membership_rows[offset:offset + batch_size])
+        members = {server_id: sorted(user_set) or [user_ids[0]] for server_id, user_set in members.items()}
+        connection.commit()
+        progress(f"servers: {servers}, memberships: {len(membership_rows)}")
+
+        # Channels, weighted by server popularity and position within the server
+        first_channel = _next_id(connection, Channel)
+        channel_rows = []
+        channel_weights = []
+        for rank, server_id in enumerate(server_ids):
+            for position in range(max(1, int(rng.expovariate(1 / channels_per_server)))):
+                channel_id = first_channel + len(channel_rows)
+                channel_rows.append((channel_id, 'general' if position == 0 else f'channel-{position}',
+                                     server_id, 'text', position, start))
+                channel_weights.append(1.0 / (rank + 1) ** zipf_exponent / (position + 1) ** zipf_exponent)
+        for offset in range(0, len(channel_rows), batch_size):
+            writer.write(Channel, ('id', 'name', 'server_id', 'channel_type', 'position', 'created_at'),
+                         channel_rows[offset:offset + batch_size])
+        connection.commit()
+        channel_activity = ZipfSampler(weights=channel_weights, rng=rng)
+        channels = [(row[0], row[2]) for row in channel_rows]
+        progress(f"channels: {len(channels)}")
+
+        # Messages in time order, each batch followed by its reactions and read receipts
+        first_message = _next_id(connection, Message)
+        emoji_popularity = ZipfSampler(len(EMOJIS), 1.3, rng)
+        last_in_channel = {}
+        for offset in range(0, messages, batch_size):
+            message_rows = []
+            reaction_rows = []
+            count_rows = []
+            read_rows = []
+            for i in range(offset, min(offset + batch_size, messages)):
+                message_id = first_message + i
+                channel_id, server_id = channels[channel_activity.sample()]
+                server_members = members[server_id]
+                created_at = start + timedelta(seconds=span * (i + rng.random()) / messages)
+                reply_to = last_in_channel.get(channel_id) if rng.random() < 0.05 else None
+                last_in_channel[channel_id] = message_id
+                message_rows.append((message_id, _sentence(rng), _skewed(rng, server_members), channel_id,
+                                     created_at, reply_to, 'text', 'sent', rng.random() < 0.001))
+
+                if rng.random() < reaction_rate:
+                    counts = {}
+                    reacted = set()
+                    for _ in range(min(len(server_members), 1 + int(rng.expovariate(0.5)))):
+                        user_id = rng.choice(server_members)
+                        emoji = EMOJIS[emoji_popularity.sample()]
+                        if (user_id, emoji) in reacted:
+                            continue
+                        reacted.add((user_id, emoji))
+                        counts[emoji] = counts.get(emoji, 0) + 1
+                        reaction_rows.append((message_id, user_id, emoji, created_at))
+                    count_rows.extend((message_id, emoji, count) for emoji, count in counts.items())
+
+                if rng.random() < read_rate:
+                    readers = rng.sample(server_members, min(len(server_members), 1 + int(rng.expovariate(0.3))))
+                    read_rows.extend((message_id, user_id, created_at + timedelta(minutes=rng.random() * 600))
+                                     for user_id in readers)
+
+            writer.write(Message, ('id', 'content', 'author_id', 'channel_id', 'created_at', 'reply_to_id',
+                                   'message_type', 'status', 'is_pinned'), message_rows)
+            writer.write(MessageReaction, ('message_id', 'user_id', 'emoji', 'created_at'), reaction_rows)
+            writer.write(MessageReactionCount, ('message_id', 'emoji', 'count'), count_rows)
+            writer.write(MessageReadStatus, ('message_id', 'user_id', 'read_at'), read_rows)
+            connection.commit()
+            progress(f"messages: {min(offset + batch_size, messages)}/{messages}")
+
+        # Direct messages between friends, busiest conversations first
+        first_dm = _next_id(connection, DirectMessage)
+        if edges:
+            edge_activity = ZipfSampler(len(edges), zipf_exponent, rng)
+            for offset in range(0, dms, batch_size):
+                dm_rows = []
+                for i in range(offset, min(offset + batch_size, dms)):
+                    a, b = edges[edge_activity.sample()]
+                    sender, recipient = (a, b) if rng.random() < 0.5 else (b, a)
+                    created_at = start + timedelta(seconds=span * (i + rng.random()) / dms)
+                    read_at = created_at + timedelta(minutes=rng.random() * 120) if rng.random() < 0.8 else None
+                    dm_rows.append((first_dm + i, _sentence(rng), sender, recipient, created_at, read_at,
+                                    'read' if read_at else 'delivered'))
+                writer.write(DirectMessage, ('id', 'content', 'sender_id', 'recipient_id', 'created_at',
+                                             'read_at', 'status'), dm_rows)
+                connection.commit()
+            progress(f"direct messages: {dms}")
+
+        _reset_sequences(connection, (User, Server, Channel, Message, DirectMessage))
+        connection.commit()
+        connection.execute(text("ANALYZE"))
+        connection.commit()
+
+    elapsed = time.perf_counter() - started
+    logging.info(f"Generated {sum(writer.rows_written.values())} rows in {elapsed:.1f}s")
+    return {
+        'user_ids': user_ids,
+        'server_ids': server_ids,
+        'channels': channels,
+        'message_ids': range(first_message, first_message + messages),
+        'rows': writer.rows_written,
+        'seconds': round(elapsed, 2),
+    }
+
+@app.cli.command('datagen')
+@click.option('--users', default=1000, show_default=True)
+@click.option('--servers', default=50, show_default=True)
+@click.option('--channels-per-server', default=4, show_default=True, help='Mean channels per server')
+@click.option('--messages', default=100000, show_default=True)
+@click.option('--dms', default=20000, show_default=True)
+@click.option('--friends-per-user', default=8, show_default=True)
+@click.option('--servers-per-user', default=3, show_default=True, help='Mean memberships per user')
+@click.option('--reaction-rate', default=0.15, show_default=True, help='Fraction of messages with reactions')
+@click.option('--read-rate', default=0.3, show_default=True, help='Fraction of messages with read receipts')
+@click.option('--zipf', 'zipf_exponent', default=1.1, show_default=True, help='Skew of server/channel/DM activity')
+@click.option('--days', default=180, show_default=True, help='History span')
+@click.option('--seed', default=1, show_default=True)
+@click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True)
+def datagen_command(**options):
+    """Bulk-generate a synthetic dataset (use a scratch database)"""
+    result = generate(progress=click.echo, **options)
+    for table, count in sorted(result['rows'].items()):
+        click.echo(f"{count:>12}  {table}")
+    click.echo(f"generated in {result['seconds']}s")
@@ -0,0 +1,76 @@
+"""
+Engine configuration for CommunicationX
+Builds the database URL and engine options from the environment: pooled, pre-pinged
+connections for PostgreSQL and WAL-mode SQLite with a busy timeout for local runs
+"""
+
+import logging
+import os
+import sqlite3
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DEFAULT_DATABASE_URL = "sqlite:///communicationx.db"
+
+def database_url():
+    """DATABASE_URL from the environment, normalised for SQLAlchemy"""
+    url = os.environ.get("DATABASE_URL") or DEFAULT_DATABASE_URL
+    # Heroku/Replit style URLs use the scheme SQLAlchemy 1.4+ no longer accepts
+    if url.startswith("postgres://"):
+        url = "postgresql://" + url[len("postgres://"):]
+    return url
+
+def engine_options(url):
+    """SQLALCHEMY_ENGINE_OPTIONS for the given backend"""
+    if url.startswith("sqlite"):
+        return {
+            "connect_args": {
+                # Seconds the driver waits on a locked database before raising
+                "timeout": int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", 5000)) / 1000,
+                # Flask-SocketIO threads share pooled connections
+                "check_same_thread": False,
+            },
+        }
+
+    if url.startswith("postgresql"):
+        return {
+            "pool_size": int(os.environ.get("DB_POOL_SIZE", 10)),
+            "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", 20)),
+            "pool_timeout": int(os.environ.get("DB_POOL_TIMEOUT", 30)),
+            # Drop connections the server or a proxy closed while idle
+            "pool_pre_ping": True,
+            "pool_recycle": int(os.environ.get("DB_POOL_RECYCLE", 1800)),
+            "connect_args": {"application_name": os.environ.get("DB_APPLICATION_NAME", "communicationx")},
+        }
+
+    return {}
+
+def configure_database(app):
+    """Set the database URI, engine options and optional read replica on the Flask config"""
+    url = database_url()
+    app.config["SQLALCHEMY_DATABASE_URI"] = url
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(url)
+    logging.info(f"Database backend: {url.split(':', 1)[0]}")
+
+    # Read-only views are routed here by db_routing.RoutingSession
+    replica_url = os.environ.get("REPLICA_DATABASE_URL")
+    if replica_url:
+        if replica_url.startswith("postgres://"):
+            replica_url = "postgresql://" + replica_url[len("postgres://"):]
+        app.config["SQLALCHEMY_BINDS"] = {"replica": {"url": replica_url, **engine_options(replica_url)}}
+    app.config["REPLICA_STICKY_SECONDS"] = float(os.environ.get("REPLICA_STICKY_SECONDS", 5))
+
+@event.listens_for(Engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Per-connection SQLite tuning: WAL lets readers run alongside a writer"""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))}")
+        cursor.execute(f"PRAGMA mmap_size={int(os.environ.get('SQLITE_MMAP_SIZE', 268435456))}")
+    finally:
+        cursor.close()
@@ -0,0 +1,237 @@
+"""
+Query accounting for CommunicationX
+Counts SQL statements per block or per request, enforces page query budgets, and profiles
+sampled requests: statement count, DB time and the slowest statements (normalized SQL),
+reported as a Server-Timing header and aggregated for the admin query-stats endpoint
+"""
+
+import heapq
+import logging
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Maximum number of SQL statements each page may issue, keyed by endpoint.
+# These budgets must not depend on how many messages or members a page shows.
+PAGE_QUERY_BUDGETS = {
+    'home': 4,
+    'server_view': 11,  # includes the message_archive read merged into every history page
+    'dm_conversation': 8,
+}
+
+# Counters active in the current thread or greenlet (gevent gives each greenlet its own context),
+# so a block only counts its own statements, not those of concurrent requests and job workers
+_active_counters = ContextVar('active_query_counters', default=())
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised when a block or page issues more SQL statements than allowed"""
+
+    def __init__(self, label, budget, statements):
+        self.label = label
+        self.budget = budget
+        self.statements = statements
+        listing = '\n'.join(f"  {i + 1}. {sql}" for i, sql in enumerate(statements))
+        super().__init__(
+            f"{label} issued {len(statements)} queries (budget {budget}):\n{listing}"
+        )
+
+class QueryCounter:
+    """Collects every SQL statement executed while it is active"""
+
+    def __init__(self):
+        self.statements = []
+        self._token = None
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def __enter__(self):
+        self._token = _active_counters.set(_active_counters.get() + (self,))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _active_counters.reset(self._token)
+        self._token = None
+        return False
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _record_statement(conn, cursor, statement, parameters, context, executemany):
+    """Feed executed statements to active counters and the current request"""
+    for counter in _active_counters.get():
+        counter.statements.append(statement)
+    if has_request_context() and 'query_log' in g:
+        g.query_log.append(statement)
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%\(\w+\)s|(?<!:):\w+|\?")
+_VALUE_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+def normalize_sql(statement):
+    """Statement shape with literals and placeholders folded, so one query pattern aggregates as one entry"""
+    statement = _WHITESPACE.sub(' ', statement).strip()
+    statement = _LITERALS.sub('?', statement)
+    # IN lists of any length are the same query
+    return _VALUE_LISTS.sub('(...)', statement)
+
+class RequestProfile:
+    """Statement count, DB time and the slowest statements of one request"""
+
+    def __init__(self, top_n):
+        self.top_n = top_n
+        self.count = 0
+        self.total_ms = 0.0
+        self._slowest = []  # min-heap of (ms, statement)
+
+    def record(self, statement, elapsed_ms):
+        self.count += 1
+        self.total_ms += elapsed_ms
+        if len(self._slowest) < self.top_n:
+            heapq.heappush(self._slowest, (elapsed_ms, statement))
+        elif elapsed_ms > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, (elapsed_ms, statement))
+
+    @property
+    def slowest(self):
+        """[(ms, normalized sql)], slowest first"""
+        return [(ms, normalize_sql(sql)) for ms, sql in sorted(self._slowest, reverse=True)]
+
+class QueryStats:
+    """Process-wide aggregates of sampled requests, by endpoint and by normalized statement"""
+
+    def __init__(self, max_statements=500):
+        self.max_statements = max_statements
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.endpoints = {}
+            self.statements = {}
+            self.dropped_statements = 0
+
+    def add(self, endpoint, profile):
+        slowest = profile.slowest
+        with self._lock:
+            entry = self.endpoints.setdefault(endpoint, {'requests': 0, 'queries': 0, 'db_ms': 0.0, 'max_queries': 0})
+            entry['requests'] += 1
+            entry['queries'] += profile.count
+            entry['db_ms'] += profile.total_ms
+            entry['max_queries'] = max(entry['max_queries'], profile.count)
+            for elapsed_ms, sql in slowest:
+                stats = self.statements.get(sql)
+                if stats is None:
+                    if len(self.statements) >= self.max_statements:
+                        self.dropped_statements += 1
+                        continue
+                    stats = self.statements[sql] = {'calls': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'endpoint': endpoint}
+                stats['calls'] += 1
+                stats['total_ms'] += elapsed_ms
+                stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+
+    def snapshot(self, limit=20):
+        """Per-endpoint averages and the statements with the highest total time"""
+        with self._lock:
+            endpoints = {
+                name: {
+                    'requests': entry['requests'],
+                    'avg_queries': round(entry['queries'] / entry['requests'], 2),
+                    'max_queries': entry['max_queries'],
+                    'avg_db_ms': round(entry['db_ms'] / entry['requests'], 2),
+                }
+                for name, entry in self.endpoints.items()
+            }
+            statements = sorted(self.statements.items(), key=lambda item: item[1]['total_ms'], reverse=True)[:limit]
+            return {
+                'endpoints': endpoints,
+                'slowest_statements': [
+                    {'sql': sql, 'calls': stats['calls'], 'total_ms': round(stats['total_ms'], 2),
+                     'max_ms': round(stats['max_ms'], 2), 'endpoint': stats['endpoint']}
+                    for sql, stats in statements
+                ],
+                'dropped_statements': self.dropped_statements,
+            }
+
+query_stats = QueryStats()
+
+# Statements slower than this are logged whether or not the request was sampled
+_slow_query_ms = 250.0
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _stop_timer(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('query_start_time')
+    if not starts:
+        return
+    elapsed_ms = (time.perf_counter() - starts.pop()) * 1000
+    if elapsed_ms >= _slow_query_ms:
+        endpoint = request.endpoint if has_request_context() else None
+        logging.warning(f"Slow query ({elapsed_ms:.1f}ms, {endpoint}): {normalize_sql(statement)}")
+    if has_request_context():
+        profile = g.get('query_profile')
+        if profile is not None:
+            profile.record(statement, elapsed_ms)
+
+@contextmanager
+def query_budget(budget, label='block'):
+    """Fail with QueryBudgetExceeded if the block runs more than `budget` queries"""
+    with QueryCounter() as counter:
+        yield counter
+    if counter.count > budget:
+        raise QueryBudgetExceeded(label, budget, counter.statements)
+
+def init_query_budgets(app):
+    """Check PAGE_QUERY_BUDGETS on every request when QUERY_BUDGET_ENFORCE is set"""
+
+    @app.before_request
+    def _start_query_log():
+        if app.config.get('QUERY_BUDGET_ENFORCE'):
+            g.query_log = []
+
+    @app.after_request
+    def _check_query_budget(response):
+        statements = g.pop('query_log', None)
+        budget = PAGE_QUERY_BUDGETS.get(request.endpoint)
+        if statements is None or budget is None or len(statements) <= budget:
+            return response
+        error = QueryBudgetExceeded(request.endpoint, budget, statements)
+        if app.config.get('QUERY_BUDGET_ENFORCE') == 'warn':
+            logging.warning(str(error))
+            return response
+        raise error
+
+def init_query_profiling(app):
+    """Profile a QUERY_PROFILE_SAMPLE_RATE fraction of requests and log statements over SLOW_QUERY_MS"""
+    global _slow_query_ms
+    _slow_query_ms = float(app.config.get('SLOW_QUERY_MS', 250))
+    sample_rate = float(app.config.get('QUERY_PROFILE_SAMPLE_RATE', 0))
+    top_n = int(app.config.get('QUERY_PROFILE_TOP_N', 5))
+
+    @app.before_request
+    def _start_query_profile():
+        if sample_rate and random.random() < sample_rate:
+            g.query_profile = RequestProfile(top_n)
+            g.query_profile_started = time.perf_counter()
+
+    @app.after_request
+    def _finish_query_profile(response):
+        profile = g.pop('query_profile', None)
+        if profile is None:
+            return response
+        total_ms = (time.perf_counter() - g.pop('query_profile_started')) * 1000
+        query_stats.add(request.endpoint or request.path, profile)
+        response.headers.add(
+            'Server-Timing',
+            f'db;dur={profile.total_ms:.1f};desc="{profile.count} queries", app;dur={total_ms:.1f}'
+        )
+        return response
@@ -0,0 +1,71 @@
+"""
+Read-replica routing for CommunicationX
+Read-only views opt in with @read_replica, and history reads in orm_repository with
+replica_reads(); their SELECTs go to the 'replica' bind when one is configured
+(REPLICA_DATABASE_URL), while writes and anything after the user's own recent write stay on
+the primary
+"""
+
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, g, has_request_context, session as flask_session
+from flask_sqlalchemy.session import Session as FlaskSession
+from sqlalchemy import event
+from sqlalchemy.sql import Select
+
+REPLICA_BIND_KEY = 'replica'
+
+# Key in the Flask session holding the time until which this user's reads stay on the primary
+STICKY_SESSION_KEY = '_primary_until'
+
+class RoutingSession(FlaskSession):
+    """Flask-SQLAlchemy session that can send read-only SELECTs to a replica engine"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self._use_replica(clause):
+            replica = self._db.engines.get(REPLICA_BIND_KEY)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _use_replica(self, clause):
+        if self._flushing or self.info.get('wrote'):
+            return False
+        if not isinstance(clause, Select):
+            return False
+        if not (has_request_context() and g.get('read_replica')):
+            return False
+        return flask_session.get(STICKY_SESSION_KEY, 0) < time.time()
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _mark_write(session, flush_context):
+    """Once this session writes, its remaining reads must see those writes"""
+    session.info['wrote'] = True
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _start_read_your_writes_window(session):
+    """Keep the user's reads on the primary long enough for the replica to catch up"""
+    wrote = session.info.pop('wrote', False)
+    if wrote and has_request_context() and REPLICA_BIND_KEY in session._db.engines:
+        window = current_app.config.get('REPLICA_STICKY_SECONDS', 5)
+        flask_session[STICKY_SESSION_KEY] = time.time() + window
+
+@contextmanager
+def replica_reads():
+    """Route SELECTs inside the block to the replica (subject to stickiness)"""
+    previous = g.get('read_replica', False)
+    g.read_replica = True
+    try:
+        yield
+    finally:
+        g.read_replica = previous
+
+def read_replica(view):
+    """Decorator for read-only views such as analytics dashboards"""
+    @wraps(view)
+    def decorated_function(*args, **kwargs):
+        with replica_reads():
+            return view(*args, **kwargs)
+    return decorated_function
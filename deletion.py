@@ -0,0 +1,199 @@
+"""
+Chunked deletion of servers and users
+db.session.delete() made SQLAlchemy load every dependent row (channels, messages, reactions,
+file blobs) into memory to cascade. Instead the row is flagged deleting, which hides it at
+once, and a background job removes everything that references it bottom-up: rows are picked
+by primary key in batches of DELETE_BATCH_SIZE and removed with set-based DELETEs, one short
+transaction per batch, with progress recorded on the job. Set-based DELETEs skip the session's
+flush hooks, so each batch drops its cached rows, fragments and access sets itself once committed
+"""
+
+import logging
+from collections import Counter
+from functools import lru_cache, partial
+
+from sqlalchemy import func, select, update
+
+from app import db
+from cache import invalidate, invalidate_access, invalidate_membership
+from fragments import invalidate_dm, invalidate_message
+from jobs import PRIORITY_LOW, enqueue, job, report_progress
+from models import Channel, MessageArchive, ServerMembership, MessageReaction, MessageReactionCount, Server, User
+
+DELETE_BATCH_SIZE = 500
+
+# Nullable references that still mean ownership: these rows are deleted, not detached
+OWNED_NULLABLE = {('flask_dance_oauth', 'user_id')}
+
+# (column, parent table) references without a foreign key constraint
+EXTRA_REFERENCES = [(MessageArchive.__table__.c.channel_id, Channel.__table__)]
+
+@lru_cache(maxsize=None)
+def _references(table):
+    """Every column that points at rows of table"""
+    columns = [
+        column
+        for child in db.metadata.sorted_tables
+        for column in child.columns
+        if any(fk.column.table is table for fk in column.foreign_keys)
+    ]
+    return tuple(columns + [column for column, parent in EXTRA_REFERENCES if parent is table])
+
+def _single_pk(table):
+    columns = list(table.primary_key.columns)
+    return columns[0] if len(columns) == 1 else None
+
+def _release_reaction_counts(session, reaction_ids):
+    """Reactions removed without their message (user deletion) must leave the summary counts"""
+    counts = MessageReactionCount.__table__
+    reactions = MessageReaction.__table__
+    removed = (
+        select(func.count()).select_from(reactions)
+        .where(reactions.c.id.in_(reaction_ids),
+               reactions.c.message_id == counts.c.message_id,
+               reactions.c.emoji == counts.c.emoji)
+        .scalar_subquery()
+    )
+    affected = select(reactions.c.message_id).where(reactions.c.id.in_(reaction_ids))
+    session.execute(
+        update(counts).where(counts.c.message_id.in_(affected)).values(count=counts.c.count - removed)
+    )
+    session.execute(counts.delete().where(counts.c.message_id.in_(affected), counts.c.count <= 0))
+
+# Run on each batch of ids just before those rows are deleted
+BEFORE_DELETE = {
+    'message_reaction': _release_reaction_counts,
+}
+
+def _forget_rows(model):
+    def forget(session, ids):
+        return [partial(invalidate, model, ident) for ident in ids]
+    return forget
+
+def _forget_fragments(invalidate_fragment):
+    def forget(session, ids):
+        return [partial(invalidate_fragment, ident) for ident in ids]
+    return forget
+
+def _forget_servers(session, ids):
+    """Server rows and their owners' access sets"""
+    owners = session.execute(select(Server.owner_id).where(Server.id.in_(ids))).scalars().all()
+    return _forget_rows(Server)(session, ids) + [partial(invalidate_access, owner_id) for owner_id in set(owners)]
+
+def _forget_memberships(session, ids):
+    pairs = session.execute(
+        select(ServerMembership.user_id, ServerMembership.server_id).where(ServerMembership.id.in_(ids))
+    ).all()
+    return [partial(invalidate_membership, user_id, server_id) for user_id, server_id in pairs]
+
+# Cache entries to drop once a batch is gone; called before the DELETE, applied after its commit
+FORGET = {
+    'users': _forget_rows(User),
+    'server': _forget_servers,
+    'channel': _forget_rows(Channel),
+    'server_membership': _forget_memberships,
+    'messages': _forget_fragments(invalidate_message),
+    'direct_messages': _forget_fragments(invalidate_dm),
+}
+
+class Purge:
+    """Deletes rows matching a condition and, first, everything that references them"""
+
+    def __init__(self, session, batch_size=DELETE_BATCH_SIZE):
+        self.session = session
+        self.batch_size = batch_size
+        self.deleted = Counter()
+        self.detached = Counter()
+        self._forget = []
+
+    def progress(self):
+        return {'deleted': dict(self.deleted), 'detached': dict(self.detached)}
+
+    def _commit(self):
+        report_progress(self.progress())
+        self.session.commit()
+        for forget in self._forget:
+            forget()
+        self._forget.clear()
+
+    def delete(self, table, condition):
+        pk = _single_pk(table)
+        if pk is None:
+            # Composite-key tables are summaries with nothing below them; the caller's batch bounds the DELETE
+            self.deleted[table.name] += self.session.execute(table.delete().where(condition)).rowcount
+            return
+
+        references = _references(table)
+        while True:
+            ids = self.session.execute(select(pk).where(condition).order_by(pk).limit(self.batch_size)).scalars().all()
+            if not ids:
+                return
+            for column in references:
+                if column.nullable and (column.table.name, column.name) not in OWNED_NULLABLE:
+                    self._detach(column, ids)
+                else:
+                    self.delete(column.table, column.in_(ids))
+            hook = BEFORE_DELETE.get(table.name)
+            if hook:
+                hook(self.session, ids)
+            if table.name in FORGET:
+                self._forget.extend(FORGET[table.name](self.session, ids))
+            self.deleted[table.name] += self.session.execute(table.delete().where(pk.in_(ids))).rowcount
+            self._commit()
+
+    def _detach(self, column, ids):
+        """Clear a nullable reference to rows about to go, in batches of the referencing table"""
+        table = column.table
+        pk = _single_pk(table)
+        if pk is None:
+            self.detached[f"{table.name}.{column.name}"] += self.session.execute(
+                update(table).where(column.in_(ids)).values({column.name: None})
+            ).rowcount
+            return
+        while True:
+            batch = select(pk).where(column.in_(ids)).limit(self.batch_size).scalar_subquery()
+            cleared = self.session.execute(
+                update(table).where(pk.in_(batch)).values({column.name: None})
+            ).rowcount
+            if not cleared:
+                return
+            self.detached[f"{table.name}.{column.name}"] += cleared
+            self._commit()
+
+def schedule_server_deletion(server):
+    """Hide the server now and queue its removal; returns the job id (None when already queued)"""
+    if server.deleting:
+        return None
+    server.deleting = True
+    job_id = enqueue('delete_server', {'server_id': server.id})
+    db.session.commit()
+    return job_id
+
+def schedule_user_deletion(user):
+    """Sign the user out everywhere now and queue removal of the account and what it owns"""
+    if user.deleting:
+        return None
+    user.deleting = True
+    # Owned servers go with the account, so hide them now as well
+    owned = Server.query.filter_by(owner_id=user.id).all()
+    for server in owned:
+        server.deleting = True
+    job_id = enqueue('delete_user', {'user_id': user.id})
+    db.session.commit()
+    return job_id
+
+@job('delete_server', priority=PRIORITY_LOW, max_attempts=10)
+def delete_server(server_id):
+    table = Server.__table__
+    purge = Purge(db.session)
+    # Safe to rerun: whatever an earlier attempt removed simply no longer matches
+    purge.delete(table, (table.c.id == server_id) & (table.c.deleting == True))  # noqa: E712
+    logging.warning(f"Deleted server {server_id}: {purge.progress()}")
+
+@job('delete_user', priority=PRIORITY_LOW, max_attempts=10)
+def delete_user(user_id):
+    table = User.__table__
+    purge = Purge(db.session)
+    # Owned servers go with the account (server.owner_id is required)
+    purge.delete(table, (table.c.id == user_id) & (table.c.deleting == True))  # noqa: E712
+    logging.warning(f"Deleted user {user_id}: {purge.progress()}")
@@ -0,0 +1,91 @@
+"""
+Rendered message fragment cache
+Channel and DM messages are rendered once through their partial templates (_message.html,
+_direct_message.html) and the HTML is reused for every viewer and page load. The cache key holds
+everything a fragment depends on (message id, channel, creation and edit time, a content hash,
+pin state, reactions, the viewer's permissions), so a changed message simply misses, and so does
+any other row that ends up with the same id; deletes, edits and archival also drop a message's
+fragments so dead entries do not wait for LRU eviction
+"""
+
+from flask import render_template
+from markupsafe import Markup
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from cache import LRUCache
+from models import Message, DirectMessage, MessageAttachment
+
+# A message keeps at most this many variants (reaction counts, viewer permissions) at a time
+MAX_VARIANTS = 8
+
+fragment_cache = LRUCache(maxsize=20000, ttl=600)
+
+def init_fragments(app):
+    """Size the cache from app config and expose the render helpers to templates"""
+    fragment_cache.maxsize = app.config.get('MESSAGE_FRAGMENT_CACHE_SIZE', 20000)
+    # The TTL bounds how long an author's old name or avatar can show on cached messages
+    fragment_cache.ttl = app.config.get('MESSAGE_FRAGMENT_CACHE_TTL', 600)
+    app.jinja_env.globals.update(render_message=render_message, render_dm=render_dm)
+
+def _render(key, variant, template, **context):
+    variants = fragment_cache.get(key)
+    if not isinstance(variants, dict):
+        variants = {}
+    html = variants.get(variant)
+    if html is None:
+        html = render_template(template, **context)
+        # Copy on write: other threads may be reading the current dict
+        variants = dict(list(variants.items())[-(MAX_VARIANTS - 1):])
+        variants[variant] = html
+        fragment_cache.set(key, variants)
+    return Markup(html)
+
+def render_message(message, reaction_counts=None, can_manage=False):
+    """HTML for one channel message (hot or archived)"""
+    archived = getattr(message, 'is_archived', False)
+    variant = (
+        message.channel_id,
+        message.created_at,
+        message.edited_at,
+        hash(message.content),
+        bool(getattr(message, 'is_pinned', False)),
+        bool(can_manage),
+        tuple(sorted(reaction_counts.items())) if reaction_counts else (),
+    )
+    return _render(('archive' if archived else 'message', message.id), variant, '_message.html',
+                   message=message, counts=reaction_counts, can_manage=can_manage)
+
+def render_dm(dm, is_own):
+    """HTML for one direct message as seen by its sender (is_own) or recipient"""
+    variant = (dm.sender_id, dm.recipient_id, dm.created_at, hash(dm.content),
+               dm.status, dm.read_at, dm.delivered_at, bool(is_own))
+    return _render(('dm', dm.id), variant, '_direct_message.html', message=dm, is_own=is_own)
+
+def invalidate_message(message_id):
+    fragment_cache.delete(('message', message_id))
+
+def invalidate_dm(dm_id):
+    fragment_cache.delete(('dm', dm_id))
+
+# Same pattern as the row cache: collect on flush, drop after the commit lands
+@event.listens_for(Session, 'after_flush')
+def _collect_fragment_invalidations(session, flush_context):
+    pending = session.info.setdefault('fragment_invalidate', set())
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Message):
+            pending.add(('message', obj.id))
+        elif isinstance(obj, DirectMessage):
+            pending.add(('dm', obj.id))
+        elif isinstance(obj, MessageAttachment):
+            # Thumbnail workers fill in proxy_url after the message has been rendered
+            pending.add(('message', obj.message_id))
+
+@event.listens_for(Session, 'after_commit')
+def _apply_fragment_invalidations(session):
+    for key in session.info.pop('fragment_invalidate', ()):
+        fragment_cache.delete(key)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_fragment_invalidations(session):
+    session.info.pop('fragment_invalidate', None)
@@ -0,0 +1,262 @@
+"""
+Image asset pipeline for CommunicationX
+Uploaded logos and avatars are stored once in image_asset under the sha256 of their bytes,
+downscaled to standard sizes when Pillow is installed, and served from /assets/<hash> with an
+immutable Cache-Control. Pages link to a short URL instead of inlining a base64 data URL
+"""
+
+import base64
+import binascii
+import hashlib
+import io
+import logging
+import re
+from datetime import datetime
+
+import click
+from flask import Response, abort, request
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from app import app, db, limiter
+from models import ImageAsset, Server, User
+
+ASSET_URL_PREFIX = '/assets/'
+
+# Longest edge in px of the downscaled copies; pages link to DISPLAY_SIZE
+STANDARD_SIZES = (64, 128, 256)
+DISPLAY_SIZE = 256
+
+# A hashed URL never changes content, so browsers and proxies may keep it for a year
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Columns that used to hold base64 data URLs
+IMAGE_COLUMNS = (
+    (Server, 'logo_url'),
+    (Server, 'banner_url'),
+    (User, 'profile_image_url'),
+    (User, 'banner_url'),
+)
+
+# The type comes from the leading bytes, never the filename, so nothing but these
+# four formats is ever served from our origin
+_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+)
+_PIL_FORMATS = {'image/png': 'PNG', 'image/jpeg': 'JPEG', 'image/gif': 'GIF', 'image/webp': 'WEBP'}
+
+_HASH = re.compile(r'^[0-9a-f]{64}$')
+
+def sniff_mime_type(data):
+    """image/* type from the file signature, or None when data is not a supported image"""
+    for signature, mime_type in _SIGNATURES:
+        if data.startswith(signature):
+            return mime_type
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+def parse_data_url(url):
+    """Bytes of a base64 image data URL, or None when url is not one"""
+    if not url or not url.startswith('data:image/'):
+        return None
+    header, _, payload = url.partition(',')
+    if not header.endswith(';base64'):
+        return None
+    try:
+        return base64.b64decode(payload)
+    except (binascii.Error, ValueError):
+        return None
+
+def _pillow():
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    return Image
+
+def pillow_available():
+    return _pillow() is not None
+
+def thumbnail_type():
+    """WebP for generated thumbnails when this Pillow build can write it, PNG otherwise"""
+    try:
+        from PIL import features
+    except ImportError:
+        return 'image/png'
+    return 'image/webp' if features.check('webp') else 'image/png'
+
+def _off_event_loop(fn, *args):
+    """Call fn on a real OS thread when gevent has patched threading (the gunicorn worker), inline otherwise.
+
+    Pillow releases the GIL while decoding and resizing, so this keeps the event loop serving
+    requests, and lets job worker greenlets resize in parallel.
+    """
+    try:
+        from gevent import get_hub, monkey
+    except ImportError:
+        return fn(*args)
+    if not monkey.is_module_patched('threading'):
+        return fn(*args)
+    return get_hub().threadpool.apply(fn, args)
+
+def _variants(data, mime_type, sizes, variant_type=None):
+    """[(variant, bytes, mime_type, width, height)]: the original plus each size it is larger than"""
+    Image = _pillow()
+    if Image is None:
+        # Without Pillow images are stored and served as uploaded
+        return [('original', data, mime_type, None, None)]
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except Exception as e:
+        raise ValueError(f"unreadable image: {e}") from e
+
+    width, height = image.size
+    variants = [('original', data, mime_type, width, height)]
+    if getattr(image, 'is_animated', False):
+        # Downscaling would keep only the first frame
+        return variants
+
+    variant_type = variant_type or mime_type
+    image_format = _PIL_FORMATS[variant_type]
+    for size in sizes:
+        if max(width, height) <= size:
+            continue
+        thumbnail = image.copy()
+        thumbnail.thumbnail((size, size), Image.LANCZOS)
+        if image_format == 'JPEG' and thumbnail.mode not in ('RGB', 'L'):
+            thumbnail = thumbnail.convert('RGB')
+        out = io.BytesIO()
+        thumbnail.save(out, image_format, **({'quality': 85} if image_format in ('JPEG', 'WEBP') else {}))
+        variants.append((str(size), out.getvalue(), variant_type, *thumbnail.size))
+    return variants
+
+def store_image(data, executor=None, sizes=STANDARD_SIZES, variant_type=None):
+    """Store an image and its downscaled copies; returns {variant: hash}.
+
+    Copies keep the upload's format unless variant_type names another (thumbnails use
+    thumbnail_type()). Raises ValueError when data is not a PNG, JPEG, GIF or WebP image.
+    executor is a Session or Connection (db.session by default); the caller commits.
+    """
+    executor = db.session if executor is None else executor
+    mime_type = sniff_mime_type(data or b'')
+    if mime_type is None:
+        raise ValueError("not a PNG, JPEG, GIF or WebP image")
+
+    table = ImageAsset.__table__
+    source_hash = hashlib.sha256(data).hexdigest()
+    rows = executor.execute(
+        select(table.c.variant, table.c.hash, table.c.variant_sizes).where(table.c.source_hash == source_hash)
+    ).all()
+    stored = {row.variant: row.hash for row in rows}
+    checked = {int(size) for row in rows if row.variant == 'original' and row.variant_sizes
+               for size in row.variant_sizes.split(',')}
+    # Images too small (or animated) for any copy are recorded as checked, so they are not decoded again;
+    # an original stored before Pillow was installed still gets its copies
+    if 'original' in stored and (checked.issuperset(sizes) or len(stored) > 1 or not pillow_available()):
+        return stored
+
+    for variant, blob, blob_type, width, height in _off_event_loop(_variants, data, mime_type, sizes, variant_type):
+        if variant in stored:
+            continue
+        digest = hashlib.sha256(blob).hexdigest()
+        try:
+            with executor.begin_nested():
+                executor.execute(table.insert().values(
+                    hash=digest, source_hash=source_hash, variant=variant, mime_type=blob_type,
+                    width=width, height=height, size=len(blob), data=blob, created_at=datetime.now()
+                ))
+        except IntegrityError:
+            # The same bytes were stored concurrently (or by another upload); the hash still resolves
+            pass
+        stored[variant] = digest
+
+    if pillow_available():
+        executor.execute(
+            table.update().where(table.c.source_hash == source_hash, table.c.variant == 'original')
+            .values(variant_sizes=','.join(str(size) for size in sorted(checked.union(sizes))))
+        )
+    return stored
+
+def load_asset(asset_hash, executor=None):
+    """(mime_type, data, width, height) of an asset, or None"""
+    executor = db.session if executor is None else executor
+    table = ImageAsset.__table__
+    return executor.execute(
+        select(table.c.mime_type, table.c.data, table.c.width, table.c.height).where(table.c.hash == asset_hash)
+    ).first()
+
+def asset_url(asset_hash):
+    return ASSET_URL_PREFIX + asset_hash
+
+def save_image(data, executor=None, size=DISPLAY_SIZE):
+    """Store an uploaded image and return the URL pages should link to"""
+    stored = store_image(data, executor)
+    return asset_url(stored.get(str(size)) or stored['original'])
+
+def extract_data_urls(executor, batch_size=100):
+    """Move base64 data URLs in IMAGE_COLUMNS into image assets; returns {column: rows moved}"""
+    moved = {}
+    for model, name in IMAGE_COLUMNS:
+        table = model.__table__
+        column = table.c[name]
+        last_id, count = 0, 0
+        while True:
+            # Batches keep only a few hundred images in memory at once
+            rows = executor.execute(
+                select(table.c.id, column)
+                .where(column.like('data:image/%'), table.c.id > last_id)
+                .order_by(table.c.id).limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            for row_id, url in rows:
+                last_id = row_id
+                data = parse_data_url(url)
+                try:
+                    new_url = save_image(data, executor) if data else None
+                except ValueError:
+                    new_url = None
+                if new_url is None:
+                    logging.warning(f"Left unreadable data URL in {table.name}.{name} id={row_id}")
+                    continue
+                values = {name: new_url}
+                if 'updated_at' in table.c:
+                    # Moving the bytes is not an edit
+                    values['updated_at'] = table.c.updated_at
+                executor.execute(table.update().where(table.c.id == row_id).values(values))
+                count += 1
+        moved[f"{table.name}.{name}"] = count
+    return moved
+
+def init_images(app):
+    """Register the /assets/<hash> route"""
+
+    @app.route('/assets/<asset_hash>')
+    @limiter.exempt
+    def image_asset(asset_hash):
+        if not _HASH.match(asset_hash):
+            abort(404)
+        headers = {'Cache-Control': IMMUTABLE_CACHE_CONTROL, 'ETag': f'"{asset_hash}"'}
+        # The hash is the ETag: a revalidating browser never costs a database read
+        if request.if_none_match.contains(asset_hash):
+            return Response(status=304, headers=headers)
+
+        row = load_asset(asset_hash)
+        if row is None:
+            abort(404)
+        response = Response(row.data, mimetype=row.mime_type, headers=headers)
+        response.headers['X-Content-Type-Options'] = 'nosniff'
+        return response
+
+@app.cli.command('extract-images')
+def extract_images_command():
+    """Move any remaining base64 data URLs into image assets"""
+    moved = extract_data_urls(db.session)
+    db.session.commit()
+    for name, count in moved.items():
+        click.echo(f"{count:>6} rows  {name}")
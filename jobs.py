@@ -0,0 +1,310 @@
+"""
+Durable background jobs for CommunicationX
+Slow side effects (emails, thumbnails, purges, image processing) are enqueued as rows in
+the job table inside the caller's transaction, so a job exists exactly when the change that
+caused it was committed. Worker threads in the web process (JOB_WORKERS, default 1) and any
+number of `flask jobs-work` processes claim and run them: lower priority numbers first, failures
+retried with exponential backoff up to max_attempts, and a job whose worker died is rerun once
+its lease expires. Delivery is at least once, so handlers must be safe to repeat
+"""
+
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import and_, func, or_, select, update
+
+from app import app, db
+from metrics import registry
+from models import Job
+
+PRIORITY_HIGH = 10
+PRIORITY_DEFAULT = 100
+PRIORITY_LOW = 1000
+
+# Retry n waits about BACKOFF_BASE * 2 ** (n - 1) seconds (with jitter), at most BACKOFF_MAX
+BACKOFF_BASE = 5
+BACKOFF_MAX = 3600
+
+# A running job not finished within this many seconds is presumed lost and run again
+LEASE_SECONDS = 600
+
+# Idle workers poll this often
+POLL_INTERVAL = 1.0
+
+# name -> (handler, default priority, max attempts)
+HANDLERS = {}
+
+job_runs = registry.counter('jobs_processed_total', 'Background jobs run', ('job', 'outcome'))
+job_latency = registry.histogram('job_duration_seconds', 'Background job run time', ('job',))
+jobs_queued = registry.gauge('jobs_queued', 'Background jobs waiting to run', ('job',))
+
+def job(name, priority=PRIORITY_DEFAULT, max_attempts=5):
+    """Register a job handler; it is called with the payload as keyword arguments inside an app context"""
+    def register(fn):
+        HANDLERS[name] = (fn, priority, max_attempts)
+        return fn
+    return register
+
+def enqueue(name, payload=None, priority=None, delay=0, executor=None):
+    """Queue a job in the current transaction and return its id; the caller commits.
+
+    payload must be JSON-serializable. executor is a Session or Connection (db.session by
+    default); flush event hooks pass session.connection().
+    """
+    if name not in HANDLERS:
+        raise KeyError(f"No job handler registered for {name!r}")
+    _, default_priority, max_attempts = HANDLERS[name]
+    now = datetime.now()
+    executor = db.session if executor is None else executor
+    result = executor.execute(Job.__table__.insert().values(
+        name=name, payload=json.dumps(payload or {}), status='queued', attempts=0,
+        priority=default_priority if priority is None else priority, max_attempts=max_attempts,
+        run_at=now + timedelta(seconds=delay), created_at=now
+    ))
+    return result.inserted_primary_key[0]
+
+_current = threading.local()
+
+def report_progress(progress):
+    """Record progress (a JSON-serializable dict) on the job this thread is running.
+
+    Written in the handler's transaction, so it becomes visible with the handler's next commit.
+    It also renews the job's lease, so a long job that keeps reporting is never rerun.
+    """
+    job_id = getattr(_current, 'job_id', None)
+    if job_id is not None:
+        table = Job.__table__
+        db.session.execute(update(table).where(table.c.id == job_id).values(
+            progress=json.dumps(progress), locked_at=datetime.now()
+        ))
+
+def _runnable(now):
+    table = Job.__table__
+    return or_(
+        and_(table.c.status == 'queued', table.c.run_at <= now),
+        and_(_lease_expired(now), table.c.attempts < table.c.max_attempts),
+    )
+
+def _lease_expired(now):
+    table = Job.__table__
+    return and_(table.c.status == 'running', table.c.locked_at < now - timedelta(seconds=LEASE_SECONDS))
+
+def _claim(worker_id, candidates=10):
+    """Lock the next runnable job for this worker; returns its row or None"""
+    table = Job.__table__
+    now = datetime.now()
+    # Lost jobs out of attempts come back too, to be failed rather than rerun
+    rows = db.session.execute(
+        select(table.c.id, table.c.name, table.c.status, table.c.attempts, table.c.max_attempts)
+        .where(or_(_runnable(now), _lease_expired(now)))
+        .order_by(table.c.priority, table.c.run_at, table.c.id).limit(candidates)
+    ).all()
+    for job_id, name, status, attempts, max_attempts in rows:
+        if status == 'running' and attempts >= max_attempts:
+            _fail_abandoned(job_id, name, attempts, now)
+            continue
+        # Conditional update: when several workers race for a row exactly one matches
+        claimed = db.session.execute(
+            update(table).where(table.c.id == job_id, _runnable(now))
+            .values(status='running', locked_by=worker_id, locked_at=now, attempts=table.c.attempts + 1)
+        ).rowcount
+        db.session.commit()
+        if claimed:
+            return db.session.execute(
+                select(table.c.id, table.c.name, table.c.payload, table.c.attempts, table.c.max_attempts)
+                .where(table.c.id == job_id)
+            ).first()
+    db.session.rollback()
+    return None
+
+def _fail_abandoned(job_id, name, attempts, now):
+    """A job whose worker died on its last attempt (e.g. killed for memory) is failed, not run forever"""
+    table = Job.__table__
+    failed = db.session.execute(
+        update(table).where(table.c.id == job_id, _lease_expired(now), table.c.attempts >= table.c.max_attempts)
+        .values(status='failed', locked_by=None, locked_at=None, finished_at=now,
+                last_error=f"Lease expired on attempt {attempts}; the worker was lost")
+    ).rowcount
+    db.session.commit()
+    if failed:
+        logging.error(f"Job {job_id} {name} failed: its worker was lost on the last of {attempts} attempts")
+        job_runs.inc(job=name, outcome='failed')
+
+def _backoff(attempts):
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.5)
+
+def _release(row, worker_id, **values):
+    """Record the outcome unless the lease was lost to another worker meanwhile"""
+    table = Job.__table__
+    db.session.execute(
+        update(table).where(table.c.id == row.id, table.c.locked_by == worker_id)
+        .values(locked_by=None, locked_at=None, **values)
+    )
+    db.session.commit()
+
+def run_one(worker_id):
+    """Claim and run one job; returns False when nothing was runnable"""
+    row = _claim(worker_id)
+    if row is None:
+        return False
+
+    handler = HANDLERS.get(row.name)
+    started = time.perf_counter()
+    _current.job_id = row.id
+    try:
+        if handler is None:
+            raise LookupError(f"No job handler registered for {row.name!r}")
+        handler[0](**json.loads(row.payload))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        error = traceback.format_exc()
+        if row.attempts >= row.max_attempts:
+            outcome = 'failed'
+            logging.error(f"Job {row.id} {row.name} failed after {row.attempts} attempts:\n{error}")
+            _release(row, worker_id, status='failed', last_error=error, finished_at=datetime.now())
+        else:
+            outcome = 'retry'
+            logging.warning(f"Job {row.id} {row.name} attempt {row.attempts} failed, retrying:\n{error}")
+            _release(row, worker_id, status='queued', last_error=error,
+                     run_at=datetime.now() + timedelta(seconds=_backoff(row.attempts)))
+    else:
+        outcome = 'ok'
+        _release(row, worker_id, status='done', finished_at=datetime.now())
+    finally:
+        _current.job_id = None
+    job_latency.observe(time.perf_counter() - started, job=row.name)
+    job_runs.inc(job=row.name, outcome=outcome)
+    return True
+
+class JobWorker:
+    """Runs jobs on `threads` threads until stopped.
+
+    Under the gevent gunicorn worker these threads are greenlets, which suits I/O-bound jobs;
+    the CPU-bound part of image jobs is handed to gevent's native thread pool (images.py) so it
+    does not stall the event loop. Busy deployments set JOB_WORKERS=0 and run
+    `flask jobs-work` processes instead.
+    """
+
+    def __init__(self, app, threads=1, poll_interval=POLL_INTERVAL):
+        self.app = app
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for i in range(self.threads):
+            thread = threading.Thread(target=self._loop, args=(f"{self.name}:{i}",), name=f'jobs-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _loop(self, worker_id, burst=False):
+        while not self._stop.is_set():
+            with self.app.app_context():
+                try:
+                    ran = run_one(worker_id)
+                except Exception:
+                    logging.exception("Job worker error")
+                    db.session.rollback()
+                    ran = False
+            if not ran:
+                if burst:
+                    return
+                self._stop.wait(self.poll_interval)
+
+_worker = None
+_worker_lock = threading.Lock()
+
+def init_jobs(app):
+    """Start JOB_WORKERS in-process worker threads with the first request (CLI runs never start them)"""
+    threads = int(app.config.get('JOB_WORKERS', os.environ.get('JOB_WORKERS', 1)))
+    jobs_queued.set_function(_queued_counts)
+    if threads <= 0:
+        return
+
+    @app.before_request
+    def _start_job_worker():
+        global _worker
+        if _worker is None:
+            with _worker_lock:
+                if _worker is None:
+                    _worker = JobWorker(app, threads)
+                    _worker.start()
+
+def _queued_counts():
+    table = Job.__table__
+    rows = db.session.execute(
+        select(table.c.name, func.count()).where(table.c.status == 'queued').group_by(table.c.name)
+    ).all()
+    return {(name,): count for name, count in rows}
+
+@app.cli.command('jobs-work')
+@click.option('--threads', default=1, show_default=True, help='Worker threads in this process')
+@click.option('--burst', is_flag=True, help='Exit once no job is runnable')
+def jobs_work_command(threads, burst):
+    """Run background jobs until interrupted"""
+    worker = JobWorker(app, threads)
+    click.echo(f"{worker.name}: {threads} worker threads, {len(HANDLERS)} job types")
+    if burst:
+        worker._loop(f"{worker.name}:burst", burst=True)
+        return
+    worker.start()
+    try:
+        while any(thread.is_alive() for thread in worker._threads):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        click.echo("stopping after the current jobs")
+        worker.stop()
+
+@app.cli.command('jobs-status')
+def jobs_status_command():
+    """Job counts by type and status"""
+    table = Job.__table__
+    rows = db.session.execute(
+        select(table.c.name, table.c.status, func.count()).group_by(table.c.name, table.c.status)
+        .order_by(table.c.name, table.c.status)
+    ).all()
+    for name, status, count in rows:
+        click.echo(f"{count:>8}  {status:<8}  {name}")
+
+@app.cli.command('jobs-retry')
+@click.option('--name', default=None, help='Only jobs of this type')
+def jobs_retry_command(name):
+    """Queue failed jobs again with a fresh attempt budget"""
+    table = Job.__table__
+    query = update(table).where(table.c.status == 'failed')
+    if name:
+        query = query.where(table.c.name == name)
+    count = db.session.execute(
+        query.values(status='queued', attempts=0, run_at=datetime.now(), finished_at=None)
+    ).rowcount
+    db.session.commit()
+    click.echo(f"requeued {count} jobs")
+
+@app.cli.command('jobs-prune')
+@click.option('--days', default=7, show_default=True, help='Keep finished jobs this many days')
+def jobs_prune_command(days):
+    """Delete done and failed jobs that finished more than --days ago"""
+    table = Job.__table__
+    count = db.session.execute(
+        table.delete().where(table.c.status.in_(('done', 'failed')),
+                             table.c.finished_at < datetime.now() - timedelta(days=days))
+    ).rowcount
+    db.session.commit()
+    click.echo(f"deleted {count} jobs")
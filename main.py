@@ -1,6 +1,15 @@
-from app import app, socketio
+from app import app, socketio, init_database
+
+# Migrate before routes import: admin setup queries the users table at import time
+init_database()
+
 import routes  # noqa: F401
 import socket_events  # noqa: F401
+import schema_migrations  # noqa: F401  (registers the flask CLI migration commands)
+import archival  # noqa: F401  (registers flask archive-messages)
+import database_config  # noqa: F401  (registers flask db-tune)
+import datagen  # noqa: F401  (registers flask datagen)
+import thumbnails  # noqa: F401  (queues thumbnail jobs for new uploads)
 
 # Register advanced Discord-like features
 from advanced_routes import advanced
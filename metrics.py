@@ -0,0 +1,327 @@
+"""
+Runtime metrics for CommunicationX
+A small in-process registry (counters, gauges, histograms) rendered in the Prometheus text
+exposition format on /metrics: HTTP and Socket.IO handler latency, connected sockets and rooms,
+call sessions, signaling traffic and database pool usage. Each worker process exposes its own
+series, so scrape every worker (gunicorn.conf.py runs one). Without METRICS_TOKEN only loopback
+clients may scrape
+"""
+
+import ipaddress
+import logging
+import os
+import threading
+import time
+from functools import wraps
+
+from flask import Response, g, request
+
+# Prometheus client defaults: 5ms to 10s
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    """Base for labelled metrics; label values are passed as keyword arguments"""
+    type_name = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """[(suffix, label values, extra labels, value)] for rendering"""
+        with self._lock:
+            return [('', key, (), value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for suffix, key, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}")
+        return '\n'.join(lines)
+
+class Counter(Metric):
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+    type_name = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._function = None
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function):
+        """Compute the value at scrape time; `function` returns a number, or {label values tuple: number}"""
+        self._function = function
+
+    def samples(self):
+        if self._function is None:
+            return super().samples()
+        try:
+            result = self._function()
+        except Exception as e:
+            # A broken collector must not take down the whole scrape
+            logging.warning(f"Metric {self.name} collection failed: {e}")
+            return []
+        if isinstance(result, dict):
+            return [('', tuple(str(v) for v in key), (), value) for key, value in result.items()]
+        return [('', (), (), result)]
+
+class Histogram(Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry['counts'][i] += 1
+                    break
+            entry['sum'] += value
+            entry['count'] += 1
+
+    def time(self, **labels):
+        """Decorator recording the wrapped call's duration in seconds"""
+        def decorator(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.observe(time.perf_counter() - started, **labels)
+            return wrapper
+        return decorator
+
+    def samples(self):
+        with self._lock:
+            snapshot = [(key, list(entry['counts']), entry['sum'], entry['count']) for key, entry in self._values.items()]
+        samples = []
+        for key, counts, total, count in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                samples.append(('_bucket', key, (('le', _format_value(bound)),), cumulative))
+            samples.append(('_sum', key, (), total))
+            samples.append(('_count', key, (), count))
+        return samples
+
+class Registry:
+    """Named collection of metrics; registering the same name twice returns the existing metric"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, documentation, labelnames=(), **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} is already registered as a {metric.type_name}")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+registry = Registry()
+
+http_requests = registry.counter(
+    'http_requests_total', 'HTTP requests handled', ('method', 'endpoint', 'status'))
+http_latency = registry.histogram(
+    'http_request_duration_seconds', 'HTTP request latency', ('method', 'endpoint'))
+socket_events = registry.counter(
+    'socketio_events_total', 'Socket.IO events handled', ('event', 'outcome'))
+socket_latency = registry.histogram(
+    'socketio_handler_duration_seconds', 'Socket.IO handler latency', ('event',))
+
+def socket_handler(fn):
+    """Time a Socket.IO handler; place it under @socketio.on. The event name is the function name without on_"""
+    event_name = fn.__name__[3:] if fn.__name__.startswith('on_') else fn.__name__
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        outcome = 'ok'
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            outcome = 'error'
+            raise
+        finally:
+            socket_latency.observe(time.perf_counter() - started, event=event_name)
+            socket_events.inc(event=event_name, outcome=outcome)
+    return wrapper
+
+def _socket_counts(socketio):
+    """Connected sockets and joined rooms (by prefix: channel, user, call) on the default namespace"""
+    rooms = dict(socketio.server.manager.rooms.get('/', {}))
+    connected = rooms.pop(None, {})
+    by_kind = {}
+    for room, members in rooms.items():
+        if room in connected:
+            continue  # every socket has a private room named after its sid
+        kind = str(room).split('_', 1)[0]
+        by_kind[(kind,)] = by_kind.get((kind,), 0) + 1
+    return len(connected), by_kind
+
+def _call_sessions():
+    from call_manager import call_manager
+    counts = {}
+    for call in list(call_manager.active_calls.values()):
+        key = (call.status.value, call.call_type.value)
+        counts[key] = counts.get(key, 0) + 1
+    return counts
+
+def _pool_stats(db, attribute):
+    def collect():
+        pool = db.engine.pool
+        # SingletonThreadPool/NullPool (in-memory SQLite, tests) have no size accounting
+        return getattr(pool, attribute)() if hasattr(pool, attribute) else 0
+    return collect
+
+def _loopback(address):
+    try:
+        return ipaddress.ip_address(address).is_loopback
+    except ValueError:
+        return False
+
+def scrape_allowed(environ, token):
+    """A bearer token when one is configured, otherwise a loopback client.
+
+    Both the forwarded client address and the socket peer must be loopback, so an
+    X-Forwarded-For header sent straight to the app cannot pass for a local scraper.
+    """
+    if token:
+        return environ.get('HTTP_AUTHORIZATION') == f'Bearer {token}'
+    peer = environ.get('werkzeug.proxy_fix.orig', {}).get('REMOTE_ADDR', environ.get('REMOTE_ADDR'))
+    return _loopback(environ.get('REMOTE_ADDR')) and _loopback(peer)
+
+def init_metrics(app, db, socketio):
+    """Register the HTTP hooks, scrape-time gauges and the /metrics endpoint"""
+    registry.gauge('socketio_connected_sockets', 'Connected Socket.IO clients').set_function(
+        lambda: _socket_counts(socketio)[0])
+    registry.gauge('socketio_rooms', 'Socket.IO rooms with at least one member', ('kind',)).set_function(
+        lambda: _socket_counts(socketio)[1])
+    registry.gauge('call_sessions', 'CallManager sessions', ('status', 'call_type')).set_function(_call_sessions)
+    for attribute, documentation in (
+        ('size', 'Configured pool size'),
+        ('checkedout', 'Connections currently checked out'),
+        ('overflow', 'Connections opened beyond pool_size (negative while the pool is not full)'),
+        ('checkedin', 'Idle connections in the pool'),
+    ):
+        registry.gauge(f'db_pool_{attribute}', documentation).set_function(_pool_stats(db, attribute))
+
+    token = app.config.get('METRICS_TOKEN')
+
+    @app.before_request
+    def _start_request_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _note_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    # Teardown runs for every request, while after_request is skipped when an exception propagates
+    # (debug mode, PROPAGATE_EXCEPTIONS) or the error handler itself fails: such a request has no
+    # status, so it is counted as a 500
+    @app.teardown_request
+    def _record_request(exc):
+        started = g.pop('metrics_started', None)
+        status = g.pop('metrics_status', 500)
+        if started is not None and request.endpoint != 'metrics':
+            # Unmatched URLs share one series so scanners cannot blow up the label set
+            endpoint = request.endpoint or 'unmatched'
+            http_latency.observe(time.perf_counter() - started, method=request.method, endpoint=endpoint)
+            http_requests.inc(method=request.method, endpoint=endpoint, status=status)
+
+    @app.route('/metrics')
+    def metrics():
+        if not scrape_allowed(request.environ, token):
+            if token:
+                return Response('unauthorized\n', status=401, mimetype='text/plain')
+            return Response('forbidden: set METRICS_TOKEN to scrape from other hosts\n', status=403,
+                            mimetype='text/plain')
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+def serve_metrics(port=None, host='0.0.0.0'):
+    """Expose the registry from a process without Flask (the standalone signaling server).
+
+    The same rule as /metrics applies: METRICS_TOKEN, or loopback clients only.
+    """
+    from wsgiref.simple_server import make_server, WSGIRequestHandler
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+    token = os.environ.get('METRICS_TOKEN')
+
+    def application(environ, start_response):
+        if not scrape_allowed(environ, token):
+            start_response('403 Forbidden', [('Content-Type', 'text/plain')])
+            return [b'forbidden\n']
+        start_response('200 OK', [('Content-Type', 'text/plain; version=0.0.4')])
+        return [registry.render().encode()]
+
+    port = int(port or os.environ.get('METRICS_PORT', 9100))
+    server = make_server(host, port, application, handler_class=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True, name='metrics').start()
+    return server
@@ -2,7 +2,10 @@ from datetime import datetime
 from app import db
 from flask_dance.consumer.storage.sqla import OAuthConsumerMixin
 from flask_login import UserMixin
-from sqlalchemy import UniqueConstraint, Index, text
+from sqlalchemy import UniqueConstraint, Index, text, false
+
+# BIGINT primary keys only autoincrement on SQLite when declared INTEGER (rowid alias)
+BigIntegerPK = db.BigInteger().with_variant(db.Integer, 'sqlite')
 
 # (IMPORTANT) This table is mandatory for Replit Auth, don't drop it.
 class User(UserMixin, db.Model):
@@ -35,6 +38,7 @@ class User(UserMixin, db.Model):
     ban_reason = db.Column(db.Text, nullable=True)  # Reason for ban
     banned_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)  # Who banned
     banned_at = db.Column(db.DateTime, nullable=True)  # When banned
+    deleting = db.Column(db.Boolean, default=False, nullable=False, server_default=false())  # Removal job queued (see deletion.py)
     
     created_at = db.Column(db.DateTime, default=datetime.now)
     updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
@@ -64,8 +68,9 @@ class Server(db.Model):
     description = db.Column(db.Text, nullable=True)
     logo_url = db.Column(db.String, nullable=True)
     banner_url = db.Column(db.String, nullable=True)  # Server banner
-    owner_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
+    owner_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     is_public = db.Column(db.Boolean, default=True)  # Public servers auto-add all users
+    deleting = db.Column(db.Boolean, default=False, nullable=False, server_default=false())  # Removal job queued (see deletion.py)
     verification_level = db.Column(db.Integer, default=0)  # 0=None, 1=Low, 2=Medium, 3=High, 4=Highest
     explicit_content_filter = db.Column(db.Integer, default=0)  # Content filtering
     default_notifications = db.Column(db.String(20), default='all')  # all, mentions
@@ -121,6 +126,8 @@ class Channel(db.Model):
     default_auto_archive_duration = db.Column(db.Integer, default=4320)  # Thread auto-archive (minutes)
     permissions_overwrites = db.Column(db.Text, nullable=True)  # JSON permission overwrites
     created_at = db.Column(db.DateTime, default=datetime.now)
+    # Bumped when a message is edited, pinned or deleted (new messages show in max(id) instead)
+    message_version = db.Column(db.Integer, default=0, nullable=False, server_default='0')
     
     # Relationships
     messages = db.relationship('Message', backref='channel', lazy=True, cascade='all, delete-orphan')
@@ -132,8 +139,8 @@ class Channel(db.Model):
 
 class ServerMembership(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
-    server_id = db.Column(db.Integer, db.ForeignKey('server.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    server_id = db.Column(db.Integer, db.ForeignKey('server.id'), nullable=False, index=True)
     nickname = db.Column(db.String(32), nullable=True)  # Server-specific nickname
     avatar_url = db.Column(db.String, nullable=True)  # Server-specific avatar
     roles = db.Column(db.Text, nullable=True)  # JSON array of role IDs
@@ -146,13 +153,17 @@ class ServerMembership(db.Model):
     
     # Relationships
     user = db.relationship('User', backref='server_memberships')
+    
+    __table_args__ = (
+        Index('idx_membership_user_server', 'user_id', 'server_id'),  # For access checks and "my servers"
+    )
 
 class Message(db.Model):
     __tablename__ = 'messages'
     
-    id = db.Column(db.BigInteger, primary_key=True)  # BigInt for large-scale storage
+    id = db.Column(BigIntegerPK, primary_key=True)  # BigInt for large-scale storage
     content = db.Column(db.Text, nullable=False)
-    author_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False, index=True)
+    author_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     channel_id = db.Column(db.Integer, db.ForeignKey('channel.id'), nullable=False, index=True)
     created_at = db.Column(db.DateTime, default=datetime.now, index=True, nullable=False)
     edited_at = db.Column(db.DateTime, nullable=True)
@@ -170,6 +181,7 @@ class Message(db.Model):
     
     # Relationships (without FK constraint for reply_to due to partitioning)
     reactions = db.relationship('MessageReaction', backref='message', cascade='all, delete-orphan')
+    reaction_counts = db.relationship('MessageReactionCount', cascade='all, delete-orphan')
     reports = db.relationship('MessageReport', backref='message', cascade='all, delete-orphan')
     
     # Composite indexes for efficient queries
@@ -179,15 +191,41 @@ class Message(db.Model):
         Index('idx_channel_type_created', 'channel_id', 'message_type', 'created_at'),  # For filtered message queries
         Index('idx_pinned_channel', 'is_pinned', 'channel_id'),       # For pinned messages
         Index('idx_reply_lookup', 'reply_to_id', 'created_at'),       # For reply lookups
+        # Ids must never be reused: archived and deleted ids live on in message_archive and caches
+        {'sqlite_autoincrement': True},
+    )
+
+class MessageArchive(db.Model):
+    """Cold storage for old channel messages, moved here in batches by archival.py"""
+    __tablename__ = 'message_archive'
+    
+    is_archived = True  # Archived messages are read-only in the UI
+    
+    id = db.Column(BigIntegerPK, primary_key=True, autoincrement=False)  # Same id as the original message
+    content = db.Column(db.Text, nullable=False)
+    author_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    channel_id = db.Column(db.Integer, nullable=False)  # No FK: archives outlive channel cleanup batches
+    created_at = db.Column(db.DateTime, nullable=False)
+    edited_at = db.Column(db.DateTime, nullable=True)
+    reply_to_id = db.Column(db.BigInteger, nullable=True)
+    message_type = db.Column(db.String(20), default='text')
+    reaction_summary = db.Column(db.Text, nullable=True)  # JSON {emoji: count} folded in at archive time
+    archived_at = db.Column(db.DateTime, default=datetime.now, nullable=False)
+    
+    author = db.relationship('User')
+    
+    __table_args__ = (
+        Index('idx_archive_channel_created', 'channel_id', 'created_at'),  # For history pages
+        Index('idx_archive_author_created', 'author_id', 'created_at'),
     )
 
 class DirectMessage(db.Model):
     __tablename__ = 'direct_messages'
     
-    id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)  # BigInt for large-scale storage
+    id = db.Column(BigIntegerPK, primary_key=True, autoincrement=True)  # BigInt for large-scale storage
     content = db.Column(db.Text, nullable=False)
-    sender_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False, index=True)
-    recipient_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False, index=True)
+    sender_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    recipient_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     created_at = db.Column(db.DateTime, default=datetime.now, index=True)
     read_at = db.Column(db.DateTime, nullable=True)
     
@@ -200,6 +238,8 @@ class DirectMessage(db.Model):
         Index('idx_dm_conversation', 'sender_id', 'recipient_id', 'created_at'),  # For conversation threads
         Index('idx_dm_recipient_unread', 'recipient_id', 'read_at', 'created_at'),  # For unread messages
         Index('idx_dm_user_timeline', 'sender_id', 'created_at'),  # For user message timeline
+        # Purged ids must not come back: fragments and clients still know them
+        {'sqlite_autoincrement': True},
     )
 
 class MessageReadStatus(db.Model):
@@ -208,7 +248,7 @@ class MessageReadStatus(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     message_id = db.Column(db.BigInteger, db.ForeignKey('messages.id'), nullable=False, index=True)
-    user_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     read_at = db.Column(db.DateTime, default=datetime.now, nullable=False)
     
     # Composite index for efficient read status queries
@@ -219,8 +259,8 @@ class MessageReadStatus(db.Model):
 
 class Call(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    caller_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
-    recipient_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
+    caller_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    recipient_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     server_id = db.Column(db.Integer, db.ForeignKey('server.id'), nullable=True)  # For server calls
     call_type = db.Column(db.String(10), nullable=False)  # 'audio' or 'video'
     status = db.Column(db.String(20), default='pending')  # 'pending', 'active', 'ended', 'declined'
@@ -236,7 +276,7 @@ class Call(db.Model):
 class CallMessage(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     call_id = db.Column(db.Integer, db.ForeignKey('call.id'), nullable=False)
-    user_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     content = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.now)
     
@@ -247,14 +287,14 @@ class CallMessage(db.Model):
 class SharedFile(db.Model):
     __tablename__ = 'shared_files'
     
-    id = db.Column(db.BigInteger, primary_key=True)  # BigInt for large-scale storage
+    id = db.Column(BigIntegerPK, primary_key=True)  # BigInt for large-scale storage
     filename = db.Column(db.String(255), nullable=False, index=True)
     original_filename = db.Column(db.String(255), nullable=False)
     file_data = db.Column(db.LargeBinary, nullable=True)  # Store large files externally for 1TB+ support
     file_path = db.Column(db.String(500), nullable=True)  # External file storage path
     file_size = db.Column(db.BigInteger, nullable=False, index=True)  # BigInt for large files
     mime_type = db.Column(db.String(100), nullable=False, index=True)
-    uploader_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False, index=True)
+    uploader_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     server_id = db.Column(db.Integer, db.ForeignKey('server.id'), nullable=True, index=True)
     channel_id = db.Column(db.Integer, db.ForeignKey('channel.id'), nullable=True, index=True)
     created_at = db.Column(db.DateTime, default=datetime.now, index=True)
@@ -277,7 +317,7 @@ class SharedFile(db.Model):
 class Invitation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     code = db.Column(db.String(32), unique=True, nullable=False)
-    inviter_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
+    inviter_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     email = db.Column(db.String(255), nullable=True)
     uses_left = db.Column(db.Integer, default=1)
     expires_at = db.Column(db.DateTime, nullable=True)
@@ -288,8 +328,8 @@ class Invitation(db.Model):
 
 class Voicemail(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    sender_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
-    recipient_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
+    sender_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    recipient_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     audio_url = db.Column(db.String, nullable=False)
     duration = db.Column(db.Integer, nullable=True)  # in seconds
     is_read = db.Column(db.Boolean, default=False)
@@ -307,7 +347,7 @@ class CodeWorkspace(db.Model):
     name = db.Column(db.String(255), nullable=False)
     description = db.Column(db.Text, nullable=True)
     workspace_type = db.Column(db.String(20), nullable=False)  # 'personal' or 'group'
-    owner_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
+    owner_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     server_id = db.Column(db.Integer, db.ForeignKey('server.id'), nullable=True)  # For group workspaces
     language = db.Column(db.String(50), default='javascript')  # python, javascript, java, cpp, etc.
     is_public = db.Column(db.Boolean, default=False)
@@ -328,7 +368,7 @@ class CodeFile(db.Model):
     content = db.Column(db.Text, nullable=True)
     language = db.Column(db.String(50), nullable=True)
     size = db.Column(db.Integer, default=0)
-    created_by = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.now)
     updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
     
@@ -341,7 +381,7 @@ class WorkspaceCollaborator(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     workspace_id = db.Column(db.Integer, db.ForeignKey('code_workspaces.id'), nullable=False)
-    user_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     permission = db.Column(db.String(20), default='read')  # read, write, admin
     joined_at = db.Column(db.DateTime, default=datetime.now)
     
@@ -357,7 +397,7 @@ class DesignWorkspace(db.Model):
     name = db.Column(db.String(255), nullable=False)
     description = db.Column(db.Text, nullable=True)
     workspace_type = db.Column(db.String(20), nullable=False)  # 'personal' or 'group'
-    owner_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
+    owner_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     server_id = db.Column(db.Integer, db.ForeignKey('server.id'), nullable=True)  # For group workspaces
     template_type = db.Column(db.String(50), default='custom')  # poster, logo, presentation, etc.
     is_public = db.Column(db.Boolean, default=False)
@@ -378,7 +418,7 @@ class DesignProject(db.Model):
     thumbnail_url = db.Column(db.String(500), nullable=True)
     width = db.Column(db.Integer, default=800)
     height = db.Column(db.Integer, default=600)
-    created_by = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.now)
     updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
     
@@ -391,7 +431,7 @@ class DesignCollaborator(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     workspace_id = db.Column(db.Integer, db.ForeignKey('design_workspaces.id'), nullable=False)
-    user_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     permission = db.Column(db.String(20), default='read')  # read, write, admin
     joined_at = db.Column(db.DateTime, default=datetime.now)
     
@@ -407,7 +447,7 @@ class BrowserSession(db.Model):
     session_name = db.Column(db.String(255), nullable=False)
     url = db.Column(db.String(2000), nullable=True)
     session_type = db.Column(db.String(20), nullable=False)  # 'personal' or 'group'
-    owner_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
+    owner_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     server_id = db.Column(db.Integer, db.ForeignKey('server.id'), nullable=True)  # For group sessions
     is_active = db.Column(db.Boolean, default=True)
     shared_with_call = db.Column(db.Boolean, default=False)  # If shared during call
@@ -423,7 +463,7 @@ class BrowserParticipant(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(db.Integer, db.ForeignKey('browser_sessions.id'), nullable=False)
-    user_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     can_control = db.Column(db.Boolean, default=False)  # Can control the browser
     joined_at = db.Column(db.DateTime, default=datetime.now)
     
@@ -443,7 +483,7 @@ class ToolFile(db.Model):
     file_data = db.Column(db.LargeBinary, nullable=True)
     file_size = db.Column(db.Integer, default=0)
     mime_type = db.Column(db.String(100), nullable=True)
-    owner_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
+    owner_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.now)
     updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
     
@@ -453,7 +493,7 @@ class ToolFile(db.Model):
 class MessageReaction(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     message_id = db.Column(db.BigInteger, db.ForeignKey('messages.id'), nullable=False)
-    user_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     emoji = db.Column(db.String(10), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.now)
     
@@ -463,10 +503,18 @@ class MessageReaction(db.Model):
     # Unique constraint to prevent duplicate reactions
     __table_args__ = (db.UniqueConstraint('message_id', 'user_id', 'emoji', name='uq_message_user_emoji'),)
 
+class MessageReactionCount(db.Model):
+    """Denormalized per-message reaction summary (emoji -> count), kept in step with MessageReaction"""
+    __tablename__ = 'message_reaction_counts'
+    
+    message_id = db.Column(db.BigInteger, db.ForeignKey('messages.id'), primary_key=True)
+    emoji = db.Column(db.String(10), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
 class MessageReport(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    message_id = db.Column(db.BigInteger, db.ForeignKey('messages.id'), nullable=False)
-    reporter_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
+    message_id = db.Column(db.BigInteger, db.ForeignKey('messages.id'), nullable=False, index=True)
+    reporter_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     reason = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.now)
@@ -497,7 +545,7 @@ class Thread(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     parent_id = db.Column(db.Integer, db.ForeignKey('channel.id'), nullable=False)
-    owner_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
+    owner_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     message_count = db.Column(db.Integer, default=0)
     member_count = db.Column(db.Integer, default=0)
     rate_limit_per_user = db.Column(db.Integer, default=0)
@@ -517,7 +565,8 @@ class CustomEmoji(db.Model):
     server_id = db.Column(db.Integer, db.ForeignKey('server.id'), nullable=False)
     name = db.Column(db.String(32), nullable=False)
     image_url = db.Column(db.String, nullable=False)
-    creator_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=True)
+    thumbnail_url = db.Column(db.String, nullable=True)  # 64 px copy for chat views (thumbnails.py)
+    creator_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
     require_colons = db.Column(db.Boolean, default=True)
     managed = db.Column(db.Boolean, default=False)
     animated = db.Column(db.Boolean, default=False)
@@ -543,9 +592,9 @@ class ServerBan(db.Model):
     """Server bans"""
     id = db.Column(db.Integer, primary_key=True)
     server_id = db.Column(db.Integer, db.ForeignKey('server.id'), nullable=False)
-    user_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     reason = db.Column(db.String(512), nullable=True)
-    moderator_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
+    moderator_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.now)
     expires_at = db.Column(db.DateTime, nullable=True)  # Temporary bans
     
@@ -556,7 +605,7 @@ class AuditLog(db.Model):
     """Server audit logs"""
     id = db.Column(db.Integer, primary_key=True)
     server_id = db.Column(db.Integer, db.ForeignKey('server.id'), nullable=False)
-    user_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
     target_id = db.Column(db.String, nullable=True)  # Target user/channel/role ID
     action_type = db.Column(db.Integer, nullable=False)  # Action type enum
     options = db.Column(db.Text, nullable=True)  # JSON additional options
@@ -585,7 +634,7 @@ class Webhook(db.Model):
 class UserPresence(db.Model):
     """User presence/activity status"""
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     status = db.Column(db.String(20), default='offline')  # online, idle, dnd, invisible, offline
     activities = db.Column(db.Text, nullable=True)  # JSON array of activities
     client_status = db.Column(db.Text, nullable=True)  # JSON client platforms
@@ -596,8 +645,8 @@ class UserPresence(db.Model):
 class Friendship(db.Model):
     """User friendships"""
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
-    friend_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    friend_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     status = db.Column(db.String(20), default='pending')  # pending, accepted, blocked
     created_at = db.Column(db.DateTime, default=datetime.now)
     accepted_at = db.Column(db.DateTime, nullable=True)
@@ -612,7 +661,7 @@ class Friendship(db.Model):
 class UserSettings(db.Model):
     """User client settings"""
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False, unique=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, unique=True)
     theme = db.Column(db.String(10), default='dark')  # dark, light
     language = db.Column(db.String(10), default='en-US')
     show_current_game = db.Column(db.Boolean, default=True)
@@ -640,7 +689,7 @@ class UserSettings(db.Model):
 class NotificationSettings(db.Model):
     """Notification preferences"""
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     server_id = db.Column(db.Integer, db.ForeignKey('server.id'), nullable=True)
     channel_id = db.Column(db.Integer, db.ForeignKey('channel.id'), nullable=True)
     notification_type = db.Column(db.String(20), default='all')  # all, mentions, nothing
@@ -664,7 +713,7 @@ class Application(db.Model):
     bot_require_code_grant = db.Column(db.Boolean, default=False)
     terms_of_service_url = db.Column(db.String, nullable=True)
     privacy_policy_url = db.Column(db.String, nullable=True)
-    owner_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
+    owner_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     verify_key = db.Column(db.String, nullable=False)
     team_id = db.Column(db.String, nullable=True)
     guild_id = db.Column(db.Integer, nullable=True)
@@ -699,7 +748,7 @@ class SlashCommand(db.Model):
 class Embed(db.Model):
     """Message embeds"""
     id = db.Column(db.Integer, primary_key=True)
-    message_id = db.Column(db.BigInteger, db.ForeignKey('messages.id'), nullable=False)
+    message_id = db.Column(db.BigInteger, db.ForeignKey('messages.id'), nullable=False, index=True)
     title = db.Column(db.String(256), nullable=True)
     embed_type = db.Column(db.String(20), default='rich')
     description = db.Column(db.String(4096), nullable=True)
@@ -719,7 +768,7 @@ class Embed(db.Model):
 class MessageAttachment(db.Model):
     """Message file attachments"""
     id = db.Column(db.Integer, primary_key=True)
-    message_id = db.Column(db.BigInteger, db.ForeignKey('messages.id'), nullable=False)
+    message_id = db.Column(db.BigInteger, db.ForeignKey('messages.id'), nullable=False, index=True)
     filename = db.Column(db.String(256), nullable=False)
     content_type = db.Column(db.String(100), nullable=True)
     size = db.Column(db.Integer, nullable=False)
@@ -737,7 +786,7 @@ class VoiceState(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     server_id = db.Column(db.Integer, db.ForeignKey('server.id'), nullable=False)
     channel_id = db.Column(db.Integer, db.ForeignKey('channel.id'), nullable=True)
-    user_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     session_id = db.Column(db.String, nullable=False)
     deaf = db.Column(db.Boolean, default=False)
     mute = db.Column(db.Boolean, default=False)
@@ -758,7 +807,7 @@ class ScheduledEvent(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     server_id = db.Column(db.Integer, db.ForeignKey('server.id'), nullable=False)
     channel_id = db.Column(db.Integer, db.ForeignKey('channel.id'), nullable=True)
-    creator_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
+    creator_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.String(1000), nullable=True)
     scheduled_start_time = db.Column(db.DateTime, nullable=False)
@@ -788,7 +837,7 @@ class Integration(db.Model):
     enable_emoticons = db.Column(db.Boolean, default=True)
     expire_behavior = db.Column(db.Integer, default=0)
     expire_grace_period = db.Column(db.Integer, default=1)
-    user_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     account = db.Column(db.Text, nullable=True)  # JSON account info
     synced_at = db.Column(db.DateTime, nullable=True)
     subscriber_count = db.Column(db.Integer, default=0)
@@ -865,3 +914,52 @@ class UserSession(db.Model):
         Index('idx_user_sessions', 'user_id', 'is_active'),
         Index('idx_session_activity', 'last_activity'),
     )
+
+class SchemaVersion(db.Model):
+    """Applied schema migrations (see schema_migrations.py)"""
+    __tablename__ = 'schema_version'
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(200), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.now, nullable=False)
+
+class ImageAsset(db.Model):
+    """Content-addressed image bytes served from /assets/<hash> (see images.py)"""
+    __tablename__ = 'image_asset'
+    id = db.Column(db.Integer, primary_key=True)
+    hash = db.Column(db.String(64), unique=True, nullable=False)  # sha256 of data
+    source_hash = db.Column(db.String(64), nullable=False)  # sha256 of the uploaded original
+    variant = db.Column(db.String(16), nullable=False, default='original')  # 'original' or longest edge in px
+    mime_type = db.Column(db.String(50), nullable=False)
+    width = db.Column(db.Integer, nullable=True)
+    height = db.Column(db.Integer, nullable=True)
+    size = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+    # On originals: the sizes copies were made for (comma-separated), including sizes the image is too small for
+    variant_sizes = db.Column(db.String(64), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.now, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint('source_hash', 'variant', name='uq_image_asset_source_variant'),
+    )
+
+class Job(db.Model):
+    """Durable background job queue (see jobs.py)"""
+    __tablename__ = 'job'
+    id = db.Column(BigIntegerPK, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')  # JSON keyword arguments for the handler
+    priority = db.Column(db.Integer, nullable=False, default=100)  # Lower runs first
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.now)  # Not before; pushed back on retry
+    locked_by = db.Column(db.String(100), nullable=True)  # Worker currently running it
+    locked_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    progress = db.Column(db.Text, nullable=True)  # JSON reported by long-running handlers
+    created_at = db.Column(db.DateTime, default=datetime.now, nullable=False)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        Index('idx_job_claim', 'status', 'priority', 'run_at'),
+    )
@@ -0,0 +1,131 @@
+"""
+SQLAlchemy implementation of the shared Repository, used by the Flask routes and streamlit_app
+Primary-key and access lookups go through cache.py, channel history through archival (hot and
+archived messages merged), and reaction counts through the message_reaction_counts summary.
+History reads (channel and DM pages, conversation lists) go to the read replica when one is
+configured, except right after the user's own write. Channels carry a message_version that
+changes whenever a message is edited, pinned or deleted, so pollers can detect changes with
+an indexed max(id) and a primary-key lookup instead of counting the channel
+"""
+
+from datetime import datetime
+
+from sqlalchemy import and_, case, event, func, inspect, or_, select, update
+from sqlalchemy.orm import Session, defer, joinedload
+
+from app import db
+from archival import channel_history
+from cache import accessible_server_ids, cached_get_many
+from db_routing import replica_reads
+from models import User, Server, Channel, Message, DirectMessage
+from reactions import reaction_counts_for, toggle_reaction
+from repository import Repository, decode_cursor, page_of
+
+def _cursor_position(cursor):
+    """(created_at, id) from a cursor, or (None, None) for the newest page"""
+    position = decode_cursor(cursor)
+    if position is None:
+        return None, None
+    try:
+        return datetime.fromisoformat(position[0]), position[1]
+    except ValueError:
+        return None, None
+
+class OrmRepository(Repository):
+    backend = 'sqlalchemy'
+
+    def user_servers(self, user_id):
+        # Member-or-owner ids come from the access cache; the rows themselves in one query
+        server_ids = accessible_server_ids(user_id)
+        if not server_ids:
+            return []
+        return Server.query.options(defer(Server.logo_url), defer(Server.banner_url)).filter(
+            Server.id.in_(server_ids), Server.deleting.is_(False)
+        ).order_by(Server.name).all()
+
+    def server_channels(self, server_id):
+        return Channel.query.filter_by(server_id=server_id).order_by(Channel.name).all()
+
+    def channel_messages(self, channel_id, limit=50, cursor=None):
+        before, before_id = _cursor_position(cursor)
+        with replica_reads():
+            messages = channel_history(channel_id, limit=limit, before=before, before_id=before_id)
+        # channel_history returns oldest first; page_of expects newest first
+        return page_of(messages[::-1], limit, lambda m: m.created_at, lambda m: m.id)
+
+    def direct_messages(self, user_id, other_id, limit=50, cursor=None):
+        query = DirectMessage.query.options(joinedload(DirectMessage.sender)).filter(
+            or_(
+                and_(DirectMessage.sender_id == user_id, DirectMessage.recipient_id == other_id),
+                and_(DirectMessage.sender_id == other_id, DirectMessage.recipient_id == user_id)
+            )
+        )
+        before, before_id = _cursor_position(cursor)
+        if before is not None:
+            query = query.filter(or_(
+                DirectMessage.created_at < before,
+                and_(DirectMessage.created_at == before, DirectMessage.id < before_id)
+            ))
+        with replica_reads():
+            messages = query.order_by(DirectMessage.created_at.desc(), DirectMessage.id.desc()).limit(limit).all()
+        return page_of(messages, limit, lambda m: m.created_at, lambda m: m.id)
+
+    def dm_conversations(self, user_id):
+        """[(partner User, last message time)], most recent first"""
+        partner = case(
+            (DirectMessage.sender_id == user_id, DirectMessage.recipient_id), else_=DirectMessage.sender_id
+        ).label('partner_id')
+        with replica_reads():
+            latest = db.session.execute(
+                select(partner, func.max(DirectMessage.created_at).label('last_at'))
+                .where(or_(DirectMessage.sender_id == user_id, DirectMessage.recipient_id == user_id))
+                .group_by(partner)
+                .order_by(func.max(DirectMessage.created_at).desc())
+            ).all()
+        # Rows that end up in the shared cache are read from the primary
+        users = self.users_by_id([partner_id for partner_id, _ in latest if partner_id != user_id])
+        return [(users[partner_id], last_at) for partner_id, last_at in latest if partner_id in users]
+
+    def reaction_counts(self, message_ids):
+        return reaction_counts_for(message_ids)
+
+    def users_by_id(self, user_ids):
+        return cached_get_many(User, user_ids)
+
+    def send_message(self, channel_id, author_id, content):
+        message = Message(content=content, author_id=author_id, channel_id=channel_id)
+        db.session.add(message)
+        db.session.commit()
+        return message
+
+    def send_direct_message(self, sender_id, recipient_id, content, **fields):
+        dm = DirectMessage(content=content, sender_id=sender_id, recipient_id=recipient_id, **fields)
+        db.session.add(dm)
+        db.session.commit()
+        return dm
+
+    def toggle_reaction(self, message_id, user_id, emoji):
+        action = toggle_reaction(message_id, user_id, emoji)
+        db.session.commit()
+        return action
+
+repository = OrmRepository()
+
+# Columns whose change is visible in a rendered channel
+_VISIBLE_MESSAGE_COLUMNS = ('content', 'edited_at', 'is_pinned')
+
+@event.listens_for(Session, 'after_flush')
+def _bump_channel_versions(session, flush_context):
+    """Advance message_version of channels whose existing messages changed or went away"""
+    channel_ids = {message.channel_id for message in session.deleted if isinstance(message, Message)}
+    for message in session.dirty:
+        if isinstance(message, Message) and any(
+            inspect(message).attrs[column].history.has_changes() for column in _VISIBLE_MESSAGE_COLUMNS
+        ):
+            channel_ids.add(message.channel_id)
+    channel_ids.discard(None)
+    if channel_ids:
+        session.connection().execute(
+            update(Channel).where(Channel.id.in_(channel_ids))
+            .values(message_version=Channel.message_version + 1)
+        )
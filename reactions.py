@@ -0,0 +1,73 @@
+"""
+Message reaction helpers
+Keeps the message_reaction_counts summary in step with message_reaction rows
+"""
+
+from sqlalchemy import func
+
+from app import db
+from models import MessageReaction, MessageReactionCount
+
+def toggle_reaction(message_id, user_id, emoji):
+    """Add or remove a user's reaction and adjust the summary in the same transaction.
+
+    Returns 'added' or 'removed'. The caller commits.
+    """
+    existing = MessageReaction.query.filter_by(
+        message_id=message_id,
+        user_id=user_id,
+        emoji=emoji
+    ).first()
+
+    if existing:
+        db.session.delete(existing)
+        _adjust_count(message_id, emoji, -1)
+        return 'removed'
+
+    db.session.add(MessageReaction(message_id=message_id, user_id=user_id, emoji=emoji))
+    _adjust_count(message_id, emoji, 1)
+    return 'added'
+
+def _adjust_count(message_id, emoji, delta):
+    """Apply delta to one summary row, creating or dropping it as needed"""
+    table = MessageReactionCount.__table__
+    key = (table.c.message_id == message_id) & (table.c.emoji == emoji)
+
+    updated = db.session.execute(
+        table.update().where(key).values(count=table.c.count + delta)
+    ).rowcount
+
+    if not updated and delta > 0:
+        db.session.execute(table.insert().values(message_id=message_id, emoji=emoji, count=delta))
+    elif updated and delta < 0:
+        db.session.execute(table.delete().where(key & (table.c.count <= 0)))
+
+def reaction_counts_for(message_ids):
+    """Return {message_id: {emoji: count}} for all given messages in one query"""
+    counts = {message_id: {} for message_id in message_ids}
+    if not counts:
+        return counts
+
+    rows = db.session.query(
+        MessageReactionCount.message_id,
+        MessageReactionCount.emoji,
+        MessageReactionCount.count
+    ).filter(MessageReactionCount.message_id.in_(list(counts))).all()
+
+    for message_id, emoji, count in rows:
+        counts[message_id][emoji] = count
+    return counts
+
+def rebuild_reaction_counts():
+    """Recompute the whole summary from message_reaction (backfill or repair)"""
+    table = MessageReactionCount.__table__
+    db.session.execute(table.delete())
+    db.session.execute(table.insert().from_select(
+        ['message_id', 'emoji', 'count'],
+        db.session.query(
+            MessageReaction.message_id,
+            MessageReaction.emoji,
+            func.count(MessageReaction.id)
+        ).group_by(MessageReaction.message_id, MessageReaction.emoji)
+    ))
+    db.session.commit()
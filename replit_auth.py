@@ -19,13 +19,17 @@ from werkzeug.local import LocalProxy
 
 from app import app, db
 from models import OAuth, User
+from cache import cached_get
 
 login_manager = LoginManager(app)
 
 @login_manager.user_loader
 def load_user(user_id):
     try:
-        return User.query.filter_by(id=user_id).first()
+        # Served from the read-through cache; invalidated when the user row changes
+        user = cached_get(User, int(user_id))
+        # An account queued for deletion is signed out on its next request
+        return None if user is None or user.deleting else user
     except Exception as e:
         logging.error(f"Error loading user {user_id}: {e}")
         return None
@@ -125,8 +129,8 @@ def make_replit_blueprint():
     return replit_bp
 
 def save_user(user_claims):
-    # Check if user already exists
-    existing_user = User.query.filter_by(id=user_claims['sub']).first()
+    # Check if user already exists (Replit subjects are numeric; users.id is an integer)
+    existing_user = User.query.filter_by(id=int(user_claims['sub'])).first()
     
     if existing_user:
         # Update existing user
@@ -138,7 +142,7 @@ def save_user(user_claims):
     else:
         # Create new user
         user = User()
-        user.id = user_claims['sub']
+        user.id = int(user_claims['sub'])
         user.email = user_claims.get('email')
         user.first_name = user_claims.get('first_name')
         user.last_name = user_claims.get('last_name')
@@ -169,7 +173,7 @@ def save_user(user_claims):
     
     # Auto-add user to all public servers
     from models import Server, ServerMembership
-    public_servers = Server.query.filter_by(is_public=True).all()
+    public_servers = Server.query.filter_by(is_public=True, deleting=False).all()
     for server in public_servers:
         existing_membership = ServerMembership.query.filter_by(
             user_id=merged_user.id, 
@@ -0,0 +1,119 @@
+"""
+Shared data-access interface for the CommunicationX frontends
+The Flask routes and streamlit_app use OrmRepository (orm_repository.py, the SQLAlchemy models);
+streamlit_communicationx uses ChatStore (streamlit_store.py, its own SQLite schema). Both implement
+Repository, so history pages are keyset-paginated, page data is batch-loaded and every call is
+timed into the metrics registry the same way whichever frontend is asking
+"""
+
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+from functools import wraps
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from metrics import registry
+
+repository_latency = registry.histogram(
+    'repository_call_duration_seconds', 'Repository call latency', ('backend', 'method'))
+
+class Page(NamedTuple):
+    """One page of history, oldest first; cursor fetches the next older page (None when there is none)"""
+    items: list
+    cursor: Optional[str]
+
+def encode_cursor(created_at, ident) -> str:
+    """Opaque keyset position (created_at, id) of the oldest item on a page"""
+    if isinstance(created_at, datetime):
+        created_at = created_at.isoformat(sep=' ')
+    return f"{created_at}|{ident}"
+
+def decode_cursor(cursor) -> Optional[Tuple[str, int]]:
+    """(created_at text, id) from encode_cursor; a missing or mangled cursor means the newest page"""
+    if not cursor:
+        return None
+    created_at, _, ident = str(cursor).rpartition('|')
+    try:
+        return created_at, int(ident)
+    except ValueError:
+        return None
+
+def page_of(newest_first, limit, created_at, ident) -> Page:
+    """Build a Page from up to `limit` rows fetched newest first"""
+    items = list(reversed(newest_first))
+    cursor = None
+    if items and len(items) >= limit:
+        cursor = encode_cursor(created_at(items[0]), ident(items[0]))
+    return Page(items, cursor)
+
+class Repository(ABC):
+    """Channel, DM, server and reaction access shared by every frontend.
+
+    Row types are the backend's own (ORM objects or tuples); method names, arguments and
+    return shapes are common. Public methods of subclasses are timed automatically.
+    """
+    backend = 'base'
+
+    # Reads
+
+    @abstractmethod
+    def user_servers(self, user_id) -> list:
+        """Servers the user belongs to, ordered by name"""
+
+    @abstractmethod
+    def server_channels(self, server_id) -> list:
+        """Channels of a server, ordered by name"""
+
+    @abstractmethod
+    def channel_messages(self, channel_id, limit=50, cursor=None) -> Page:
+        """Newest `limit` channel messages before `cursor`, authors preloaded"""
+
+    @abstractmethod
+    def direct_messages(self, user_id, other_id, limit=50, cursor=None) -> Page:
+        """Newest `limit` messages between two users before `cursor`, senders preloaded"""
+
+    @abstractmethod
+    def dm_conversations(self, user_id) -> list:
+        """One entry per conversation partner, most recent first"""
+
+    @abstractmethod
+    def reaction_counts(self, message_ids) -> Dict[Any, Dict[str, int]]:
+        """{message_id: {emoji: count}} for a whole page in one query"""
+
+    @abstractmethod
+    def users_by_id(self, user_ids) -> Dict[Any, Any]:
+        """{user_id: user} for a batch of ids; unknown ids are left out"""
+
+    # Writes
+
+    @abstractmethod
+    def send_message(self, channel_id, author_id, content):
+        """Post a message to a channel"""
+
+    @abstractmethod
+    def send_direct_message(self, sender_id, recipient_id, content):
+        """Send a direct message from sender to recipient"""
+
+    @abstractmethod
+    def toggle_reaction(self, message_id, user_id, emoji):
+        """Add or remove a reaction; returns 'added' or 'removed'"""
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for name in INTERFACE:
+            method = cls.__dict__.get(name)
+            if method is not None and not getattr(method, '_timed', False):
+                setattr(cls, name, _timed(method, name))
+
+INTERFACE = [name for name, value in vars(Repository).items() if callable(value) and not name.startswith('_')]
+
+def _timed(method, name):
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            repository_latency.observe(time.perf_counter() - started, backend=self.backend, method=name)
+    wrapper._timed = True
+    return wrapper
@@ -2,21 +2,33 @@ from flask import session, render_template, request, redirect, url_for, flash, j
 from flask_login import current_user, login_user
 from app import app, db, limiter
 from replit_auth import require_login, make_replit_blueprint
+from archival import reaction_summary
+from orm_repository import repository
+from sanitizer import sanitize_input
+from cache import init_cache, cached_get, cached_get_or_404, is_server_member, can_access_server, invalidate, invalidate_membership
+from fragments import init_fragments
+from images import init_images, parse_data_url, save_image
+from deletion import schedule_server_deletion
+from jobs import PRIORITY_HIGH, enqueue, init_jobs, job
 from models import User, Server, Channel, Message, DirectMessage, ServerMembership, Call, CallMessage, Voicemail, Invitation, SharedFile, MessageReaction, MessageReport
 from datetime import datetime
-import bleach
 import hashlib
 import uuid
 import os
-import base64
 import logging
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import defer
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 import io
 
 app.register_blueprint(make_replit_blueprint(), url_prefix="/auth")
 
+init_cache(app)
+init_fragments(app)
+init_images(app)
+init_jobs(app)
+
 # Register admin routes
 try:
     from admin_routes import admin, setup_super_admin
@@ -29,16 +41,6 @@ try:
 except Exception as e:
     print(f"Error registering admin routes: {e}")
 
-def sanitize_input(text, max_length=1000):
-    """Sanitize and validate user input"""
-    if not text:
-        return ""
-    # Strip whitespace and limit length
-    text = text.strip()[:max_length]
-    # Allow basic HTML tags for messages
-    allowed_tags = ['b', 'i', 'u', 'em', 'strong', 'br']
-    return bleach.clean(text, tags=allowed_tags, strip=True)
-
 @app.before_request
 def make_session_permanent():
     session.permanent = True
@@ -46,10 +48,6 @@ def make_session_permanent():
 @app.route('/')
 def index():
     try:
-        # Initialize database on first request only
-        from app import init_database
-        init_database()
-        
         if current_user.is_authenticated:
             return redirect(url_for('home'))
         return render_template('splash.html')
@@ -125,7 +123,7 @@ def custom_auth():
         
         # Auto-join public servers
         from models import ServerMembership
-        public_servers = Server.query.filter_by(is_public=True).all()
+        public_servers = Server.query.filter_by(is_public=True, deleting=False).all()
         for server in public_servers:
             membership = ServerMembership(user_id=new_user.id, server_id=server.id)
             db.session.add(membership)
@@ -189,12 +187,10 @@ def custom_signup():
             return render_template('signup.html')
         
         try:
-            # Create new user
-            user_id = str(uuid.uuid4())
+            # Create new user (id is assigned by the database)
             password_hash = hashlib.sha256(password.encode()).hexdigest()
             
             user = User()
-            user.id = user_id
             user.first_name = first_name
             user.last_name = last_name
             user.username = username
@@ -249,7 +245,7 @@ def handle_custom_login():
     elif email:
         user = User.query.filter_by(email=email).first()
     
-    if not user:
+    if not user or user.deleting:
         flash('Invalid credentials.', 'error')
         return redirect(url_for('custom_login'))
     
@@ -267,33 +263,20 @@ def handle_custom_login():
 @app.route('/home')
 @require_login
 def home():
-    # Get user's servers
-    user_servers = db.session.query(Server).join(ServerMembership).filter(
-        ServerMembership.user_id == current_user.id
-    ).all()
-    
-    # Get owned servers
-    owned_servers = Server.query.filter_by(owner_id=current_user.id).all()
-    
-    # Combine and deduplicate
-    all_servers = list({server.id: server for server in user_servers + owned_servers}.values())
+    # Joined and owned servers: ids from the access cache, rows in a single query
+    all_servers = repository.user_servers(current_user.id)
     
     return render_template('home.html', servers=all_servers)
 
 @app.route('/server/<int:server_id>')
 @require_login
 def server_view(server_id):
-    server = Server.query.get_or_404(server_id)
+    server = cached_get_or_404(Server, server_id)
     
     # Check if user has access to this server
-    is_member = ServerMembership.query.filter_by(
-        user_id=current_user.id, 
-        server_id=server_id
-    ).first() is not None
-    
     is_owner = server.owner_id == current_user.id
     
-    if not (is_member or is_owner):
+    if not can_access_server(current_user.id, server_id):
         flash('You do not have access to this server.', 'error')
         return redirect(url_for('home'))
     
@@ -305,26 +288,42 @@ def server_view(server_id):
         db.session.commit()
     
     messages = []
+    older_cursor = None
     if channel:
-        messages = Message.query.filter_by(channel_id=channel.id).order_by(Message.created_at.desc()).limit(50).all()
-        messages.reverse()
+        # Recent messages with authors and attachments preloaded; older history comes from the archive
+        messages, older_cursor = repository.channel_messages(channel.id, limit=50, cursor=request.args.get('before'))
+    
+    # Reaction counts for every visible message in one query
+    reaction_counts = repository.reaction_counts([message.id for message in messages if not getattr(message, 'is_archived', False)])
+    for message in messages:
+        if getattr(message, 'is_archived', False):
+            reaction_counts[message.id] = reaction_summary(message)
     
     members = db.session.query(User).join(ServerMembership).filter(
         ServerMembership.server_id == server_id
     ).all()
     
+    # Only the newest files are listed; never pull the stored file bytes for the sidebar
+    recent_files = SharedFile.query.options(defer(SharedFile.file_data)).filter_by(
+        server_id=server_id
+    ).order_by(SharedFile.created_at.desc()).limit(5).all()
+    recent_files.reverse()
+    
     return render_template('server.html', 
                          server=server, 
                          channel=channel, 
                          messages=messages, 
                          members=members,
+                         recent_files=recent_files,
+                         reaction_counts=reaction_counts,
+                         older_cursor=older_cursor,
                          is_owner=is_owner)
 
 @app.route('/server/<int:server_id>/send_message', methods=['POST'])
 @require_login
 @limiter.limit("30 per minute")
 def send_message(server_id):
-    server = Server.query.get_or_404(server_id)
+    server = cached_get_or_404(Server, server_id)
     content = sanitize_input(request.form.get('message', ''), max_length=2000)
     
     if not content or len(content.strip()) == 0:
@@ -336,14 +335,7 @@ def send_message(server_id):
         return redirect(url_for('server_view', server_id=server_id))
     
     # Check access
-    is_member = ServerMembership.query.filter_by(
-        user_id=current_user.id, 
-        server_id=server_id
-    ).first() is not None
-    
-    is_owner = server.owner_id == current_user.id
-    
-    if not (is_member or is_owner):
+    if not can_access_server(current_user.id, server_id):
         flash('You do not have access to this server.', 'error')
         return redirect(url_for('home'))
     
@@ -355,13 +347,7 @@ def send_message(server_id):
         db.session.commit()
     
     try:
-        message = Message(
-            content=content,
-            author_id=current_user.id,
-            channel_id=channel.id
-        )
-        db.session.add(message)
-        db.session.commit()
+        repository.send_message(channel.id, current_user.id, content)
     except SQLAlchemyError as e:
         db.session.rollback()
         logging.error(f"Error sending message: {e}")
@@ -439,7 +425,7 @@ def create_server():
 @app.route('/server/<int:server_id>/add_member', methods=['POST'])
 @require_login
 def add_member(server_id):
-    server = Server.query.get_or_404(server_id)
+    server = cached_get_or_404(Server, server_id)
     
     if server.owner_id != current_user.id:
         flash('Only the server owner can add members.', 'error')
@@ -471,6 +457,7 @@ def add_member(server_id):
     )
     db.session.add(membership)
     db.session.commit()
+    invalidate_membership(user.id, server_id)
     
     flash(f'User {username} added to server successfully!', 'success')
     return redirect(url_for('server_view', server_id=server_id))
@@ -478,36 +465,23 @@ def add_member(server_id):
 @app.route('/direct_messages')
 @require_login
 def direct_messages():
-    # Get all users who have had conversations with current user
-    conversations = db.session.query(User).join(
-        DirectMessage,
-        (DirectMessage.sender_id == User.id) | (DirectMessage.recipient_id == User.id)
-    ).filter(
-        (DirectMessage.sender_id == current_user.id) | (DirectMessage.recipient_id == current_user.id),
-        User.id != current_user.id
-    ).distinct().all()
+    # Everyone the current user has talked to, most recent conversation first
+    conversations = [user for user, _ in repository.dm_conversations(current_user.id)]
     
     # Get all users for potential new conversations
-    all_users = User.query.filter(User.id != current_user.id).all()
+    all_users = User.query.filter(User.id != current_user.id, User.deleting.is_(False)).all()
     
     return render_template('direct_messages.html', 
                          conversations=conversations, 
                          all_users=all_users)
 
-@app.route('/dm/<user_id>')
+@app.route('/dm/<int:user_id>')
 @require_login
 def dm_conversation(user_id):
-    other_user = User.query.get_or_404(user_id)
-    
-    # Get messages between current user and other user
-    messages = DirectMessage.query.filter(
-        ((DirectMessage.sender_id == current_user.id) & (DirectMessage.recipient_id == user_id)) |
-        ((DirectMessage.sender_id == user_id) & (DirectMessage.recipient_id == current_user.id))
-    ).order_by(DirectMessage.created_at.desc()).limit(50).all()
-    
-    messages.reverse()
+    other_user = cached_get_or_404(User, user_id)
     
-    # Mark messages as read
+    # Mark messages as read first: the commit expires loaded rows, which would reload each
+    # message of the page one query at a time while rendering
     DirectMessage.query.filter(
         DirectMessage.sender_id == user_id,
         DirectMessage.recipient_id == current_user.id,
@@ -515,29 +489,26 @@ def dm_conversation(user_id):
     ).update({DirectMessage.read_at: datetime.now()})
     db.session.commit()
     
+    # Messages between current user and other user, a keyset page at a time
+    messages, older_cursor = repository.direct_messages(current_user.id, user_id, cursor=request.args.get('before'))
+    
     return render_template('direct_messages.html', 
                          other_user=other_user, 
                          messages=messages,
-                         all_users=User.query.filter(User.id != current_user.id).all())
+                         older_cursor=older_cursor,
+                         all_users=User.query.filter(User.id != current_user.id, User.deleting.is_(False)).all())
 
-@app.route('/send_dm/<user_id>', methods=['POST'])
+@app.route('/send_dm/<int:user_id>', methods=['POST'])
 @require_login
 def send_dm(user_id):
-    other_user = User.query.get_or_404(user_id)
+    other_user = cached_get_or_404(User, user_id)
     content = request.form.get('message', '').strip()
     
     if not content:
         flash('Message cannot be empty.', 'error')
         return redirect(url_for('dm_conversation', user_id=user_id))
     
-    dm = DirectMessage(
-        content=content,
-        sender_id=current_user.id,
-        recipient_id=user_id,
-        status='sent'  # Set initial status as sent
-    )
-    db.session.add(dm)
-    db.session.commit()
+    dm = repository.send_direct_message(current_user.id, user_id, content, status='sent')  # Initial status is sent
     
     # Emit real-time status update
     from socket_events import socketio
@@ -549,10 +520,10 @@ def send_dm(user_id):
     
     return redirect(url_for('dm_conversation', user_id=user_id))
 
-@app.route('/call/<user_id>/<call_type>')
+@app.route('/call/<int:user_id>/<call_type>')
 @require_login
 def initiate_call(user_id, call_type):
-    other_user = User.query.get_or_404(user_id)
+    other_user = cached_get_or_404(User, user_id)
     
     if call_type not in ['audio', 'video']:
         flash('Invalid call type.', 'error')
@@ -717,8 +688,9 @@ def edit_profile():
         if resized_image_data and resized_image_data.startswith('data:image/'):
             try:
                 # Validate data URL format
-                if 'base64,' in resized_image_data:
-                    current_user.profile_image_url = resized_image_data
+                image_data = parse_data_url(resized_image_data)
+                if image_data:
+                    current_user.profile_image_url = save_image(image_data)
                     flash('Profile photo updated successfully!', 'success')
                 else:
                     flash('Invalid image data format.', 'error')
@@ -736,7 +708,7 @@ def edit_profile():
                 
                 if file_ext in allowed_extensions:
                     try:
-                        # Read file and convert to base64 data URL
+                        # Read file and store it as an image asset
                         file_data = profile_image.read()
                         
                         # Check file size (limit to 5MB)
@@ -744,12 +716,7 @@ def edit_profile():
                             flash('Image file too large. Please use an image under 5MB.', 'error')
                             return render_template('edit_profile.html', user=current_user)
                         
-                        # Create data URL
-                        mime_type = f"image/{file_ext[1:]}" if file_ext != '.jpg' else "image/jpeg"
-                        base64_data = base64.b64encode(file_data).decode('utf-8')
-                        data_url = f"data:{mime_type};base64,{base64_data}"
-                        
-                        current_user.profile_image_url = data_url
+                        current_user.profile_image_url = save_image(file_data)
                         flash('Profile photo uploaded successfully!', 'success')
                         
                     except Exception as e:
@@ -766,6 +733,7 @@ def edit_profile():
             
         current_user.updated_at = datetime.now()
         db.session.commit()
+        invalidate(User, current_user.id)
         flash('Profile updated successfully!', 'success')
         return redirect(url_for('profile'))
     
@@ -778,7 +746,7 @@ def voicemails():
     sent_voicemails = Voicemail.query.filter_by(sender_id=current_user.id).order_by(Voicemail.created_at.desc()).all()
     return render_template('voicemails.html', received=received_voicemails, sent=sent_voicemails)
 
-@app.route('/send_voicemail/<user_id>', methods=['POST'])
+@app.route('/send_voicemail/<int:user_id>', methods=['POST'])
 @require_login
 def send_voicemail(user_id):
     audio_url = request.form.get('audio_url')
@@ -815,7 +783,7 @@ def mark_voicemail_read(voicemail_id):
 def auto_add_user_to_servers(user):
     """Automatically add new users to all public servers"""
     try:
-        public_servers = Server.query.filter_by(is_public=True).all()
+        public_servers = Server.query.filter_by(is_public=True, deleting=False).all()
         for server in public_servers:
             existing_membership = ServerMembership.query.filter_by(
                 user_id=user.id, 
@@ -836,15 +804,10 @@ def auto_add_user_to_servers(user):
 @app.route('/server_call/<int:server_id>')
 @require_login
 def server_call(server_id):
-    server = Server.query.get_or_404(server_id)
+    server = cached_get_or_404(Server, server_id)
     
     # Check if user is member of server
-    membership = ServerMembership.query.filter_by(
-        user_id=current_user.id,
-        server_id=server_id
-    ).first()
-    
-    if not membership:
+    if not is_server_member(current_user.id, server_id):
         flash('You are not a member of this server', 'error')
         return redirect(url_for('home'))
     
@@ -901,7 +864,7 @@ def send_call_message(call_id):
 @app.route('/update_server_logo/<int:server_id>', methods=['POST'])
 @require_login
 def update_server_logo(server_id):
-    server = Server.query.get_or_404(server_id)
+    server = cached_get_or_404(Server, server_id)
     
     if server.owner_id != current_user.id:
         flash('Only the server owner can update the logo.', 'error')
@@ -915,7 +878,7 @@ def update_server_logo(server_id):
         
         if file_ext in allowed_extensions:
             try:
-                # Read file and convert to base64 data URL
+                # Read file and store it as an image asset
                 file_data = logo_file.read()
                 
                 # Check file size (limit to 2MB)
@@ -923,13 +886,9 @@ def update_server_logo(server_id):
                     flash('Logo file too large. Please use an image under 2MB.', 'error')
                     return redirect(url_for('server_view', server_id=server_id))
                 
-                # Create data URL
-                mime_type = f"image/{file_ext[1:]}" if file_ext != '.jpg' else "image/jpeg"
-                base64_data = base64.b64encode(file_data).decode('utf-8')
-                data_url = f"data:{mime_type};base64,{base64_data}"
-                
-                server.logo_url = data_url
+                server.logo_url = save_image(file_data)
                 db.session.commit()
+                invalidate(Server, server_id)
                 flash('Server logo updated successfully!', 'success')
                 
             except Exception as e:
@@ -943,7 +902,7 @@ def update_server_logo(server_id):
 @require_login
 def edit_server(server_id):
     """Edit server information"""
-    server = Server.query.get_or_404(server_id)
+    server = cached_get_or_404(Server, server_id)
     
     # Only server owner can edit
     if server.owner_id != current_user.id:
@@ -968,6 +927,7 @@ def edit_server(server_id):
     server.is_public = is_public
     
     db.session.commit()
+    invalidate(Server, server_id)
     
     # If changed to public, auto-add all users
     if is_public:
@@ -984,6 +944,8 @@ def edit_server(server_id):
                     db.session.add(membership)
             
             db.session.commit()
+            for user in all_users:
+                invalidate_membership(user.id, server_id)
             logging.info(f"Auto-added all users to public server {server_id}")
         except Exception as e:
             logging.error(f"Error auto-adding users to public server: {e}")
@@ -1007,9 +969,8 @@ def delete_server(server_id):
         flash('Server name confirmation does not match', 'error')
         return redirect(url_for('server_view', server_id=server_id))
     
-    # Delete server (cascade will handle channels, messages, memberships, etc.)
-    db.session.delete(server)
-    db.session.commit()
+    # Hidden now; channels, messages, memberships etc. are removed in batches by a background job
+    schedule_server_deletion(server)
     
     flash(f'Server "{server.name}" has been permanently deleted', 'success')
     return redirect(url_for('home'))
@@ -1017,17 +978,10 @@ def delete_server(server_id):
 @app.route('/upload_file/<int:server_id>', methods=['POST'])
 @require_login
 def upload_file(server_id):
-    server = Server.query.get_or_404(server_id)
+    server = cached_get_or_404(Server, server_id)
     
-    # Check if user is member of server
-    is_member = ServerMembership.query.filter_by(
-        user_id=current_user.id, 
-        server_id=server_id
-    ).first() is not None
-    
-    is_owner = server.owner_id == current_user.id
-    
-    if not (is_member or is_owner):
+    # Check if user is member or owner of server
+    if not can_access_server(current_user.id, server_id):
         flash('You do not have access to this server.', 'error')
         return redirect(url_for('home'))
     
@@ -1086,14 +1040,7 @@ def download_file(file_id):
     
     # Check if user has access to the file
     if shared_file.server_id:
-        is_member = ServerMembership.query.filter_by(
-            user_id=current_user.id, 
-            server_id=shared_file.server_id
-        ).first() is not None
-        
-        is_owner = shared_file.server.owner_id == current_user.id
-        
-        if not (is_member or is_owner):
+        if not can_access_server(current_user.id, shared_file.server_id):
             flash('You do not have access to this file.', 'error')
             return redirect(url_for('home'))
     
@@ -1121,18 +1068,20 @@ def create_invitation():
         uses_left=5  # Allow 5 uses per invitation
     )
     db.session.add(invitation)
-    db.session.commit()
     
     base_url = request.url_root.rstrip('/')
     invite_url = f"{base_url}/invite/{code}"
     
-    # Send email if email address is provided
+    # Email is sent by a background job, committed together with the invitation
     if email:
-        try:
-            send_invitation_email(email, invite_url, current_user.username or current_user.first_name or 'A friend')
-            flash(f'Invitation sent to {email}!', 'success')
-        except Exception as e:
-            flash('Invitation created but email could not be sent. You can still share the link manually.', 'warning')
+        enqueue('send_invitation_email', {
+            'to_email': email,
+            'invite_url': invite_url,
+            'inviter_name': current_user.username or current_user.first_name or 'A friend'
+        })
+    db.session.commit()
+    if email:
+        flash(f'Invitation sent to {email}!', 'success')
     
     return jsonify({
         'success': True,
@@ -1141,8 +1090,9 @@ def create_invitation():
         'email_sent': bool(email)
     })
 
+@job('send_invitation_email', priority=PRIORITY_HIGH, max_attempts=8)
 def send_invitation_email(to_email, invite_url, inviter_name):
-    """Send invitation email using a simple email service"""
+    """Send invitation email using a simple email service (runs as a background job)"""
     import smtplib
     from email.mime.text import MIMEText
     from email.mime.multipart import MIMEMultipart
@@ -1199,10 +1149,10 @@ def join_by_invitation(code):
     flash('Please sign up to join CommunicationX!', 'info')
     return redirect(url_for('custom_signup'))
 
-@app.route('/start_call/<call_type>/<user_id>')
+@app.route('/start_call/<call_type>/<int:user_id>')
 @require_login
 def start_call(call_type, user_id):
-    other_user = User.query.get_or_404(user_id)
+    other_user = cached_get_or_404(User, user_id)
     
     if call_type not in ['audio', 'video']:
         flash('Invalid call type.', 'error')
@@ -1235,15 +1185,10 @@ def start_call(call_type, user_id):
 @app.route('/start_server_call/<int:server_id>/<call_type>')
 @require_login
 def start_server_call(server_id, call_type):
-    server = Server.query.get_or_404(server_id)
+    server = cached_get_or_404(Server, server_id)
     
     # Check if user is member of server
-    membership = ServerMembership.query.filter_by(
-        user_id=current_user.id,
-        server_id=server_id
-    ).first()
-    
-    if not membership and server.owner_id != current_user.id:
+    if not can_access_server(current_user.id, server_id):
         flash('You are not a member of this server', 'error')
         return redirect(url_for('home'))
     
@@ -1295,28 +1240,8 @@ def react_to_message(message_id):
         return jsonify({'error': 'Emoji required'}), 400
     
     try:
-        # Check if reaction already exists
-        existing_reaction = MessageReaction.query.filter_by(
-            message_id=message_id,
-            user_id=current_user.id,
-            emoji=emoji
-        ).first()
-        
-        if existing_reaction:
-            # Remove reaction if it exists
-            db.session.delete(existing_reaction)
-            action = 'removed'
-        else:
-            # Add new reaction
-            reaction = MessageReaction(
-                message_id=message_id,
-                user_id=current_user.id,
-                emoji=emoji
-            )
-            db.session.add(reaction)
-            action = 'added'
-        
-        db.session.commit()
+        # Toggle the reaction and its summary count together
+        action = repository.toggle_reaction(message_id, current_user.id, emoji)
         return jsonify({'success': True, 'action': action})
     except Exception as e:
         db.session.rollback()
@@ -1397,6 +1322,9 @@ def forward_message(message_id):
     
     if not recipient_id:
         return jsonify({'error': 'Recipient required'}), 400
+    recipient = cached_get(User, recipient_id)
+    if recipient is None or recipient.deleting:
+        return jsonify({'error': 'Recipient not found'}), 404
     
     try:
         # Create direct message with forwarded content
@@ -0,0 +1,44 @@
+"""
+User input sanitizing for CommunicationX
+bleach.clean() builds a new Cleaner and runs the html5lib parser on every call; here each thread
+reuses one Cleaner (it keeps parser state, so it cannot be shared across threads) and text that
+bleach would return unchanged skips parsing altogether
+"""
+
+import re
+import threading
+
+import bleach
+
+# Basic formatting allowed in messages and descriptions
+ALLOWED_TAGS = frozenset(['b', 'i', 'u', 'em', 'strong', 'br'])
+
+# Anything bleach would rewrite: markup and entities, plus the control characters it replaces
+# (tab and newline pass through untouched)
+_NEEDS_CLEANING = re.compile(r'[<>&\x00-\x08\x0b-\x1f]')
+
+_local = threading.local()
+
+def _cleaner():
+    cleaner = getattr(_local, 'cleaner', None)
+    if cleaner is None:
+        cleaner = _local.cleaner = bleach.Cleaner(tags=ALLOWED_TAGS, strip=True)
+    return cleaner
+
+def _sanitize(text, max_length, cleaner):
+    if not text:
+        return ""
+    # Strip whitespace and limit length
+    text = text.strip()[:max_length]
+    if not _NEEDS_CLEANING.search(text):
+        return text
+    return (cleaner or _cleaner()).clean(text)
+
+def sanitize_input(text, max_length=1000):
+    """Sanitize and validate user input"""
+    return _sanitize(text, max_length, None)
+
+def sanitize_many(texts, max_length=1000):
+    """sanitize_input over a batch (bulk imports); returns a list in the same order"""
+    cleaner = _cleaner()
+    return [_sanitize(text, max_length, cleaner) for text in texts]
@@ -0,0 +1,466 @@
+"""
+Versioned, non-destructive schema migrations for CommunicationX
+Steps are applied once, in order, and recorded in the schema_version table; a boot
+with an up-to-date schema costs a single SELECT and no DDL
+"""
+
+import logging
+import os
+from datetime import datetime
+
+import click
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.schema import CreateColumn, CreateTable
+
+from app import app, db
+from images import ASSET_URL_PREFIX, asset_url, extract_data_urls
+from models import SchemaVersion, Channel, CustomEmoji, Message, DirectMessage, MessageReaction, MessageReactionCount, MessageArchive, MessageAttachment, Embed, MessageReport, ImageAsset, Job, Server, User
+
+PLACEHOLDER_USERNAME = 'deleted_user'
+
+# Orphaned rows that only describe the missing user's own ties or state are deleted rather than
+# handed to the placeholder, which would otherwise turn up as a member, reactor or friend
+ORPHANS_DELETED = {
+    ('friendship', 'user_id'), ('friendship', 'friend_id'),
+    ('server_membership', 'user_id'), ('server_ban', 'user_id'),
+    ('message_reaction', 'user_id'), ('message_read_status', 'user_id'),
+    ('user_presence', 'user_id'), ('user_sessions', 'user_id'), ('user_settings', 'user_id'),
+    ('notification_settings', 'user_id'), ('voice_state', 'user_id'), ('user_activity', 'user_id'),
+    ('design_collaborators', 'user_id'), ('workspace_collaborators', 'user_id'),
+    ('browser_participants', 'user_id'),
+}
+
+# Arbitrary key for pg_advisory_xact_lock so concurrent workers migrate one at a time
+MIGRATION_LOCK_KEY = 710023
+
+MIGRATIONS = []
+
+def migration(version, name):
+    """Register a migration step; steps run in version order and must be idempotent"""
+    def register(fn):
+        MIGRATIONS.append((version, name, fn))
+        MIGRATIONS.sort(key=lambda step: step[0])
+        return fn
+    return register
+
+def latest_version():
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+def current_version(connection):
+    """Highest applied version, or 0 when the database has never been migrated"""
+    try:
+        return connection.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+    except (OperationalError, ProgrammingError):
+        connection.rollback()
+        return 0
+
+def _lock(connection):
+    """Serialize migrations across workers booting at the same time"""
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': MIGRATION_LOCK_KEY})
+    elif connection.dialect.name == 'sqlite':
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+def upgrade_schema(engine=None):
+    """Apply pending migrations; returns the list of versions applied (empty when current)"""
+    engine = engine or db.engine
+    target = latest_version()
+
+    # Fast path: one query, no DDL, no lock
+    with engine.connect() as connection:
+        if current_version(connection) >= target:
+            return []
+
+    applied = []
+    with engine.connect() as connection:
+        if connection.dialect.name == 'sqlite':
+            # Table rebuilds must not trip foreign key enforcement mid-way
+            connection.exec_driver_sql('PRAGMA foreign_keys=OFF')
+        _lock(connection)
+        SchemaVersion.__table__.create(connection, checkfirst=True)
+
+        # Another worker may have finished while we waited for the lock
+        version = current_version(connection)
+        for step_version, name, fn in MIGRATIONS:
+            if step_version <= version:
+                continue
+            logging.warning(f"Applying schema migration {step_version}: {name}")
+            fn(connection)
+            connection.execute(SchemaVersion.__table__.insert().values(
+                version=step_version, name=name, applied_at=datetime.now()
+            ))
+            applied.append(step_version)
+        connection.commit()
+
+    if applied:
+        logging.warning(f"Schema upgraded to version {target}")
+    return applied
+
+def check_schema(engine=None):
+    """Raise if the schema is behind the code (used when auto-upgrade is disabled)"""
+    engine = engine or db.engine
+    with engine.connect() as connection:
+        version = current_version(connection)
+    if version < latest_version():
+        raise RuntimeError(
+            f"Database schema is at version {version}, code expects {latest_version()}; run 'flask schema-upgrade'"
+        )
+
+def user_fk_columns():
+    """Every (table, column) pair that references users.id"""
+    pairs = []
+    for table in db.metadata.sorted_tables:
+        for column in table.columns:
+            if any(fk.column.table.name == 'users' for fk in column.foreign_keys):
+                pairs.append((table, column))
+    return pairs
+
+def _is_integer_type(type_):
+    try:
+        return type_.python_type is int
+    except NotImplementedError:
+        return False
+
+def _live_column_types(connection):
+    """{(table, column): type} as the database currently declares them"""
+    inspector = inspect(connection)
+    existing = set(inspector.get_table_names())
+    types = {}
+    for table, column in user_fk_columns():
+        if table.name not in existing:
+            continue
+        for live in inspector.get_columns(table.name):
+            if live['name'] == column.name:
+                types[(table.name, column.name)] = live['type']
+    return types
+
+def _q(connection, name):
+    return connection.dialect.identifier_preparer.quote(name)
+
+def _non_integer_clause(connection, column):
+    """SQL predicate matching values that cannot be cast to an integer"""
+    if connection.dialect.name == 'postgresql':
+        return f"CAST({column} AS TEXT) !~ '^[0-9]+$'"
+    return f"(CAST({column} AS TEXT) = '' OR CAST({column} AS TEXT) GLOB '*[^0-9]*')"
+
+def _placeholder_user_id(connection):
+    """Id of the account that inherits rows whose author no longer exists"""
+    user_id = connection.execute(
+        text("SELECT id FROM users WHERE username = :username"), {'username': PLACEHOLDER_USERNAME}
+    ).scalar()
+    if user_id is None:
+        connection.execute(
+            text("INSERT INTO users (username, first_name, status, is_banned) VALUES (:username, 'Deleted', 'invisible', :banned)"),
+            {'username': PLACEHOLDER_USERNAME, 'banned': True}
+        )
+        user_id = connection.execute(
+            text("SELECT id FROM users WHERE username = :username"), {'username': PLACEHOLDER_USERNAME}
+        ).scalar()
+    return user_id
+
+def _backfill_column(connection, table, column, dry_run=False):
+    """Fix values that are not integers or name a missing user; returns the number of rows fixed.
+
+    Nullable references are cleared, association rows (ORPHANS_DELETED) are deleted and content
+    such as messages and audit entries is kept under the placeholder user.
+    """
+    t, c = _q(connection, table.name), _q(connection, column.name)
+    bad_rows = (
+        f"{c} IS NOT NULL AND ({_non_integer_clause(connection, c)} OR NOT EXISTS "
+        f"(SELECT 1 FROM users WHERE CAST(users.id AS TEXT) = CAST({t}.{c} AS TEXT)))"
+    )
+    count = connection.execute(text(f"SELECT COUNT(*) FROM {t} WHERE {bad_rows}")).scalar()
+    if not count or dry_run:
+        return count or 0
+
+    if column.nullable:
+        connection.execute(text(f"UPDATE {t} SET {c} = NULL WHERE {bad_rows}"))
+    elif (table.name, column.name) in ORPHANS_DELETED:
+        connection.execute(text(f"DELETE FROM {t} WHERE {bad_rows}"))
+    else:
+        placeholder = _placeholder_user_id(connection)
+        connection.execute(text(f"UPDATE {t} SET {c} = :placeholder WHERE {bad_rows}"), {'placeholder': str(placeholder)})
+    logging.warning(f"Backfilled {count} rows in {table.name}.{column.name}")
+    return count
+
+def _convert_postgresql(connection, table, columns):
+    t = _q(connection, table.name)
+    for column in columns:
+        c = _q(connection, column.name)
+        connection.execute(text(f"ALTER TABLE {t} ALTER COLUMN {c} TYPE INTEGER USING {c}::integer"))
+
+def _convert_sqlite(connection, table, columns):
+    """SQLite cannot change a column type or table options in place, so rebuild the table from the model definition"""
+    inspector = inspect(connection)
+    live_columns = {col['name'] for col in inspector.get_columns(table.name)}
+    converted = {column.name for column in columns}
+
+    new_name = f"{table.name}__new"
+    new_table = table.to_metadata(db.metadata, name=new_name)
+    try:
+        connection.execute(text(f"DROP TABLE IF EXISTS {_q(connection, new_name)}"))
+        connection.execute(CreateTable(new_table))
+
+        copied = [col.name for col in table.columns if col.name in live_columns]
+        targets = ', '.join(_q(connection, name) for name in copied)
+        sources = ', '.join(
+            f"CAST({_q(connection, name)} AS INTEGER)" if name in converted else _q(connection, name)
+            for name in copied
+        )
+        connection.execute(text(
+            f"INSERT INTO {_q(connection, new_name)} ({targets}) SELECT {sources} FROM {_q(connection, table.name)}"
+        ))
+        connection.execute(text(f"DROP TABLE {_q(connection, table.name)}"))
+        connection.execute(text(f"ALTER TABLE {_q(connection, new_name)} RENAME TO {_q(connection, table.name)}"))
+    finally:
+        db.metadata.remove(new_table)
+
+    for index in table.indexes:
+        index.create(connection, checkfirst=True)
+
+def add_column(connection, column):
+    """ALTER TABLE ... ADD COLUMN from the model definition; skipped when the column exists"""
+    table = column.table
+    if column.name in {live['name'] for live in inspect(connection).get_columns(table.name)}:
+        return
+    definition = CreateColumn(column).compile(dialect=connection.dialect)
+    connection.execute(text(f"ALTER TABLE {_q(connection, table.name)} ADD COLUMN {definition}"))
+
+def sqlite_autoincrement(connection, table, copies=()):
+    """Rebuild a SQLite table as AUTOINCREMENT so ids of deleted rows are never handed out again.
+
+    The sequence continues above the highest id in table and in copies (tables holding moved rows).
+    """
+    sql = connection.execute(
+        text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': table.name}
+    ).scalar()
+    if 'AUTOINCREMENT' not in (sql or '').upper():
+        _convert_sqlite(connection, table, ())
+    highest = max(
+        connection.execute(text(f"SELECT MAX(id) FROM {_q(connection, t.name)}")).scalar() or 0
+        for t in (table, *copies)
+    )
+    connection.execute(text("DELETE FROM sqlite_sequence WHERE name = :name"), {'name': table.name})
+    connection.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES (:name, :seq)"), {'name': table.name, 'seq': highest})
+
+def convert_user_fks_to_integer(connection, dry_run=False):
+    """Backfill and convert every VARCHAR user FK to INTEGER; returns a report dict"""
+    report = {'backfilled': {}, 'converted': [], 'skipped': []}
+    live_types = _live_column_types(connection)
+
+    pending = {}
+    for table, column in user_fk_columns():
+        live_type = live_types.get((table.name, column.name))
+        if live_type is None:
+            continue
+        if _is_integer_type(live_type):
+            report['skipped'].append(f"{table.name}.{column.name}")
+            continue
+        fixed = _backfill_column(connection, table, column, dry_run=dry_run)
+        if fixed:
+            report['backfilled'][f"{table.name}.{column.name}"] = fixed
+        pending.setdefault(table, []).append(column)
+
+    for table, columns in pending.items():
+        report['converted'].extend(f"{table.name}.{column.name}" for column in columns)
+        if dry_run:
+            continue
+        if connection.dialect.name == 'postgresql':
+            _convert_postgresql(connection, table, columns)
+        else:
+            _convert_sqlite(connection, table, columns)
+
+    if not dry_run:
+        # New membership/owner indexes are created on existing databases too
+        for table, _ in user_fk_columns():
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+    return report
+
+def verify_user_fks(connection):
+    """Return a list of problems: non-integer columns, non-integer values or dangling user ids"""
+    problems = []
+    live_types = _live_column_types(connection)
+    for table, column in user_fk_columns():
+        live_type = live_types.get((table.name, column.name))
+        if live_type is None:
+            continue
+        name = f"{table.name}.{column.name}"
+        if not _is_integer_type(live_type):
+            problems.append(f"{name} is still {live_type}")
+            continue
+
+        t, c = _q(connection, table.name), _q(connection, column.name)
+        if connection.dialect.name == 'sqlite':
+            mistyped = connection.execute(text(
+                f"SELECT COUNT(*) FROM {t} WHERE typeof({c}) NOT IN ('integer', 'null')"
+            )).scalar()
+            if mistyped:
+                problems.append(f"{name} has {mistyped} non-integer values")
+        dangling = connection.execute(text(
+            f"SELECT COUNT(*) FROM {t} WHERE {c} IS NOT NULL "
+            f"AND NOT EXISTS (SELECT 1 FROM users WHERE users.id = {t}.{c})"
+        )).scalar()
+        if dangling:
+            problems.append(f"{name} has {dangling} rows pointing at missing users")
+    return problems
+
+# Migration steps. Append new steps with the next version number; never edit applied ones.
+
+@migration(1, 'baseline schema')
+def _create_missing_tables(connection):
+    """Create any table or index the models define that the database lacks"""
+    db.metadata.create_all(connection, checkfirst=True)
+
+@migration(2, 'integer user foreign keys')
+def _integer_user_fks(connection):
+    report = convert_user_fks_to_integer(connection)
+    problems = verify_user_fks(connection)
+    if problems:
+        raise RuntimeError("User FK conversion failed verification: " + '; '.join(problems))
+    return report
+
+@migration(3, 'reaction count summary backfill')
+def _backfill_reaction_counts(connection):
+    summary = MessageReactionCount.__table__
+    reactions = MessageReaction.__table__
+    summary.create(connection, checkfirst=True)
+    if connection.execute(summary.select().limit(1)).first() is not None:
+        return
+    connection.execute(summary.insert().from_select(
+        ['message_id', 'emoji', 'count'],
+        db.select(reactions.c.message_id, reactions.c.emoji, db.func.count())
+        .group_by(reactions.c.message_id, reactions.c.emoji)
+    ))
+
+@migration(4, 'message archive and message child indexes')
+def _message_archive(connection):
+    MessageArchive.__table__.create(connection, checkfirst=True)
+    for model in (MessageAttachment, Embed, MessageReport):
+        for index in model.__table__.indexes:
+            index.create(connection, checkfirst=True)
+
+@migration(5, 'image assets extracted from data URLs')
+def _image_assets(connection):
+    ImageAsset.__table__.create(connection, checkfirst=True)
+    moved = extract_data_urls(connection)
+    logging.warning(f"Moved data URLs into image assets: {moved}")
+
+@migration(6, 'background job queue')
+def _job_queue(connection):
+    Job.__table__.create(connection, checkfirst=True)
+
+@migration(7, 'deleting flags and job progress')
+def _deletion_columns(connection):
+    for column in (Server.__table__.c.deleting, User.__table__.c.deleting, Job.__table__.c.progress):
+        add_column(connection, column)
+
+@migration(8, 'message ids never reused')
+def _message_autoincrement(connection):
+    # PostgreSQL sequences never repeat; SQLite reused the ids of archived messages
+    if connection.dialect.name == 'sqlite':
+        sqlite_autoincrement(connection, Message.__table__, copies=(MessageArchive.__table__,))
+
+@migration(9, 'direct message ids never reused')
+def _direct_message_autoincrement(connection):
+    if connection.dialect.name == 'sqlite':
+        sqlite_autoincrement(connection, DirectMessage.__table__)
+
+@migration(10, 'channel message versions')
+def _channel_message_version(connection):
+    add_column(connection, Channel.__table__.c.message_version)
+
+@migration(11, 'placeholder user associations removed')
+def _placeholder_associations(connection):
+    """Version 2 gave the placeholder user the memberships, reactions and friendships of missing users"""
+    placeholder = connection.execute(
+        text("SELECT id FROM users WHERE username = :username"), {'username': PLACEHOLDER_USERNAME}
+    ).scalar()
+    if placeholder is None:
+        return
+    reactions, counts = MessageReaction.__table__, MessageReactionCount.__table__
+    affected = [row[0] for row in connection.execute(
+        db.select(reactions.c.message_id).where(reactions.c.user_id == placeholder).distinct())]
+    for table, column in user_fk_columns():
+        if (table.name, column.name) in ORPHANS_DELETED:
+            connection.execute(table.delete().where(column == placeholder))
+    # Recount the summary rows of messages that lost placeholder reactions
+    for offset in range(0, len(affected), 500):
+        batch = affected[offset:offset + 500]
+        connection.execute(counts.delete().where(counts.c.message_id.in_(batch)))
+        connection.execute(counts.insert().from_select(
+            ['message_id', 'emoji', 'count'],
+            db.select(reactions.c.message_id, reactions.c.emoji, db.func.count())
+            .where(reactions.c.message_id.in_(batch))
+            .group_by(reactions.c.message_id, reactions.c.emoji)
+        ))
+
+@migration(12, 'emoji thumbnails beside the original')
+def _emoji_thumbnail_column(connection):
+    add_column(connection, CustomEmoji.__table__.c.thumbnail_url)
+    add_column(connection, ImageAsset.__table__.c.variant_sizes)
+
+    # Thumbnail jobs used to overwrite image_url with the 64 px copy; point it back at the original
+    emojis, assets = CustomEmoji.__table__, ImageAsset.__table__
+    originals = assets.alias('originals')
+    rows = connection.execute(
+        db.select(emojis.c.id, emojis.c.image_url, originals.c.hash)
+        .join(assets, emojis.c.image_url == db.literal(ASSET_URL_PREFIX) + assets.c.hash)
+        .join(originals, (originals.c.source_hash == assets.c.source_hash) & (originals.c.variant == 'original'))
+        .where(assets.c.variant != 'original', emojis.c.thumbnail_url.is_(None))
+    ).all()
+    for emoji_id, thumbnail_url, original_hash in rows:
+        connection.execute(emojis.update().where(emojis.c.id == emoji_id).values(
+            image_url=asset_url(original_hash), thumbnail_url=thumbnail_url))
+
+def init_schema():
+    """Boot hook: upgrade when SCHEMA_AUTO_UPGRADE is on (default), otherwise only verify"""
+    if os.environ.get('SCHEMA_AUTO_UPGRADE', '1') == '0':
+        check_schema()
+    else:
+        upgrade_schema()
+
+@app.cli.command('schema-status')
+def schema_status_command():
+    """Show applied and pending schema migrations"""
+    with db.engine.connect() as connection:
+        version = current_version(connection)
+    for step_version, name, _ in MIGRATIONS:
+        click.echo(f"{'applied' if step_version <= version else 'pending'}  {step_version:>3}  {name}")
+
+@app.cli.command('schema-upgrade')
+def schema_upgrade_command():
+    """Apply pending schema migrations"""
+    applied = upgrade_schema()
+    click.echo(f"applied {applied}" if applied else f"schema is current (version {latest_version()})")
+
+@app.cli.command('convert-user-fks')
+@click.option('--dry-run', is_flag=True, help='Report what would change without writing')
+def convert_user_fks_command(dry_run):
+    """Convert VARCHAR user foreign keys to INTEGER, backfill bad values and verify"""
+    with db.engine.connect() as connection:
+        if connection.dialect.name == 'sqlite':
+            # Table rebuilds must not trip foreign key enforcement mid-way
+            connection.exec_driver_sql('PRAGMA foreign_keys=OFF')
+        report = convert_user_fks_to_integer(connection, dry_run=dry_run)
+        if dry_run:
+            connection.rollback()
+        else:
+            connection.commit()
+            connection.exec_driver_sql('ANALYZE')
+            connection.commit()
+
+        for name, count in report['backfilled'].items():
+            click.echo(f"backfilled {count:>6} rows  {name}")
+        for name in report['converted']:
+            click.echo(f"{'would convert' if dry_run else 'converted'}  {name}")
+        click.echo(f"{len(report['skipped'])} columns already integer")
+
+        if not dry_run:
+            problems = verify_user_fks(connection)
+            for problem in problems:
+                click.echo(f"FAILED  {problem}", err=True)
+            if problems:
+                raise SystemExit(1)
+            click.echo("verified: all user foreign keys are integer and resolve to users")
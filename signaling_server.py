@@ -5,14 +5,20 @@ import logging
 from datetime import datetime
 from typing import Dict, Set
 from call_manager import call_manager, CallStatus
+from metrics import registry, serve_metrics
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+signaling_messages = registry.counter('signaling_messages_total', 'Signaling messages received', ('type',))
+signaling_send_failures = registry.counter('signaling_send_failures_total', 'Signaling sends that found no open connection')
+signaling_pending_sends = registry.gauge('signaling_pending_sends', 'Signaling sends waiting on a websocket')
+
 class SignalingServer:
     def __init__(self):
         self.connections: Dict[str, websockets.WebSocketServerProtocol] = {}
         self.user_connections: Dict[str, str] = {}  # user_id -> connection_id
+        registry.gauge('signaling_connections', 'Open signaling websockets').set_function(lambda: len(self.connections))
         
     async def register(self, websocket, user_id: str):
         """Register a new WebSocket connection"""
@@ -36,12 +42,15 @@ class SignalingServer:
         connection_id = self.user_connections.get(user_id)
         if connection_id and connection_id in self.connections:
             websocket = self.connections[connection_id]
+            signaling_pending_sends.inc()
             try:
                 await websocket.send(json.dumps(message))
                 return True
             except websockets.exceptions.ConnectionClosed:
                 await self.unregister(connection_id, user_id)
-                return False
+            finally:
+                signaling_pending_sends.dec()
+        signaling_send_failures.inc()
         return False
     
     async def handle_call_signal(self, message: dict, sender_id: str):
@@ -119,6 +128,7 @@ class SignalingServer:
         try:
             message = json.loads(message_str)
             message_type = message.get('type')
+            signaling_messages.inc(type=message_type if message_type in ('webrtc_signal', 'call_response', 'ping') else 'unknown')
             
             if message_type == 'webrtc_signal':
                 await self.handle_call_signal(message, user_id)
@@ -184,6 +194,8 @@ def start_signaling_server(host='0.0.0.0', port=8765):
     return websockets.serve(websocket_handler, host, port)
 
 if __name__ == '__main__':
+    # Metrics for this process on METRICS_PORT (default 9100)
+    serve_metrics()
     # Start the server
     start_server = start_signaling_server()
     asyncio.get_event_loop().run_until_complete(start_server)
@@ -1,11 +1,13 @@
 from flask_socketio import emit, join_room, leave_room, disconnect
 from flask_login import current_user
 from app import socketio, db
+from metrics import socket_handler
 from models import Call, Message, DirectMessage, MessageReadStatus, User
 from datetime import datetime
 import logging
 
 @socketio.on('join_call')
+@socket_handler
 def on_join_call(data):
     if not current_user.is_authenticated:
         disconnect()
@@ -29,12 +31,14 @@ def on_join_call(data):
         disconnect()
 
 @socketio.on('leave_call')
+@socket_handler
 def on_leave_call(data):
     call_id = data['call_id']
     leave_room(f"call_{call_id}")
     emit('user_left', {'user_id': current_user.id}, to=f"call_{call_id}")
 
 @socketio.on('webrtc_offer')
+@socket_handler
 def on_webrtc_offer(data):
     if not current_user.is_authenticated:
         disconnect()
@@ -51,6 +55,7 @@ def on_webrtc_offer(data):
         }, to=f"call_{call_id}", include_self=False)
 
 @socketio.on('webrtc_answer')
+@socket_handler
 def on_webrtc_answer(data):
     if not current_user.is_authenticated:
         disconnect()
@@ -67,6 +72,7 @@ def on_webrtc_answer(data):
         }, to=f"call_{call_id}", include_self=False)
 
 @socketio.on('webrtc_ice_candidate')
+@socket_handler
 def on_webrtc_ice_candidate(data):
     if not current_user.is_authenticated:
         disconnect()
@@ -85,6 +91,7 @@ def on_webrtc_ice_candidate(data):
 # Message Status and Typing Events
 
 @socketio.on('typing')
+@socket_handler
 def on_typing(data):
     """Handle typing indicators"""
     if not current_user.is_authenticated:
@@ -101,6 +108,7 @@ def on_typing(data):
     }, to=f"channel_{channel_id}", include_self=False)
 
 @socketio.on('stop_typing')
+@socket_handler
 def on_stop_typing(data):
     """Handle stop typing indicators"""
     if not current_user.is_authenticated:
@@ -116,6 +124,7 @@ def on_stop_typing(data):
     }, to=f"channel_{channel_id}", include_self=False)
 
 @socketio.on('mark_message_read')
+@socket_handler
 def on_mark_message_read(data):
     """Mark message as read and update status"""
     if not current_user.is_authenticated:
@@ -194,6 +203,7 @@ def on_mark_message_read(data):
         db.session.rollback()
 
 @socketio.on('join_channel')
+@socket_handler
 def on_join_channel(data):
     """Join a channel room for real-time updates"""
     if not current_user.is_authenticated:
@@ -204,7 +214,8 @@ def on_join_channel(data):
         join_room(f"channel_{channel_id}")
 
 @socketio.on('connect')
-def on_connect():
+@socket_handler
+def on_connect(auth=None):
     if current_user.is_authenticated:
         join_room(f"user_{current_user.id}")
         current_user.status = 'online'
@@ -213,7 +224,8 @@ def on_connect():
         emit('connected', {'user_id': current_user.id})
 
 @socketio.on('disconnect')
-def on_disconnect():
+@socket_handler
+def on_disconnect(reason=None):
     if current_user.is_authenticated:
         leave_room(f"user_{current_user.id}")
         current_user.status = 'away'
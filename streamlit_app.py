@@ -8,13 +8,16 @@ import base64
 import logging
 import json
 import os
-from sqlalchemy import create_engine, text, and_, or_, desc
+from sqlalchemy import create_engine, text, and_, or_, desc, func
+from sqlalchemy.orm import joinedload
 from models import User, Server, Channel, Message, DirectMessage, ServerMembership, Call, CallMessage, Voicemail, Invitation, SharedFile, MessageReaction, MessageReport
 from app import db, app
 import streamlit_authenticator as stauth
 from streamlit_option_menu import option_menu
 from werkzeug.security import generate_password_hash, check_password_hash
 from call_manager import call_manager, CallType, CallStatus
+from archival import reaction_summary
+from orm_repository import repository
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -32,9 +35,15 @@ st.set_page_config(
 def init_database():
     """Initialize database connection"""
     with app.app_context():
-        db.create_all()
+        from schema_migrations import init_schema
+        init_schema()
         return True
 
+# Open conversations are watched through a cheap change signature instead of rerunning the whole
+# script every second; the check backs off while nothing changes
+POLL_INTERVAL = 1.0
+MAX_POLL_INTERVAL = 30.0
+
 # Initialize session state
 def init_session_state():
     """Initialize Streamlit session state variables"""
@@ -54,6 +63,12 @@ def init_session_state():
         st.session_state.refresh_messages = 0
     if 'active_call' not in st.session_state:
         st.session_state.active_call = None
+    if 'seen_signature' not in st.session_state:
+        st.session_state.seen_signature = None
+    if 'poll_interval' not in st.session_state:
+        st.session_state.poll_interval = POLL_INTERVAL
+    if 'next_poll_at' not in st.session_state:
+        st.session_state.next_poll_at = 0.0
 
 # Authentication functions
 def authenticate_user(username, password):
@@ -75,7 +90,6 @@ def register_user(username, email, password, first_name="", last_name=""):
         
         # Create new user
         user = User(
-            id=str(uuid.uuid4()),
             username=username,
             email=email,
             password_hash=generate_password_hash(password),
@@ -84,9 +98,10 @@ def register_user(username, email, password, first_name="", last_name=""):
             created_at=datetime.now()
         )
         db.session.add(user)
+        db.session.flush()  # Assign user.id before creating memberships
         
         # Auto-add to public servers
-        public_servers = Server.query.filter_by(is_public=True).all()
+        public_servers = Server.query.filter_by(is_public=True, deleting=False).all()
         for server in public_servers:
             membership = ServerMembership(
                 user_id=user.id,
@@ -338,9 +353,7 @@ def show_servers_sidebar():
     
     with app.app_context():
         # Get user's servers
-        user_servers = db.session.query(Server).join(ServerMembership).filter(
-            ServerMembership.user_id == st.session_state.user_id
-        ).all()
+        user_servers = repository.user_servers(st.session_state.user_id)
         
         for server in user_servers:
             server_key = f"server_{server.id}"
@@ -352,7 +365,7 @@ def show_servers_sidebar():
         # Show channels for selected server
         if st.session_state.current_server:
             st.markdown("#### Channels")
-            channels = Channel.query.filter_by(server_id=st.session_state.current_server).all()
+            channels = repository.server_channels(st.session_state.current_server)
             
             for channel in channels:
                 channel_key = f"channel_{channel.id}"
@@ -369,28 +382,9 @@ def show_dm_sidebar():
     st.subheader("💬 Direct Messages")
     
     with app.app_context():
-        # Get recent DM conversations
-        dm_query = db.session.query(DirectMessage).filter(
-            or_(
-                DirectMessage.sender_id == st.session_state.user_id,
-                DirectMessage.recipient_id == st.session_state.user_id
-            )
-        ).order_by(desc(DirectMessage.created_at)).limit(50)
-        
-        conversations = {}
-        for dm in dm_query:
-            other_user_id = dm.recipient_id if dm.sender_id == st.session_state.user_id else dm.sender_id
-            if other_user_id not in conversations:
-                other_user = User.query.get(other_user_id)
-                conversations[other_user_id] = {
-                    'user': other_user,
-                    'last_message': dm,
-                    'unread_count': 0
-                }
-        
-        # Display conversations
-        for user_id, conv in conversations.items():
-            user = conv['user']
+        # Recent DM conversations, most recent first
+        for user, _ in repository.dm_conversations(st.session_state.user_id):
+            user_id = user.id
             status_icon = {"online": "🟢", "away": "🟡", "busy": "🔴", "invisible": "⚫"}.get(user.status, "⚫")
             
             if st.button(f"{status_icon} {user.username}", key=f"dm_{user_id}", use_container_width=True):
@@ -416,7 +410,7 @@ def show_calls_sidebar():
     
     with app.app_context():
         # Recent calls
-        recent_calls = Call.query.filter(
+        recent_calls = Call.query.options(joinedload(Call.caller), joinedload(Call.recipient)).filter(
             or_(
                 Call.caller_id == st.session_state.user_id,
                 Call.recipient_id == st.session_state.user_id
@@ -425,8 +419,7 @@ def show_calls_sidebar():
         
         st.markdown("#### Recent Calls")
         for call in recent_calls:
-            other_user_id = call.recipient_id if call.caller_id == st.session_state.user_id else call.caller_id
-            other_user = User.query.get(other_user_id)
+            other_user = call.recipient if call.caller_id == st.session_state.user_id else call.caller
             
             call_icon = "📞" if call.call_type == "audio" else "📹"
             status_icon = {"pending": "⏳", "active": "🟢", "ended": "🔴", "declined": "❌", "missed": "⚪"}.get(call.status, "❓")
@@ -481,6 +474,12 @@ def show_channel_messages():
     with app.app_context():
         channel = Channel.query.get(st.session_state.current_channel)
         server = Server.query.get(st.session_state.current_server)
+        if channel is None or server is None or server.deleting:
+            # Deleted (or being deleted) while selected
+            st.session_state.current_server = None
+            st.session_state.current_channel = None
+            st.info("This server is no longer available")
+            return
         
         st.header(f"# {channel.name}")
         st.caption(f"Server: {server.name}")
@@ -496,27 +495,23 @@ def show_channel_messages():
                 
             if send_button and message_content.strip():
                 # Save message to database
-                new_message = Message(
-                    content=message_content.strip(),
-                    author_id=st.session_state.user_id,
-                    channel_id=st.session_state.current_channel,
-                    created_at=datetime.now()
-                )
-                db.session.add(new_message)
-                db.session.commit()
+                repository.send_message(st.session_state.current_channel, st.session_state.user_id, message_content.strip())
                 st.session_state.refresh_messages += 1
                 st.rerun()
         
-        # Display messages
-        messages = Message.query.filter_by(
-            channel_id=st.session_state.current_channel
-        ).order_by(desc(Message.created_at)).limit(50).all()
+        # Display messages, authors preloaded
+        messages = repository.channel_messages(st.session_state.current_channel).items
         
         st.markdown("---")
         
-        for message in reversed(messages):
-            author = User.query.get(message.author_id)
-            display_message(message, author)
+        # Reaction counts for all visible messages in one query (archived ones carry their own)
+        reaction_counts = repository.reaction_counts([message.id for message in messages if not getattr(message, 'is_archived', False)])
+        for message in messages:
+            if getattr(message, 'is_archived', False):
+                reaction_counts[message.id] = reaction_summary(message)
+        
+        for message in messages:
+            display_message(message, message.author, reaction_counts.get(message.id))
 
 def show_direct_messages():
     """Display direct messages with selected user"""
@@ -526,7 +521,12 @@ def show_direct_messages():
     
     with app.app_context():
         recipient = User.query.get(st.session_state.dm_recipient)
-        
+        if recipient is None or recipient.deleting:
+            # Account deleted (or being deleted) while the conversation was open
+            st.session_state.dm_recipient = None
+            st.info("This user is no longer available")
+            return
+
         st.header(f"💬 {recipient.username}")
         status_icon = {"online": "🟢", "away": "🟡", "busy": "🔴", "invisible": "⚫"}.get(recipient.status, "⚫")
         st.caption(f"Status: {status_icon} {recipient.status.title()}")
@@ -545,14 +545,7 @@ def show_direct_messages():
                 
             if send_button and dm_content.strip():
                 # Save DM to database
-                new_dm = DirectMessage(
-                    content=dm_content.strip(),
-                    sender_id=st.session_state.user_id,
-                    recipient_id=st.session_state.dm_recipient,
-                    created_at=datetime.now()
-                )
-                db.session.add(new_dm)
-                db.session.commit()
+                repository.send_direct_message(st.session_state.user_id, st.session_state.dm_recipient, dm_content.strip())
                 st.session_state.refresh_messages += 1
                 st.rerun()
             
@@ -567,25 +560,15 @@ def show_direct_messages():
                 st.success(f"Calling {recipient.username}...")
                 st.rerun()
         
-        # Display DMs
-        dms = DirectMessage.query.filter(
-            and_(
-                or_(
-                    and_(DirectMessage.sender_id == st.session_state.user_id, 
-                         DirectMessage.recipient_id == st.session_state.dm_recipient),
-                    and_(DirectMessage.sender_id == st.session_state.dm_recipient, 
-                         DirectMessage.recipient_id == st.session_state.user_id)
-                )
-            )
-        ).order_by(desc(DirectMessage.created_at)).limit(50).all()
+        # Display DMs, senders preloaded
+        dms = repository.direct_messages(st.session_state.user_id, st.session_state.dm_recipient).items
         
         st.markdown("---")
         
-        for dm in reversed(dms):
-            author = User.query.get(dm.sender_id)
-            display_dm(dm, author)
+        for dm in dms:
+            display_dm(dm, dm.sender)
 
-def display_message(message, author):
+def display_message(message, author, reaction_counts=None):
     """Display a single message with reactions and actions"""
     timestamp = message.created_at.strftime("%H:%M")
     
@@ -617,16 +600,7 @@ def display_message(message, author):
                         delete_message(message.id)
             
             # Display reactions
-            reactions = MessageReaction.query.filter_by(message_id=message.id).all()
-            if reactions:
-                reaction_counts = {}
-                for reaction in reactions:
-                    emoji = reaction.emoji
-                    if emoji in reaction_counts:
-                        reaction_counts[emoji] += 1
-                    else:
-                        reaction_counts[emoji] = 1
-                
+            if reaction_counts:
                 reaction_text = " ".join([f"{emoji} {count}" for emoji, count in reaction_counts.items()])
                 st.markdown(f"<div class='reaction'>{reaction_text}</div>", unsafe_allow_html=True)
         
@@ -652,25 +626,8 @@ def display_dm(dm, author):
 def add_reaction(message_id, emoji):
     """Add reaction to message"""
     with app.app_context():
-        # Check if user already reacted with this emoji
-        existing = MessageReaction.query.filter_by(
-            message_id=message_id,
-            user_id=st.session_state.user_id,
-            emoji=emoji
-        ).first()
-        
-        if existing:
-            db.session.delete(existing)
-        else:
-            reaction = MessageReaction(
-                message_id=message_id,
-                user_id=st.session_state.user_id,
-                emoji=emoji,
-                created_at=datetime.now()
-            )
-            db.session.add(reaction)
-        
-        db.session.commit()
+        # Toggle the reaction and its summary count together
+        repository.toggle_reaction(message_id, st.session_state.user_id, emoji)
         st.rerun()
 
 def delete_message(message_id):
@@ -769,6 +726,55 @@ def show_call_interface():
                         st.success("Call ended")
                         st.rerun()
 
+# Change detection for open conversations
+@st.cache_data(ttl=1, show_spinner=False)
+def channel_signature(channel_id):
+    """Latest message id and the channel's message_version (edits, pins, deletes); one indexed query per second shared by all viewers"""
+    with app.app_context():
+        latest = db.session.query(func.max(Message.id)).filter(Message.channel_id == channel_id).scalar_subquery()
+        row = db.session.query(latest, Channel.message_version).filter(Channel.id == channel_id).first()
+        return tuple(row) if row else None
+
+@st.cache_data(ttl=1, show_spinner=False)
+def dm_signature(user_a, user_b):
+    """Latest id of a DM conversation (DMs are never edited or deleted); callers pass the pair sorted so both sides share the entry"""
+    with app.app_context():
+        return db.session.query(func.max(DirectMessage.id)).filter(
+            or_(
+                and_(DirectMessage.sender_id == user_a, DirectMessage.recipient_id == user_b),
+                and_(DirectMessage.sender_id == user_b, DirectMessage.recipient_id == user_a)
+            )
+        ).scalar()
+
+def conversation_signature():
+    """Signature of whatever conversation is open, or None"""
+    if st.session_state.current_channel:
+        return ('channel', st.session_state.current_channel, channel_signature(st.session_state.current_channel))
+    if st.session_state.dm_recipient:
+        pair = sorted([st.session_state.user_id, st.session_state.dm_recipient])
+        return ('dm', st.session_state.dm_recipient, dm_signature(*pair))
+    return None
+
+def mark_conversation_seen(signature):
+    """Record the signature a full run rendered; any full run means activity, so polling goes back to the fast interval.
+
+    The signature must be taken before rendering: a message arriving mid-render then still
+    differs from it and triggers the next rerun.
+    """
+    st.session_state.seen_signature = signature
+    st.session_state.poll_interval = POLL_INTERVAL
+    st.session_state.next_poll_at = time.monotonic() + POLL_INTERVAL
+
+@st.fragment(run_every=POLL_INTERVAL)
+def watch_conversation():
+    """Rerun the app only when the open conversation changed; idle conversations are checked less and less often"""
+    if time.monotonic() < st.session_state.next_poll_at:
+        return
+    if conversation_signature() != st.session_state.seen_signature:
+        st.rerun(scope="app")
+    st.session_state.poll_interval = min(st.session_state.poll_interval * 2, MAX_POLL_INTERVAL)
+    st.session_state.next_poll_at = time.monotonic() + st.session_state.poll_interval
+
 # Main application
 def main():
     """Main application function"""
@@ -783,6 +789,9 @@ def main():
     # Show sidebar
     show_sidebar()
     
+    # Before rendering, so nothing that arrives while the page renders counts as seen
+    signature = conversation_signature()
+    
     # Main content area
     if st.session_state.current_channel:
         show_channel_messages()
@@ -820,15 +829,18 @@ def main():
             st.markdown("### 📈 Recent Activity")
             
             # Recent messages across all servers
-            recent_messages = db.session.query(Message).join(Channel).join(Server).join(ServerMembership).filter(
+            recent_messages = db.session.query(Message).options(
+                joinedload(Message.author),
+                joinedload(Message.channel).joinedload(Channel.server),
+            ).join(Channel).join(Server).join(ServerMembership).filter(
                 ServerMembership.user_id == st.session_state.user_id
             ).order_by(desc(Message.created_at)).limit(5).all()
             
             if recent_messages:
                 for msg in recent_messages:
-                    author = User.query.get(msg.author_id)
-                    channel = Channel.query.get(msg.channel_id)
-                    server = Server.query.get(channel.server_id)
+                    author = msg.author
+                    channel = msg.channel
+                    server = channel.server
                     
                     st.markdown(f"**{author.username}** in #{channel.name} ({server.name}): {msg.content[:100]}...")
             else:
@@ -837,10 +849,10 @@ def main():
     # Show modals
     show_create_server_modal()
     
-    # Auto-refresh for real-time updates
-    time.sleep(1)
+    # Real-time updates: poll for changes instead of rerunning every second
     if st.session_state.current_channel or st.session_state.dm_recipient:
-        st.rerun()
+        mark_conversation_seen(signature)
+        watch_conversation()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,736 @@
+"""
+Data access for the standalone Streamlit app (streamlit_communicationx.py)
+ChatStore implements the shared Repository interface (repository.py) over its own SQLite schema. It owns one long-lived WAL-mode SQLite connection shared by every session and rerun:
+no per-query connect/close, compiled statements are reused from the connection's statement
+cache, and a lock serializes access because Streamlit runs each session in its own thread
+
+The schema is versioned with PRAGMA user_version; check_query_plans() runs EXPLAIN QUERY PLAN over
+the hot queries and reports any that scan a whole table (tests/test_streamlit_query_plans.py, or
+`python streamlit_store.py check-plans` against a live file)
+"""
+
+import argparse
+import hashlib
+import sqlite3
+import sys
+import threading
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import List, Optional, Dict
+
+from repository import Page, Repository, decode_cursor, page_of
+
+@dataclass
+class User:
+    id: str
+    username: str
+    email: str
+    password_hash: str
+    first_name: str = ""
+    last_name: str = ""
+    status: str = "online"
+    created_at: str = ""
+
+@dataclass
+class Server:
+    id: int
+    name: str
+    description: str
+    owner_id: str
+    is_public: bool = True
+    created_at: str = ""
+
+@dataclass
+class Channel:
+    id: int
+    name: str
+    server_id: int
+    created_at: str = ""
+
+@dataclass
+class Message:
+    id: int
+    content: str
+    author_id: str
+    channel_id: int
+    created_at: str
+    message_type: str = "text"
+
+@dataclass
+class DirectMessage:
+    id: int
+    content: str
+    sender_id: str
+    recipient_id: str
+    created_at: str
+
+@dataclass
+class Call:
+    id: int
+    caller_id: str
+    recipient_id: str
+    call_type: str
+    status: str
+    started_at: str
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id TEXT PRIMARY KEY,
+        username TEXT UNIQUE NOT NULL,
+        email TEXT UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL,
+        first_name TEXT,
+        last_name TEXT,
+        status TEXT DEFAULT 'online',
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS servers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        description TEXT,
+        owner_id TEXT NOT NULL,
+        is_public BOOLEAN DEFAULT TRUE,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (owner_id) REFERENCES users (id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS channels (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        server_id INTEGER NOT NULL,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (server_id) REFERENCES servers (id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        content TEXT NOT NULL,
+        author_id TEXT NOT NULL,
+        channel_id INTEGER NOT NULL,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        message_type TEXT DEFAULT 'text',
+        FOREIGN KEY (author_id) REFERENCES users (id),
+        FOREIGN KEY (channel_id) REFERENCES channels (id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS direct_messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        content TEXT NOT NULL,
+        sender_id TEXT NOT NULL,
+        recipient_id TEXT NOT NULL,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (sender_id) REFERENCES users (id),
+        FOREIGN KEY (recipient_id) REFERENCES users (id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS server_memberships (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        server_id INTEGER NOT NULL,
+        joined_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id),
+        FOREIGN KEY (server_id) REFERENCES servers (id),
+        UNIQUE(user_id, server_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS calls (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        caller_id TEXT NOT NULL,
+        recipient_id TEXT NOT NULL,
+        call_type TEXT NOT NULL,
+        status TEXT DEFAULT 'pending',
+        started_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (caller_id) REFERENCES users (id),
+        FOREIGN KEY (recipient_id) REFERENCES users (id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS message_reactions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        message_id INTEGER NOT NULL,
+        user_id TEXT NOT NULL,
+        emoji TEXT NOT NULL,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (message_id) REFERENCES messages (id) ON DELETE CASCADE,
+        FOREIGN KEY (user_id) REFERENCES users (id),
+        UNIQUE(message_id, user_id, emoji)
+    )
+    """,
+    # Per-message reaction summary (emoji -> count), kept in step with message_reactions
+    """
+    CREATE TABLE IF NOT EXISTS message_reaction_counts (
+        message_id INTEGER NOT NULL,
+        emoji TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (message_id, emoji),
+        FOREIGN KEY (message_id) REFERENCES messages (id) ON DELETE CASCADE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS dm_reactions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        dm_id INTEGER NOT NULL,
+        user_id TEXT NOT NULL,
+        emoji TEXT NOT NULL,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (dm_id) REFERENCES direct_messages (id) ON DELETE CASCADE,
+        FOREIGN KEY (user_id) REFERENCES users (id),
+        UNIQUE(dm_id, user_id, emoji)
+    )
+    """,
+]
+
+# Secondary indexes for the hot queries; UNIQUE constraints already index users.username,
+# server_memberships(user_id, ...), message_reactions(message_id, ...) and dm_reactions(dm_id, ...)
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_messages_channel_created ON messages (channel_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_messages_author ON messages (author_id)",
+    "CREATE INDEX IF NOT EXISTS idx_dm_pair_created ON direct_messages (sender_id, recipient_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_dm_recipient_created ON direct_messages (recipient_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_channels_server_name ON channels (server_id, name)",
+    "CREATE INDEX IF NOT EXISTS idx_memberships_server ON server_memberships (server_id)",
+]
+
+USER_COLUMNS = "id, username, email, password_hash, first_name, last_name, status, created_at"
+
+CHANNEL_MESSAGES_SQL = """
+    SELECT m.id, m.content, m.author_id, m.channel_id, m.created_at, m.message_type,
+           u.username, u.status
+    FROM messages m
+    JOIN users u ON m.author_id = u.id
+    WHERE m.channel_id = ? {before}
+    ORDER BY m.created_at DESC, m.id DESC
+    LIMIT ?
+"""
+
+DIRECT_MESSAGES_SQL = """
+    SELECT dm.id, dm.content, dm.sender_id, dm.recipient_id, dm.created_at,
+           u.username, u.status
+    FROM direct_messages dm
+    JOIN users u ON dm.sender_id = u.id
+    WHERE ((dm.sender_id = ? AND dm.recipient_id = ?)
+       OR (dm.sender_id = ? AND dm.recipient_id = ?)) {before}
+    ORDER BY dm.created_at DESC, dm.id DESC
+    LIMIT ?
+"""
+
+# Aggregate per partner first, then join users by primary key (joining on a CASE scanned users per DM)
+DM_CONVERSATIONS_SQL = """
+    SELECT c.other_user_id, u.username, u.status, c.last_message_time
+    FROM (
+        SELECT CASE WHEN sender_id = ? THEN recipient_id ELSE sender_id END AS other_user_id,
+               MAX(created_at) AS last_message_time
+        FROM direct_messages
+        WHERE sender_id = ? OR recipient_id = ?
+        GROUP BY other_user_id
+    ) c
+    JOIN users u ON u.id = c.other_user_id
+    ORDER BY c.last_message_time DESC
+"""
+
+USER_SERVERS_SQL = """
+    SELECT s.id, s.name, s.description, s.owner_id, s.is_public, s.created_at
+    FROM servers s
+    JOIN server_memberships sm ON s.id = sm.server_id
+    WHERE sm.user_id = ?
+    ORDER BY s.name
+"""
+
+SERVER_CHANNELS_SQL = """
+    SELECT id, name, server_id, created_at
+    FROM channels
+    WHERE server_id = ?
+    ORDER BY name
+"""
+
+# Keyset condition appended to the history queries for pages after the first
+BEFORE_SQL = "AND ({alias}.created_at, {alias}.id) < (?, ?)"
+
+REACTION_COUNTS_SQL = """
+    SELECT message_id, emoji, count
+    FROM message_reaction_counts
+    WHERE message_id IN ({placeholders})
+"""
+
+DM_REACTIONS_SQL = """
+    SELECT dm_id, emoji, COUNT(*) as count
+    FROM dm_reactions
+    WHERE dm_id IN ({placeholders})
+    GROUP BY dm_id, emoji
+"""
+
+USER_STATS_SQL = """
+    SELECT (SELECT COUNT(*) FROM messages WHERE author_id = ?),
+           (SELECT COUNT(*) FROM direct_messages WHERE sender_id = ?),
+           (SELECT COUNT(*) FROM server_memberships WHERE user_id = ?)
+"""
+
+USERS_BY_ID_SQL = f"SELECT {USER_COLUMNS} FROM users WHERE id IN ({{placeholders}})"
+
+AUTHENTICATE_SQL = f"SELECT {USER_COLUMNS} FROM users WHERE username = ? AND password_hash = ?"
+
+# (name, sql, sample parameters) checked by check_query_plans
+HOT_QUERIES = [
+    ('authenticate_user', AUTHENTICATE_SQL, ('alice', 'x')),
+    ('user_servers', USER_SERVERS_SQL, ('u1',)),
+    ('server_channels', SERVER_CHANNELS_SQL, (1,)),
+    ('channel_messages', CHANNEL_MESSAGES_SQL.format(before=''), (1, 50)),
+    ('channel_messages (older page)', CHANNEL_MESSAGES_SQL.format(before=BEFORE_SQL.format(alias='m')),
+     (1, '2024-01-01 00:00:00', 10, 50)),
+    ('reaction_counts', REACTION_COUNTS_SQL.format(placeholders='?,?,?'), (1, 2, 3)),
+    ('users_by_id', USERS_BY_ID_SQL.format(placeholders='?,?'), ('u1', 'u2')),
+    ('direct_messages', DIRECT_MESSAGES_SQL.format(before=''), ('u1', 'u2', 'u2', 'u1', 50)),
+    ('direct_messages (older page)', DIRECT_MESSAGES_SQL.format(before=BEFORE_SQL.format(alias='dm')),
+     ('u1', 'u2', 'u2', 'u1', '2024-01-01 00:00:00', 10, 50)),
+    ('dm_conversations', DM_CONVERSATIONS_SQL, ('u1', 'u1', 'u1')),
+    ('get_reactions_for_dms', DM_REACTIONS_SQL.format(placeholders='?,?,?'), (1, 2, 3)),
+    ('user_stats', USER_STATS_SQL, ('u1', 'u1', 'u1')),
+]
+
+def _baseline(cursor):
+    for statement in SCHEMA:
+        cursor.execute(statement)
+    # Backfill the reaction summary for databases created before it existed
+    cursor.execute("SELECT 1 FROM message_reaction_counts LIMIT 1")
+    if cursor.fetchone() is None:
+        cursor.execute("""
+            INSERT INTO message_reaction_counts (message_id, emoji, count)
+            SELECT message_id, emoji, COUNT(*) FROM message_reactions
+            GROUP BY message_id, emoji
+        """)
+
+def _hot_path_indexes(cursor):
+    for statement in INDEXES:
+        cursor.execute(statement)
+    cursor.execute("ANALYZE")
+
+# (version, name, step); steps are idempotent so unversioned databases from before
+# user_version tracking upgrade cleanly from 0
+MIGRATIONS = [
+    (1, 'baseline schema', _baseline),
+    (2, 'hot path indexes', _hot_path_indexes),
+]
+
+def hash_password(password: str) -> str:
+    """Hash password using SHA-256"""
+    return hashlib.sha256(password.encode()).hexdigest()
+
+class ChatStore(Repository):
+    """Data access object over a single shared SQLite connection"""
+    backend = 'sqlite'
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.RLock()
+        # Autocommit mode: reads run without a transaction, writes use transaction()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None,
+                                     timeout=5, cached_statements=256)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # Low-level helpers
+
+    def query(self, sql: str, params=()) -> list:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def query_one(self, sql: str, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchone()
+
+    @contextmanager
+    def transaction(self):
+        """Write transaction; takes the write lock up front so concurrent writers queue instead of failing"""
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                yield cursor
+            except BaseException:
+                self._conn.rollback()
+                raise
+            else:
+                self._conn.commit()
+            finally:
+                cursor.close()
+
+    # Schema
+
+    def schema_version(self) -> int:
+        return self.query_one("PRAGMA user_version")[0]
+
+    def init_schema(self) -> List[int]:
+        """Apply pending migrations; returns the versions applied (empty when current)"""
+        if self.schema_version() >= MIGRATIONS[-1][0]:
+            return []
+        applied = []
+        with self.transaction() as cursor:
+            # Re-read under the write lock: another process may have migrated meanwhile
+            version = cursor.execute("PRAGMA user_version").fetchone()[0]
+            for step_version, name, step in MIGRATIONS:
+                if step_version <= version:
+                    continue
+                step(cursor)
+                applied.append(step_version)
+            if applied:
+                cursor.execute(f"PRAGMA user_version = {applied[-1]}")
+        return applied
+
+    def check_query_plans(self) -> Dict[str, List[str]]:
+        """EXPLAIN QUERY PLAN for every hot query; returns {name: [full table scans]} for offenders"""
+        problems = {}
+        for name, sql, params in HOT_QUERIES:
+            plan = [row[3] for row in self.query(f"EXPLAIN QUERY PLAN {sql}", params)]
+            # "SCAN t" without USING ... INDEX reads the whole table; scanning a materialized
+            # subquery or the constant row of a scalar select is fine
+            derived = {detail.split()[-1] for detail in plan if detail.startswith(('MATERIALIZE', 'CO-ROUTINE'))}
+            scans = [detail for detail in plan
+                     if detail.startswith('SCAN ') and 'INDEX' not in detail
+                     and detail.replace('SCAN TABLE ', 'SCAN ').split()[1] not in derived | {'CONSTANT', 'SUBQUERY'}]
+            if scans:
+                problems[name] = scans
+        return problems
+
+    def create_sample_data(self):
+        """Create sample data if database is empty"""
+        with self.transaction() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM users")
+            if cursor.fetchone()[0]:
+                return
+
+            sample_users = [
+                ("admin", "admin@communicationx.com", "admin123", "Admin", "User"),
+                ("alice", "alice@example.com", "password123", "Alice", "Smith"),
+                ("bob", "bob@example.com", "password123", "Bob", "Johnson"),
+            ]
+            user_ids = []
+            for username, email, password, first_name, last_name in sample_users:
+                user_id = str(uuid.uuid4())
+                user_ids.append(user_id)
+                cursor.execute("""
+                    INSERT INTO users (id, username, email, password_hash, first_name, last_name)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, (user_id, username, email, hash_password(password), first_name, last_name))
+
+            cursor.execute("""
+                INSERT INTO servers (name, description, owner_id, is_public)
+                VALUES (?, ?, ?, ?)
+            """, ("General Community", "Welcome to the general community server!", user_ids[0], True))
+            server_id = cursor.lastrowid
+
+            cursor.executemany("INSERT INTO channels (name, server_id) VALUES (?, ?)",
+                               [(name, server_id) for name in ("general", "random", "announcements")])
+            cursor.executemany("INSERT INTO server_memberships (user_id, server_id) VALUES (?, ?)",
+                               [(user_id, server_id) for user_id in user_ids])
+
+    # Users
+
+    def authenticate_user(self, username: str, password: str) -> Optional[User]:
+        """Authenticate user"""
+        row = self.query_one(AUTHENTICATE_SQL, (username, hash_password(password)))
+        return User(*row) if row else None
+
+    def username_exists(self, username: str) -> bool:
+        return self.query_one("SELECT 1 FROM users WHERE username = ?", (username,)) is not None
+
+    def email_exists(self, email: str) -> bool:
+        return self.query_one("SELECT 1 FROM users WHERE email = ?", (email,)) is not None
+
+    def register_user(self, username: str, email: str, password: str, first_name: str = "", last_name: str = "") -> tuple:
+        """Register new user and auto-join public servers"""
+        if self.query_one("SELECT id FROM users WHERE username = ? OR email = ?", (username, email)):
+            return None, "Username or email already exists"
+
+        user_id = str(uuid.uuid4())
+        password_hash = hash_password(password)
+        try:
+            with self.transaction() as cursor:
+                cursor.execute("""
+                    INSERT INTO users (id, username, email, password_hash, first_name, last_name)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, (user_id, username, email, password_hash, first_name, last_name))
+                cursor.execute("""
+                    INSERT OR IGNORE INTO server_memberships (user_id, server_id)
+                    SELECT ?, id FROM servers WHERE is_public = TRUE
+                """, (user_id,))
+        except Exception as e:
+            return None, f"Registration failed: {str(e)}"
+
+        return User(user_id, username, email, password_hash, first_name, last_name), "Success"
+
+    def get_all_users(self) -> List[User]:
+        """Get all users for DM selection"""
+        return [User(*row) for row in self.query(f"SELECT {USER_COLUMNS} FROM users ORDER BY username")]
+
+    def users_by_id(self, user_ids) -> Dict[str, User]:
+        ids = list(dict.fromkeys(user_id for user_id in user_ids if user_id is not None))
+        if not ids:
+            return {}
+        placeholders = ",".join("?" * len(ids))
+        return {row[0]: User(*row) for row in self.query(USERS_BY_ID_SQL.format(placeholders=placeholders), ids)}
+
+    def user_stats(self, user_id: str) -> Dict[str, int]:
+        """Messages, DMs and server memberships for the profile page, in one round trip"""
+        messages, dms, servers = self.query_one(USER_STATS_SQL, (user_id, user_id, user_id))
+        return {'messages': messages, 'direct_messages': dms, 'servers': servers}
+
+    # Servers and channels
+
+    def user_servers(self, user_id: str) -> List[Server]:
+        return [Server(*row) for row in self.query(USER_SERVERS_SQL, (user_id,))]
+
+    def server_channels(self, server_id: int) -> List[Channel]:
+        return [Channel(*row) for row in self.query(SERVER_CHANNELS_SQL, (server_id,))]
+
+    def get_server_owner(self, server_id: int) -> Optional[str]:
+        """Get server owner ID"""
+        row = self.query_one("SELECT owner_id FROM servers WHERE id = ?", (server_id,))
+        return row[0] if row else None
+
+    def create_server(self, name: str, description: str, owner_id: str, is_public: bool = True) -> Optional[int]:
+        """Create new server with a general channel and the owner as member"""
+        try:
+            with self.transaction() as cursor:
+                cursor.execute("""
+                    INSERT INTO servers (name, description, owner_id, is_public)
+                    VALUES (?, ?, ?, ?)
+                """, (name, description, owner_id, is_public))
+                server_id = cursor.lastrowid
+                cursor.execute("INSERT INTO channels (name, server_id) VALUES (?, ?)", ("general", server_id))
+                cursor.execute("INSERT INTO server_memberships (user_id, server_id) VALUES (?, ?)", (owner_id, server_id))
+            return server_id
+        except Exception:
+            return None
+
+    def create_channel(self, name: str, server_id: int) -> Optional[int]:
+        """Create new channel in server"""
+        try:
+            with self.transaction() as cursor:
+                cursor.execute("INSERT INTO channels (name, server_id) VALUES (?, ?)", (name, server_id))
+                return cursor.lastrowid
+        except Exception:
+            return None
+
+    def delete_channel(self, channel_id: int, user_id: str) -> bool:
+        """Delete channel if user is server owner"""
+        try:
+            with self.transaction() as cursor:
+                cursor.execute("""
+                    SELECT s.owner_id FROM servers s
+                    JOIN channels c ON s.id = c.server_id
+                    WHERE c.id = ?
+                """, (channel_id,))
+                row = cursor.fetchone()
+                if not row or row[0] != user_id:
+                    return False
+                cursor.execute("DELETE FROM messages WHERE channel_id = ?", (channel_id,))
+                cursor.execute("DELETE FROM channels WHERE id = ?", (channel_id,))
+            return True
+        except Exception:
+            return False
+
+    # Channel messages
+
+    def channel_messages(self, channel_id: int, limit: int = 50, cursor=None) -> Page:
+        """Message rows (id, content, author_id, channel_id, created_at, message_type, username, status)"""
+        position = decode_cursor(cursor)
+        if position is None:
+            rows = self.query(CHANNEL_MESSAGES_SQL.format(before=''), (channel_id, limit))
+        else:
+            rows = self.query(CHANNEL_MESSAGES_SQL.format(before=BEFORE_SQL.format(alias='m')),
+                              (channel_id, *position, limit))
+        return page_of(rows, limit, lambda row: row[4], lambda row: row[0])
+
+    def send_message(self, channel_id: int, author_id: str, content: str) -> bool:
+        """Send message to channel"""
+        try:
+            with self.transaction() as cursor:
+                cursor.execute("INSERT INTO messages (content, author_id, channel_id) VALUES (?, ?, ?)",
+                               (content, author_id, channel_id))
+            return True
+        except Exception:
+            return False
+
+    def delete_message(self, message_id: int, user_id: str) -> bool:
+        """Delete message and its reactions if user is author"""
+        try:
+            with self.transaction() as cursor:
+                cursor.execute("SELECT author_id FROM messages WHERE id = ?", (message_id,))
+                row = cursor.fetchone()
+                if not row or row[0] != user_id:
+                    return False
+                cursor.execute("DELETE FROM message_reactions WHERE message_id = ?", (message_id,))
+                cursor.execute("DELETE FROM message_reaction_counts WHERE message_id = ?", (message_id,))
+                cursor.execute("DELETE FROM messages WHERE id = ?", (message_id,))
+            return True
+        except Exception:
+            return False
+
+    def toggle_reaction(self, message_id: int, user_id: str, emoji: str) -> Optional[str]:
+        """Toggle a reaction; the reaction row and its summary commit together. None on failure"""
+        try:
+            with self.transaction() as cursor:
+                cursor.execute("""
+                    DELETE FROM message_reactions
+                    WHERE message_id = ? AND user_id = ? AND emoji = ?
+                """, (message_id, user_id, emoji))
+                if cursor.rowcount:
+                    cursor.execute("""
+                        UPDATE message_reaction_counts SET count = count - 1
+                        WHERE message_id = ? AND emoji = ?
+                    """, (message_id, emoji))
+                    cursor.execute("""
+                        DELETE FROM message_reaction_counts
+                        WHERE message_id = ? AND emoji = ? AND count <= 0
+                    """, (message_id, emoji))
+                else:
+                    cursor.execute("""
+                        INSERT INTO message_reactions (message_id, user_id, emoji)
+                        VALUES (?, ?, ?)
+                    """, (message_id, user_id, emoji))
+                    cursor.execute("""
+                        INSERT INTO message_reaction_counts (message_id, emoji, count)
+                        VALUES (?, ?, 1)
+                        ON CONFLICT (message_id, emoji) DO UPDATE SET count = count + 1
+                    """, (message_id, emoji))
+                    return 'added'
+            return 'removed'
+        except Exception:
+            return None
+
+    def reaction_counts(self, message_ids: List[int]) -> Dict[int, Dict[str, int]]:
+        reactions = {message_id: {} for message_id in message_ids}
+        if not reactions:
+            return reactions
+        placeholders = ",".join("?" * len(reactions))
+        for message_id, emoji, count in self.query(REACTION_COUNTS_SQL.format(placeholders=placeholders), list(reactions)):
+            reactions[message_id][emoji] = count
+        return reactions
+
+    # Direct messages
+
+    def dm_conversations(self, user_id: str) -> List[tuple]:
+        """(other_user_id, username, status, last_message_time) rows"""
+        return self.query(DM_CONVERSATIONS_SQL, (user_id, user_id, user_id))
+
+    def direct_messages(self, user_id: str, other_id: str, limit: int = 50, cursor=None) -> Page:
+        """DM rows (id, content, sender_id, recipient_id, created_at, username, status)"""
+        pair = (user_id, other_id, other_id, user_id)
+        position = decode_cursor(cursor)
+        if position is None:
+            rows = self.query(DIRECT_MESSAGES_SQL.format(before=''), (*pair, limit))
+        else:
+            rows = self.query(DIRECT_MESSAGES_SQL.format(before=BEFORE_SQL.format(alias='dm')),
+                              (*pair, *position, limit))
+        return page_of(rows, limit, lambda row: row[4], lambda row: row[0])
+
+    def send_direct_message(self, sender_id: str, recipient_id: str, content: str) -> bool:
+        """Send direct message"""
+        try:
+            with self.transaction() as cursor:
+                cursor.execute("INSERT INTO direct_messages (content, sender_id, recipient_id) VALUES (?, ?, ?)",
+                               (content, sender_id, recipient_id))
+            return True
+        except Exception:
+            return False
+
+    def delete_dm(self, dm_id: int, user_id: str) -> bool:
+        """Delete direct message and its reactions if user is sender"""
+        try:
+            with self.transaction() as cursor:
+                cursor.execute("SELECT sender_id FROM direct_messages WHERE id = ?", (dm_id,))
+                row = cursor.fetchone()
+                if not row or row[0] != user_id:
+                    return False
+                cursor.execute("DELETE FROM dm_reactions WHERE dm_id = ?", (dm_id,))
+                cursor.execute("DELETE FROM direct_messages WHERE id = ?", (dm_id,))
+            return True
+        except Exception:
+            return False
+
+    def add_dm_reaction(self, dm_id: int, user_id: str, emoji: str) -> bool:
+        """Add or remove reaction to direct message"""
+        try:
+            with self.transaction() as cursor:
+                cursor.execute("""
+                    DELETE FROM dm_reactions
+                    WHERE dm_id = ? AND user_id = ? AND emoji = ?
+                """, (dm_id, user_id, emoji))
+                if not cursor.rowcount:
+                    cursor.execute("INSERT INTO dm_reactions (dm_id, user_id, emoji) VALUES (?, ?, ?)",
+                                   (dm_id, user_id, emoji))
+            return True
+        except Exception:
+            return False
+
+    def get_reactions_for_dms(self, dm_ids: List[int]) -> Dict[int, Dict[str, int]]:
+        """Get reaction counts for many direct messages in one query"""
+        reactions = {dm_id: {} for dm_id in dm_ids}
+        if not reactions:
+            return reactions
+        placeholders = ",".join("?" * len(reactions))
+        for dm_id, emoji, count in self.query(DM_REACTIONS_SQL.format(placeholders=placeholders), list(reactions)):
+            reactions[dm_id][emoji] = count
+        return reactions
+
+    # Forwarding
+
+    def _forward(self, source_sql: str, source_id: int, sender_id: str, recipient_id: str) -> bool:
+        try:
+            with self.transaction() as cursor:
+                cursor.execute(source_sql, (source_id,))
+                row = cursor.fetchone()
+                if not row:
+                    return False
+                cursor.execute("INSERT INTO direct_messages (content, sender_id, recipient_id) VALUES (?, ?, ?)",
+                               (f"[Forwarded] {row[0]}", sender_id, recipient_id))
+            return True
+        except Exception:
+            return False
+
+    def forward_message_to_dm(self, message_id: int, sender_id: str, recipient_id: str) -> bool:
+        """Forward message content to direct message"""
+        return self._forward("SELECT content FROM messages WHERE id = ?", message_id, sender_id, recipient_id)
+
+    def forward_dm_to_dm(self, dm_id: int, sender_id: str, recipient_id: str) -> bool:
+        """Forward DM content to another direct message"""
+        return self._forward("SELECT content FROM direct_messages WHERE id = ?", dm_id, sender_id, recipient_id)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Streamlit SQLite schema maintenance")
+    parser.add_argument('command', choices=['migrate', 'check-plans'])
+    parser.add_argument('database', nargs='?', default=':memory:',
+                        help='SQLite file (default: a fresh in-memory schema)')
+    args = parser.parse_args(argv)
+
+    store = ChatStore(args.database)
+    applied = store.init_schema()
+    if args.command == 'migrate':
+        print(f"applied {applied}" if applied else f"schema is current (version {store.schema_version()})")
+        return 0
+
+    problems = store.check_query_plans()
+    for name, _, _ in HOT_QUERIES:
+        if name in problems:
+            for detail in problems[name]:
+                print(f"FULL SCAN  {name}: {detail}")
+        else:
+            print(f"ok  {name}")
+    return 1 if problems else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
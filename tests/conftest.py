@@ -0,0 +1,107 @@
+"""
+Shared test setup: the app imported against a throwaway SQLite database, emptied between tests
+"""
+
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DB_DIR = tempfile.mkdtemp(prefix='communicationx-tests-')
+
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(DB_DIR, 'primary.db')}"
+os.environ.setdefault('REPL_ID', 'test')
+os.environ['JOB_WORKERS'] = '0'
+os.environ['QUERY_PROFILE_SAMPLE_RATE'] = '0'
+sys.path.insert(0, ROOT)
+
+import jinja2  # noqa: E402
+from flask import g  # noqa: E402
+from flask.testing import FlaskClient  # noqa: E402
+
+import main  # noqa: E402,F401  (migrates the schema and registers every route)
+from app import app as flask_app, db, limiter  # noqa: E402
+from cache import cache  # noqa: E402
+from fragments import fragment_cache  # noqa: E402
+from models import Channel, DirectMessage, Message, SchemaVersion, Server, ServerMembership, User  # noqa: E402
+from schema_migrations import MIGRATIONS  # noqa: E402
+
+# Templates sit next to the modules in this checkout
+flask_app.jinja_loader = jinja2.ChoiceLoader([flask_app.jinja_loader, jinja2.FileSystemLoader(ROOT)])
+flask_app.config['WTF_CSRF_ENABLED'] = False
+limiter.enabled = False
+
+class Client(FlaskClient):
+    """Requests run inside the test's app context, so forget the user flask_login put on g last time"""
+
+    def open(self, *args, **kwargs):
+        g.pop('_login_user', None)
+        return super().open(*args, **kwargs)
+
+flask_app.test_client_class = Client
+
+@pytest.fixture
+def app():
+    with flask_app.app_context():
+        yield flask_app
+        db.session.remove()
+        # Every test starts from empty tables and caches
+        db.drop_all()
+        db.create_all()
+        # create_all builds the current schema; record it as migrated like a booted database
+        db.session.execute(SchemaVersion.__table__.insert(), [
+            {'version': version, 'name': name, 'applied_at': datetime.now()} for version, name, _ in MIGRATIONS
+        ])
+        db.session.commit()
+        cache.clear()
+        fragment_cache.clear()
+
+@pytest.fixture
+def login(app):
+    """login(user_id) returns a test client signed in as that user"""
+    def signed_in(user_id):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['_user_id'] = str(user_id)
+            sess['_fresh'] = True
+        return client
+    return signed_in
+
+@pytest.fixture
+def chat(app):
+    """Two users sharing a server with one channel; add_messages(n) fills the channel and their DMs"""
+    alice = User(username='alice', email='alice@example.com')
+    bob = User(username='bob', email='bob@example.com')
+    db.session.add_all([alice, bob])
+    db.session.flush()
+    server = Server(name='general chat', owner_id=alice.id)
+    db.session.add(server)
+    db.session.flush()
+    channel = Channel(name='general', server_id=server.id)
+    db.session.add_all([channel, ServerMembership(user_id=alice.id, server_id=server.id),
+                        ServerMembership(user_id=bob.id, server_id=server.id)])
+    db.session.commit()
+
+    class Chat:
+        pass
+
+    chat = Chat()
+    chat.alice_id, chat.bob_id, chat.server_id, chat.channel_id = alice.id, bob.id, server.id, channel.id
+
+    def add_messages(n, prefix='message'):
+        authors = (chat.alice_id, chat.bob_id)
+        db.session.add_all([
+            Message(content=f"{prefix} {i}", author_id=authors[i % 2], channel_id=chat.channel_id)
+            for i in range(n)
+        ])
+        db.session.add_all([
+            DirectMessage(content=f"{prefix} {i}", sender_id=authors[i % 2], recipient_id=authors[1 - i % 2])
+            for i in range(n)
+        ])
+        db.session.commit()
+
+    chat.add_messages = add_messages
+    return chat
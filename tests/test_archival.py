@@ -0,0 +1,62 @@
+"""
+Hot/cold message storage: old messages move to message_archive in batches and channel history
+still reads as one timeline, reactions included, without handing archived ids out again
+"""
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+
+from app import db
+from archival import archive_old_messages, channel_history
+from models import Message, MessageArchive
+from reactions import toggle_reaction
+
+def _post(chat, content, days_ago, **fields):
+    message = Message(content=content, author_id=chat.alice_id, channel_id=chat.channel_id,
+                      created_at=datetime.now() - timedelta(days=days_ago), **fields)
+    db.session.add(message)
+    db.session.flush()
+    return message.id
+
+def test_old_messages_move_to_the_archive_and_stay_readable(chat, login):
+    old_ids = [_post(chat, f'old {i}', days_ago=200 - i) for i in range(5)]
+    pinned_id = _post(chat, 'old pinned', days_ago=300, is_pinned=True)
+    _post(chat, 'recent', days_ago=1)
+    toggle_reaction(old_ids[0], chat.bob_id, '👍')
+    db.session.commit()
+
+    assert archive_old_messages(older_than_days=90, batch_size=2) == 5
+    assert db.session.scalars(select(MessageArchive.id).order_by(MessageArchive.id)).all() == old_ids
+    hot = db.session.scalars(select(Message.content).order_by(Message.created_at)).all()
+    assert hot == ['old pinned', 'recent']
+
+    # One timeline: the pinned hot message is older than every archived one
+    history = channel_history(chat.channel_id)
+    assert [message.id for message in history][:2] == [pinned_id, old_ids[0]]
+    assert [message.content for message in history][-1] == 'recent'
+
+    page = login(chat.bob_id).get(f'/server/{chat.server_id}').get_data(as_text=True)
+    assert 'old 0' in page and 'recent' in page
+    assert '<span class="reaction-count">1</span>' in page
+
+    # Archived ids are never reused by new messages
+    new_id = _post(chat, 'after archival', days_ago=0)
+    assert new_id > max(old_ids)
+
+def test_history_pages_cross_the_archive_boundary(chat):
+    ids = [_post(chat, f'message {i}', days_ago=200 - i) for i in range(6)]
+    ids += [_post(chat, f'message {i}', days_ago=10 - i) for i in range(6, 10)]
+    db.session.commit()
+    archive_old_messages(older_than_days=90)
+
+    seen = []
+    before = before_id = None
+    while True:
+        page = channel_history(chat.channel_id, limit=3, before=before, before_id=before_id)
+        if not page:
+            break
+        seen = [message.id for message in page] + seen
+        before, before_id = page[0].created_at, page[0].id
+    assert seen == ids
+    assert db.session.scalar(select(func.count()).select_from(MessageArchive)) == 6
@@ -0,0 +1,46 @@
+"""
+Read-through cache: credentials stay out of the shared tier, and a read that raced with an
+invalidation cannot put the old row back
+"""
+
+from app import db
+from cache import _MISSING, _row_key, cache, cached_get, invalidate
+from models import User
+
+def test_shared_tier_holds_no_credentials(chat):
+    user = db.session.get(User, chat.alice_id)
+    user.password_hash = 'pbkdf2:sha256:secret'
+    user.bot_token = 'bot-secret'
+    db.session.commit()
+    db.session.remove()
+
+    cached_get(User, chat.alice_id)
+    values = cache.shared.get(_row_key(User, chat.alice_id))
+    assert values['username'] == 'alice'
+    assert 'password_hash' not in values and 'bot_token' not in values
+
+    # A row rebuilt from the cache still reads its credentials from the database
+    db.session.remove()
+    cache.local.clear()
+    user = cached_get(User, chat.alice_id)
+    assert user.password_hash == 'pbkdf2:sha256:secret'
+
+def test_read_that_raced_with_an_invalidation_is_not_cached(chat):
+    key = _row_key(User, chat.bob_id)
+    generation = cache.generation(key)
+    stale = {'id': chat.bob_id, 'username': 'bob', 'is_banned': False}
+
+    # Bob is banned (and his row invalidated) after the read started but before it is cached
+    user = db.session.get(User, chat.bob_id)
+    user.is_banned = True
+    db.session.commit()
+    cache.set(key, stale, generation)
+
+    assert cache.get(key) is _MISSING
+    assert cached_get(User, chat.bob_id).is_banned
+
+    # Without a concurrent change the value is cached as usual
+    invalidate(User, chat.bob_id)
+    generation = cache.generation(key)
+    cache.set(key, stale, generation)
+    assert cache.get(key) == stale
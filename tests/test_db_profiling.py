@@ -0,0 +1,48 @@
+"""
+Query counters see only the statements of the thread or greenlet that opened them
+"""
+
+import threading
+
+import pytest
+from sqlalchemy import select, text
+
+from app import app as flask_app, db
+from db_profiling import QueryBudgetExceeded, QueryCounter, query_budget
+from models import User
+
+def test_nested_counters_both_count(app):
+    with QueryCounter() as outer:
+        db.session.execute(text("SELECT 1"))
+        with QueryCounter() as inner:
+            db.session.execute(select(User.id))
+        db.session.execute(text("SELECT 2"))
+    assert (outer.count, inner.count) == (3, 1)
+
+def test_other_threads_are_not_counted(app):
+    started, finish = threading.Event(), threading.Event()
+
+    def concurrent_request():
+        with flask_app.app_context():
+            started.set()
+            finish.wait(5)
+            for _ in range(5):
+                db.session.execute(text("SELECT 1"))
+            db.session.remove()
+
+    worker = threading.Thread(target=concurrent_request)
+    worker.start()
+    started.wait(5)
+    with QueryCounter() as counter:
+        finish.set()
+        worker.join(5)
+        db.session.execute(text("SELECT 1"))
+    assert counter.count == 1
+
+def test_query_budget_lists_the_statements(app):
+    with pytest.raises(QueryBudgetExceeded) as exceeded:
+        with query_budget(1, 'two lookups'):
+            db.session.execute(text("SELECT 1"))
+            db.session.execute(text("SELECT 2"))
+    assert exceeded.value.label == 'two lookups'
+    assert len(exceeded.value.statements) == 2
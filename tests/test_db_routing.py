@@ -0,0 +1,76 @@
+"""
+Read-replica routing with two SQLite files: the replica is a snapshot of the primary, so rows
+written after the snapshot show which database a page read its history from
+"""
+
+import sqlite3
+
+import pytest
+from sqlalchemy import create_engine
+
+from app import db
+from db_routing import REPLICA_BIND_KEY
+from orm_repository import repository
+
+@pytest.fixture
+def replica(app, tmp_path):
+    """snapshot() copies the primary into a second SQLite file and serves it as the replica bind"""
+    path = tmp_path / 'replica.db'
+
+    def snapshot():
+        engine = db.engines.pop(REPLICA_BIND_KEY, None)
+        if engine is not None:
+            engine.dispose()
+        source = sqlite3.connect(db.engine.url.database)
+        target = sqlite3.connect(path)
+        source.backup(target)
+        source.close()
+        target.close()
+        db.engines[REPLICA_BIND_KEY] = create_engine(f"sqlite:///{path}")
+
+    yield snapshot
+    engine = db.engines.pop(REPLICA_BIND_KEY, None)
+    if engine is not None:
+        engine.dispose()
+
+def test_channel_history_reads_the_replica(chat, login, replica):
+    chat.add_messages(3, prefix='replicated')
+    replica()
+    chat.add_messages(2, prefix='lagging')
+
+    page = login(chat.bob_id).get(f'/server/{chat.server_id}').get_data(as_text=True)
+    assert 'replicated 2' in page
+    assert 'lagging' not in page
+
+def test_dm_history_reads_the_replica(chat, login, replica):
+    chat.add_messages(3, prefix='replicated')
+    replica()
+    chat.add_messages(2, prefix='lagging')
+
+    page = login(chat.bob_id).get(f'/dm/{chat.alice_id}').get_data(as_text=True)
+    assert 'replicated 2' in page
+    assert 'lagging' not in page
+
+def test_own_write_reads_the_primary(chat, login, replica):
+    chat.add_messages(3, prefix='replicated')
+    replica()
+
+    client = login(chat.bob_id)
+    client.post(f'/server/{chat.server_id}/send_message', data={'message': 'just sent'})
+    page = client.get(f'/server/{chat.server_id}').get_data(as_text=True)
+    assert 'just sent' in page
+
+def test_history_outside_a_request_reads_the_primary(chat, replica):
+    chat.add_messages(3, prefix='replicated')
+    replica()
+    chat.add_messages(2, prefix='lagging')
+
+    # streamlit_app calls the repository with only an app context
+    contents = [message.content for message in repository.channel_messages(chat.channel_id).items]
+    assert 'lagging 1' in contents
+
+def test_without_a_replica_history_reads_the_primary(chat, login):
+    chat.add_messages(2, prefix='primary')
+
+    page = login(chat.bob_id).get(f'/server/{chat.server_id}').get_data(as_text=True)
+    assert 'primary 1' in page
@@ -0,0 +1,55 @@
+"""
+Chunked deletion: a flagged user or server disappears from the app at once, and its purge job
+leaves no row anywhere that still points at it
+"""
+
+from sqlalchemy import func, select
+
+from app import db
+from deletion import _references, schedule_server_deletion, schedule_user_deletion
+from jobs import run_one
+from models import DirectMessage, Message, MessageReaction, Server, User
+from reactions import toggle_reaction
+
+def _run_jobs():
+    while run_one('test'):
+        pass
+
+def _rows_pointing_at(table, ident):
+    return {
+        f"{column.table.name}.{column.name}": count
+        for column in _references(table)
+        if (count := db.session.scalar(select(func.count()).select_from(column.table).where(column == ident)))
+    }
+
+def test_user_being_purged_cannot_receive_dms(chat, login):
+    chat.add_messages(4)
+    schedule_user_deletion(db.session.get(User, chat.bob_id))
+
+    client = login(chat.alice_id)
+    assert client.post(f'/send_dm/{chat.bob_id}', data={'message': 'still there?'}).status_code == 404
+    assert client.get(f'/dm/{chat.bob_id}').status_code == 404
+    assert client.get(f'/call/{chat.bob_id}/audio').status_code == 404
+
+    _run_jobs()
+    db.session.expire_all()
+    assert db.session.get(User, chat.bob_id) is None
+    assert _rows_pointing_at(User.__table__, chat.bob_id) == {}
+    assert db.session.scalar(select(func.count()).select_from(DirectMessage)) == 0
+
+def test_server_purge_removes_everything_below_it(chat):
+    chat.add_messages(6)
+    for message_id in db.session.scalars(select(Message.id)):
+        toggle_reaction(message_id, chat.bob_id, '👍')
+    db.session.commit()
+
+    schedule_server_deletion(db.session.get(Server, chat.server_id))
+    _run_jobs()
+    db.session.expire_all()
+
+    assert db.session.get(Server, chat.server_id) is None
+    assert _rows_pointing_at(Server.__table__, chat.server_id) == {}
+    assert db.session.scalar(select(func.count()).select_from(Message)) == 0
+    assert db.session.scalar(select(func.count()).select_from(MessageReaction)) == 0
+    # Direct messages belong to the users, who both remain
+    assert db.session.scalar(select(func.count()).select_from(DirectMessage)) == 6
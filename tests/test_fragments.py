@@ -0,0 +1,53 @@
+"""
+Rendered message fragments: pages reuse cached HTML, and any change to what a fragment shows
+(edit, reaction, pin, viewer permissions) renders it again
+"""
+
+from datetime import datetime
+
+from sqlalchemy import select
+
+from app import db
+from fragments import fragment_cache
+from models import Message
+from reactions import toggle_reaction
+
+def _mark_cached(key):
+    """Swap every cached variant for a marker, so a page shows whether it reused them"""
+    variants = fragment_cache.get(key)
+    fragment_cache.set(key, {variant: f'<p>cached {key[1]}</p>' for variant in variants})
+
+def test_pages_reuse_fragments_until_the_message_changes(chat, login):
+    chat.add_messages(2)
+    message_id = db.session.scalar(select(Message.id).order_by(Message.id))
+    client = login(chat.bob_id)
+    url = f'/server/{chat.server_id}'
+
+    assert 'message 0' in client.get(url).get_data(as_text=True)
+    _mark_cached(('message', message_id))
+    assert f'cached {message_id}' in client.get(url).get_data(as_text=True)
+
+    message = db.session.get(Message, message_id)
+    message.content = 'edited text'
+    message.edited_at = datetime.now()
+    db.session.commit()
+    page = client.get(url).get_data(as_text=True)
+    assert 'edited text' in page and f'cached {message_id}' not in page
+
+    # A reaction changes the variant: rendered again even though the old entry is still cached
+    _mark_cached(('message', message_id))
+    toggle_reaction(message_id, chat.alice_id, '🎉')
+    db.session.commit()
+    page = client.get(url).get_data(as_text=True)
+    assert '🎉' in page and f'cached {message_id}' not in page
+
+def test_viewers_with_different_permissions_get_their_own_variant(chat, login):
+    chat.add_messages(1)
+    message_id = db.session.scalar(select(Message.id))
+    url = f'/server/{chat.server_id}'
+
+    login(chat.alice_id).get(url)
+    _mark_cached(('message', message_id))
+    # bob neither wrote the message nor owns the server, so alice's variant does not apply
+    assert f'cached {message_id}' not in login(chat.bob_id).get(url).get_data(as_text=True)
+    assert len(fragment_cache.get(('message', message_id))) == 2
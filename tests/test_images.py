@@ -0,0 +1,91 @@
+"""
+Image assets and thumbnails: uploads are stored once under their hash, served with immutable
+caching, and downscaled by background jobs without losing the original
+"""
+
+import base64
+import io
+
+import pytest
+from PIL import Image
+from sqlalchemy import text
+
+import images
+from app import db
+from images import IMMUTABLE_CACHE_CONTROL, asset_url, extract_data_urls, load_asset, save_image, store_image
+from jobs import run_one
+from thumbnails import generate_emoji_thumbnails
+from models import CustomEmoji, Server
+from schema_migrations import upgrade_schema
+
+def _png(size):
+    out = io.BytesIO()
+    Image.new('RGB', (size, size), (200, 40, 90)).save(out, 'PNG')
+    return out.getvalue()
+
+def test_assets_are_served_by_hash_with_immutable_caching(app):
+    url = save_image(_png(300))
+    db.session.commit()
+    client = app.test_client()
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == IMMUTABLE_CACHE_CONTROL
+    assert Image.open(io.BytesIO(response.data)).size == (256, 256)
+
+    asset_hash = url.rsplit('/', 1)[1]
+    assert client.get(url, headers={'If-None-Match': f'"{asset_hash}"'}).status_code == 304
+    with pytest.raises(ValueError):
+        save_image(b'<svg onload="alert(1)"></svg>')
+
+def test_data_url_logos_move_into_assets(chat):
+    data_url = 'data:image/png;base64,' + base64.b64encode(_png(100)).decode()
+    db.session.get(Server, chat.server_id).logo_url = data_url
+    db.session.commit()
+
+    assert extract_data_urls(db.session)['server.logo_url'] == 1
+    db.session.commit()
+    logo_url = db.session.get(Server, chat.server_id).logo_url
+    assert logo_url.startswith('/assets/')
+    assert load_asset(logo_url.rsplit('/', 1)[1]).data == _png(100)
+
+def test_small_images_are_decoded_once(app, monkeypatch):
+    first = store_image(_png(32))
+    assert list(first) == ['original']
+
+    def decode(*args):
+        raise AssertionError("decoded again")
+
+    monkeypatch.setattr(images, '_variants', decode)
+    assert store_image(_png(32)) == first
+
+def test_emoji_thumbnail_keeps_the_original(chat):
+    original_url = asset_url(store_image(_png(300), sizes=())['original'])
+    emoji = CustomEmoji(server_id=chat.server_id, name='party', image_url=original_url)
+    db.session.add(emoji)
+    db.session.commit()
+    emoji_id = emoji.id
+
+    # Queued with the emoji; running it twice changes nothing more
+    assert run_one('test')
+    generate_emoji_thumbnails(emoji_id)
+
+    emoji = db.session.get(CustomEmoji, emoji_id)
+    assert emoji.image_url == original_url
+    thumbnail = load_asset(emoji.thumbnail_url.rsplit('/', 1)[1])
+    assert (thumbnail.width, thumbnail.height) == (64, 64)
+
+def test_upgrade_restores_overwritten_emoji_urls(chat):
+    stored = store_image(_png(300))
+    emoji = CustomEmoji(server_id=chat.server_id, name='old', image_url=asset_url(stored['64']),
+                        thumbnail_url=None)
+    db.session.add(emoji)
+    db.session.commit()
+    emoji_id = emoji.id
+    db.session.execute(text("DELETE FROM schema_version WHERE version >= 12"))
+    db.session.commit()
+    db.session.remove()
+
+    assert 12 in upgrade_schema()
+    emoji = db.session.get(CustomEmoji, emoji_id)
+    assert (emoji.image_url, emoji.thumbnail_url) == (asset_url(stored['original']), asset_url(stored['64']))
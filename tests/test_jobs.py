@@ -0,0 +1,113 @@
+"""
+Background jobs: retries back off, an exhausted job fails, and a job whose worker was lost is run
+again once its lease expires, or failed if that was its last attempt
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import func, select, update
+
+import jobs
+from app import db
+from jobs import LEASE_SECONDS, enqueue, job, run_one
+from models import AuditLog, Job
+
+calls = []
+
+@job('test_record', max_attempts=2)
+def record(value):
+    calls.append(value)
+
+@job('test_broken', max_attempts=2)
+def broken():
+    raise RuntimeError("still broken")
+
+@pytest.fixture(autouse=True)
+def _no_jitter(monkeypatch):
+    calls.clear()
+    monkeypatch.setattr(jobs.random, 'uniform', lambda low, high: 1.0)
+
+def _job(job_id):
+    db.session.expire_all()
+    return db.session.get(Job, job_id)
+
+def _lose_worker(job_id):
+    """The job looks claimed by a worker that died longer than a lease ago"""
+    db.session.execute(update(Job.__table__).where(Job.__table__.c.id == job_id).values(
+        status='running', locked_by='gone:1:0', locked_at=datetime.now() - timedelta(seconds=LEASE_SECONDS + 1)
+    ))
+    db.session.commit()
+
+def test_job_runs_with_its_payload(app):
+    job_id = enqueue('test_record', {'value': 'hello'})
+    db.session.commit()
+
+    assert run_one('test')
+    assert not run_one('test')
+    assert calls == ['hello']
+    assert _job(job_id).status == 'done'
+
+def test_failure_is_retried_after_a_backoff_then_failed(app):
+    job_id = enqueue('test_broken')
+    db.session.commit()
+
+    before = datetime.now()
+    assert run_one('test')
+    retry = _job(job_id)
+    assert (retry.status, retry.attempts) == ('queued', 1)
+    assert retry.run_at >= before + timedelta(seconds=jobs.BACKOFF_BASE)
+    assert 'still broken' in retry.last_error
+    # Not runnable again until the backoff has passed
+    assert not run_one('test')
+
+    retry.run_at = datetime.now()
+    db.session.commit()
+    assert run_one('test')
+    failed = _job(job_id)
+    assert (failed.status, failed.attempts) == ('failed', 2)
+    assert failed.finished_at is not None
+
+def test_job_of_a_lost_worker_is_rerun_after_its_lease(app):
+    job_id = enqueue('test_record', {'value': 'again'})
+    db.session.commit()
+    _lose_worker(job_id)
+    db.session.execute(update(Job.__table__).values(attempts=1))
+    db.session.commit()
+
+    assert run_one('test')
+    assert calls == ['again']
+    rerun = _job(job_id)
+    assert (rerun.status, rerun.attempts) == ('done', 2)
+
+def test_running_job_within_its_lease_is_left_alone(app):
+    job_id = enqueue('test_record', {'value': 'busy'})
+    db.session.commit()
+    _lose_worker(job_id)
+    db.session.execute(update(Job.__table__).values(locked_at=datetime.now()))
+    db.session.commit()
+
+    assert not run_one('test')
+    assert _job(job_id).status == 'running'
+
+def test_lost_job_on_its_last_attempt_is_failed(app):
+    job_id = enqueue('test_record', {'value': 'never'})
+    db.session.commit()
+    _lose_worker(job_id)
+    db.session.execute(update(Job.__table__).values(attempts=2))
+    db.session.commit()
+
+    assert not run_one('test')
+    assert calls == []
+    failed = _job(job_id)
+    assert failed.status == 'failed'
+    assert 'Lease expired' in failed.last_error
+
+def test_audit_entry_commits_with_the_change(chat, login):
+    client = login(chat.alice_id)
+    response = client.post(f'/api/advanced/server/{chat.server_id}/roles/create', json={'name': 'mods'})
+    assert response.status_code == 200
+
+    entry = db.session.scalars(select(AuditLog)).one()
+    assert (entry.action_type, entry.target_id) == (10, str(response.get_json()['role_id']))
+    assert db.session.scalar(select(func.count()).select_from(Job)) == 0
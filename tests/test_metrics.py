@@ -0,0 +1,38 @@
+"""
+/metrics access without METRICS_TOKEN, and HTTP request counts that include unhandled errors
+"""
+
+import pytest
+
+from metrics import http_requests, scrape_allowed
+
+def _requests(endpoint, status):
+    return http_requests._values.get(('GET', endpoint, str(status)), 0)
+
+def test_metrics_are_served_to_loopback_clients_only(app):
+    client = app.test_client()
+    assert client.get('/metrics').status_code == 200
+    assert client.get('/metrics', environ_base={'REMOTE_ADDR': '203.0.113.5'}).status_code == 403
+    # A forwarded address cannot stand in for the socket peer
+    spoofed = client.get('/metrics', headers={'X-Forwarded-For': '127.0.0.1'},
+                         environ_base={'REMOTE_ADDR': '203.0.113.5'})
+    assert spoofed.status_code == 403
+
+def test_token_is_required_from_any_address():
+    assert scrape_allowed({'REMOTE_ADDR': '203.0.113.5', 'HTTP_AUTHORIZATION': 'Bearer s3cret'}, 's3cret')
+    assert not scrape_allowed({'REMOTE_ADDR': '127.0.0.1'}, 's3cret')
+
+def test_unhandled_errors_are_counted_as_500(app, monkeypatch):
+    def broken():
+        raise RuntimeError("view failed")
+
+    monkeypatch.setitem(app.view_functions, 'index', broken)
+    before = _requests('index', 500)
+    assert app.test_client().get('/').status_code == 500
+    assert _requests('index', 500) == before + 1
+
+    # Propagated exceptions skip after_request; teardown still counts them
+    monkeypatch.setitem(app.config, 'PROPAGATE_EXCEPTIONS', True)
+    with pytest.raises(RuntimeError):
+        app.test_client().get('/')
+    assert _requests('index', 500) == before + 2
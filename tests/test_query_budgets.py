@@ -0,0 +1,49 @@
+"""
+Page query budgets: each page stays within PAGE_QUERY_BUDGETS and issues the same number of
+statements whether the channel and conversation hold N or 10 * N messages
+"""
+
+import pytest
+
+from app import db
+from cache import cache
+from db_profiling import PAGE_QUERY_BUDGETS, query_budget
+from fragments import fragment_cache
+from models import Message
+from reactions import toggle_reaction
+
+N = 20
+
+PAGES = {
+    'home': '/home',
+    'server_view': '/server/{server_id}',
+    'dm_conversation': '/dm/{alice_id}',
+}
+
+def _add_messages(chat, count):
+    chat.add_messages(count)
+    # Reactions on every message, so per-message reaction lookups would show up as growth
+    for message_id in db.session.scalars(db.select(Message.id).where(Message.channel_id == chat.channel_id)):
+        toggle_reaction(message_id, chat.alice_id, '👍')
+    db.session.commit()
+
+def _page_queries(client, endpoint, url):
+    # Cold caches: count what a page costs when nothing is cached yet
+    cache.clear()
+    fragment_cache.clear()
+    with query_budget(PAGE_QUERY_BUDGETS[endpoint], endpoint) as counter:
+        response = client.get(url)
+    assert response.status_code == 200
+    return counter.count
+
+@pytest.mark.parametrize('endpoint', sorted(PAGES))
+def test_page_queries_stay_flat_as_history_grows(chat, login, endpoint):
+    url = PAGES[endpoint].format(server_id=chat.server_id, alice_id=chat.alice_id)
+    client = login(chat.bob_id)
+
+    _add_messages(chat, N)
+    few = _page_queries(client, endpoint, url)
+    _add_messages(chat, 9 * N)
+    many = _page_queries(client, endpoint, url)
+
+    assert few == many, f"{endpoint} issued {few} queries with {N} messages but {many} with {10 * N}"
@@ -0,0 +1,57 @@
+"""
+Reaction count summary: toggling reactions keeps message_reaction_counts equal to the reactions
+themselves, and the channel page renders counts from the summary
+"""
+
+from sqlalchemy import func, select
+
+from app import db
+from models import Message, MessageReaction, MessageReactionCount
+from reactions import reaction_counts_for, rebuild_reaction_counts
+
+def _react(client, message_id, emoji):
+    response = client.post(f'/message/{message_id}/react', json={'emoji': emoji})
+    assert response.status_code == 200
+    return response.get_json()['action']
+
+def _recounted():
+    rows = db.session.execute(
+        select(MessageReaction.message_id, MessageReaction.emoji, func.count())
+        .group_by(MessageReaction.message_id, MessageReaction.emoji)
+    ).all()
+    return {(message_id, emoji): count for message_id, emoji, count in rows}
+
+def _summary():
+    rows = db.session.execute(
+        select(MessageReactionCount.message_id, MessageReactionCount.emoji, MessageReactionCount.count)).all()
+    return {(message_id, emoji): count for message_id, emoji, count in rows}
+
+def test_toggling_reactions_keeps_the_summary_exact(chat, login):
+    chat.add_messages(2)
+    first, second = db.session.scalars(select(Message.id).order_by(Message.id)).all()
+    alice, bob = login(chat.alice_id), login(chat.bob_id)
+
+    assert _react(alice, first, '👍') == 'added'
+    assert _react(bob, first, '👍') == 'added'
+    assert _react(bob, first, '🎉') == 'added'
+    assert _react(alice, second, '🔥') == 'added'
+    assert _summary() == _recounted() == {(first, '👍'): 2, (first, '🎉'): 1, (second, '🔥'): 1}
+
+    # Removing the last reaction of an emoji drops its summary row
+    assert _react(bob, first, '🎉') == 'removed'
+    assert _react(alice, second, '🔥') == 'removed'
+    assert _summary() == _recounted() == {(first, '👍'): 2}
+    assert reaction_counts_for([first, second]) == {first: {'👍': 2}, second: {}}
+
+    page = bob.get(f'/server/{chat.server_id}').get_data(as_text=True)
+    assert '<span class="reaction-count">2</span>' in page
+
+def test_rebuild_repairs_a_drifted_summary(chat, login):
+    chat.add_messages(1)
+    message_id = db.session.scalar(select(Message.id))
+    _react(login(chat.alice_id), message_id, '👍')
+    db.session.execute(MessageReactionCount.__table__.update().values(count=7))
+    db.session.commit()
+
+    rebuild_reaction_counts()
+    assert _summary() == {(message_id, '👍'): 1}
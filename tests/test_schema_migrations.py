@@ -0,0 +1,119 @@
+"""
+Schema migrations from a baseline-shaped database (VARCHAR user references holding ids, UUIDs and
+names such as 'webhook') up to the current version
+"""
+
+import pytest
+from sqlalchemy import MetaData, String, create_engine, func, select, text
+
+import schema_migrations
+from app import db, init_database
+from db_profiling import QueryCounter
+from models import Message, MessageReaction, MessageReactionCount, ServerMembership, User
+from schema_migrations import PLACEHOLDER_USERNAME, latest_version, upgrade_schema, verify_user_fks
+
+def test_current_schema_costs_one_query(app):
+    with QueryCounter() as counter:
+        assert upgrade_schema() == []
+    assert counter.count == 1
+
+def test_reapplied_steps_keep_existing_rows(chat):
+    chat.add_messages(3)
+    db.session.execute(text("DELETE FROM schema_version WHERE version >= 7"))
+    db.session.commit()
+    db.session.remove()
+
+    assert upgrade_schema() == list(range(7, latest_version() + 1))
+    assert db.session.scalar(select(func.count()).select_from(Message)) == 3
+    assert db.session.get(User, chat.alice_id).username == 'alice'
+
+def test_failed_migration_stops_the_boot(app, monkeypatch):
+    def broken(connection):
+        raise RuntimeError("cannot migrate")
+
+    monkeypatch.setattr(schema_migrations, 'MIGRATIONS',
+                        schema_migrations.MIGRATIONS + [(latest_version() + 1, 'broken step', broken)])
+    with pytest.raises(SystemExit):
+        init_database()
+    # Rolled back as a whole: the failed step is not recorded
+    monkeypatch.undo()
+    db.session.remove()
+    assert db.session.scalar(text("SELECT MAX(version) FROM schema_version")) == latest_version()
+
+# Tables rebuilt with string user references, as the first releases created them
+BASELINE_STRING_COLUMNS = {
+    'messages': ('author_id',),
+    'server_membership': ('user_id',),
+    'message_reaction': ('user_id',),
+}
+
+@pytest.fixture
+def baseline(tmp_path):
+    """An unversioned database: alice (id 1) in one server, plus rows left by users that are gone"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'baseline.db'}")
+    metadata = MetaData()
+    for table in db.metadata.sorted_tables:
+        copy = table.to_metadata(metadata)
+        for name in BASELINE_STRING_COLUMNS.get(table.name, ()):
+            copy.c[name].type = String(255)
+    metadata.create_all(engine)
+
+    with engine.begin() as connection:
+        connection.execute(text("INSERT INTO users (id, username) VALUES (1, 'alice')"))
+        connection.execute(text("INSERT INTO server (id, name, owner_id) VALUES (1, 'general chat', 1)"))
+        connection.execute(text("INSERT INTO channel (id, name, server_id) VALUES (1, 'general', 1)"))
+        connection.execute(text(
+            "INSERT INTO server_membership (user_id, server_id) VALUES ('1', 1), ('ghost', 1), ('8f1c-uuid', 1)"))
+        connection.execute(text(
+            "INSERT INTO messages (id, content, author_id, channel_id, created_at) VALUES "
+            "(1, 'hello', '1', 1, '2024-01-01'), (2, 'deploy done', 'webhook', 1, '2024-01-02')"))
+        connection.execute(text(
+            "INSERT INTO message_reaction (message_id, user_id, emoji, created_at) VALUES "
+            "(1, '1', '👍', '2024-01-01'), (1, 'ghost', '👍', '2024-01-01'), (2, 'webhook', '🎉', '2024-01-02')"))
+    yield engine
+    engine.dispose()
+
+def test_baseline_upgrade_keeps_content_and_drops_orphaned_associations(baseline):
+    applied = upgrade_schema(baseline)
+    assert applied[-1] == latest_version()
+
+    with baseline.connect() as connection:
+        assert verify_user_fks(connection) == []
+        placeholder = connection.execute(
+            select(User.id).where(User.username == PLACEHOLDER_USERNAME)).scalar()
+
+        # Content survives under the placeholder
+        authors = dict(connection.execute(select(Message.id, Message.author_id)).all())
+        assert authors == {1: 1, 2: placeholder}
+
+        # Memberships and reactions of missing users are gone, not handed to the placeholder
+        assert connection.execute(select(ServerMembership.user_id)).scalars().all() == [1]
+        assert connection.execute(select(MessageReaction.user_id)).scalars().all() == [1]
+        counts = connection.execute(
+            select(MessageReactionCount.message_id, MessageReactionCount.emoji, MessageReactionCount.count)).all()
+        assert counts == [(1, '👍', 1)]
+
+def test_placeholder_associations_from_earlier_upgrades_are_removed(chat):
+    placeholder = User(username=PLACEHOLDER_USERNAME, is_banned=True)
+    db.session.add(placeholder)
+    db.session.flush()
+    message = Message(content='hello', author_id=chat.alice_id, channel_id=chat.channel_id)
+    db.session.add_all([message, ServerMembership(user_id=placeholder.id, server_id=chat.server_id)])
+    db.session.flush()
+    db.session.add_all([
+        MessageReaction(message_id=message.id, user_id=placeholder.id, emoji='👍'),
+        MessageReaction(message_id=message.id, user_id=chat.bob_id, emoji='👍'),
+        MessageReactionCount(message_id=message.id, emoji='👍', count=2),
+    ])
+    db.session.commit()
+    placeholder_id, message_id = placeholder.id, message.id
+    db.session.execute(text("DELETE FROM schema_version WHERE version >= 11"))
+    db.session.commit()
+    db.session.remove()
+
+    assert 11 in upgrade_schema()
+
+    members = db.session.scalars(select(ServerMembership.user_id).where(ServerMembership.server_id == chat.server_id))
+    assert placeholder_id not in set(members)
+    assert db.session.scalar(select(func.count()).select_from(MessageReaction)) == 1
+    assert db.session.scalar(select(MessageReactionCount.count).where(MessageReactionCount.message_id == message_id)) == 1
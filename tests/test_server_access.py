@@ -0,0 +1,48 @@
+"""
+Cached per-user server sets: access checks are served from the cache and follow joins, kicks and
+ownership changes as soon as they commit
+"""
+
+from app import db
+from cache import accessible_server_ids, can_access_server
+from db_profiling import QueryCounter
+from models import Server, ServerMembership, User
+
+def _can_open(client, server_id):
+    return client.get(f'/server/{server_id}').status_code == 200
+
+def test_access_follows_membership_changes(chat, login):
+    carol = User(username='carol', email='carol@example.com')
+    db.session.add(carol)
+    db.session.commit()
+    carol_id = carol.id
+    client = login(carol_id)
+
+    assert not _can_open(client, chat.server_id)
+
+    response = login(chat.alice_id).post(f'/server/{chat.server_id}/add_member', data={'username': 'carol'})
+    assert response.status_code == 302
+    assert _can_open(client, chat.server_id)
+
+    # Kicked through the ORM: the commit hook drops the cached set
+    db.session.delete(ServerMembership.query.filter_by(user_id=carol_id, server_id=chat.server_id).one())
+    db.session.commit()
+    assert not _can_open(client, chat.server_id)
+
+def test_access_follows_ownership_transfer(chat):
+    carol = User(username='carol', email='carol@example.com')
+    db.session.add(carol)
+    db.session.commit()
+    assert not can_access_server(carol.id, chat.server_id)
+    assert can_access_server(chat.alice_id, chat.server_id)
+
+    db.session.get(Server, chat.server_id).owner_id = carol.id
+    db.session.commit()
+    assert can_access_server(carol.id, chat.server_id)
+
+def test_repeated_checks_do_not_query(chat):
+    assert accessible_server_ids(chat.bob_id) == {chat.server_id}
+    with QueryCounter() as counter:
+        for _ in range(10):
+            assert can_access_server(chat.bob_id, chat.server_id)
+    assert counter.count == 0
@@ -0,0 +1,11 @@
+"""
+Hot ChatStore queries must stay on their indexes: a plan that falls back to a full table scan fails
+"""
+
+from streamlit_store import HOT_QUERIES, ChatStore
+
+def test_hot_queries_use_indexes():
+    store = ChatStore(':memory:')
+    store.init_schema()
+    assert HOT_QUERIES
+    assert store.check_query_plans() == {}
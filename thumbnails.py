@@ -0,0 +1,100 @@
+"""
+Thumbnail generation for CommunicationX
+New custom emojis and image attachments are downscaled by background jobs (jobs.py) queued in
+the same transaction that creates them. Each upload gets WebP copies (PNG where Pillow lacks
+WebP) at the standard sizes, stored as image assets. Attachments get their width, height and
+proxy_url filled in and emojis their thumbnail_url, so chat views load the 64 px copy; image_url
+and url keep pointing at the upload itself
+"""
+
+import logging
+import os
+
+import click
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import app, db
+from images import ASSET_URL_PREFIX, STANDARD_SIZES, asset_url, load_asset, store_image, thumbnail_type
+from jobs import enqueue, job
+from models import CustomEmoji, MessageAttachment
+
+# Longest edge in px of the copy chat views load
+CHAT_THUMBNAIL_SIZE = 64
+
+def _read_source(url):
+    """Bytes behind a local upload or asset URL; remote URLs are never fetched"""
+    if url.startswith(ASSET_URL_PREFIX):
+        row = load_asset(url[len(ASSET_URL_PREFIX):])
+        return row.data if row else None
+    if url.startswith('/static/uploads/'):
+        # Same relative layout upload_emoji writes to
+        path = os.path.normpath(url.lstrip('/'))
+        if not path.startswith(os.path.join('static', 'uploads') + os.sep) or not os.path.isfile(path):
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+    return None
+
+def _thumbnails(url):
+    """{variant: hash} for the image at url, or None when it cannot be read as an image"""
+    data = _read_source(url)
+    if data is None:
+        return None
+    try:
+        return store_image(data, sizes=STANDARD_SIZES, variant_type=thumbnail_type())
+    except ValueError as e:
+        logging.info(f"No thumbnails for {url}: {e}")
+        return None
+
+@job('emoji_thumbnails')
+def generate_emoji_thumbnails(emoji_id):
+    emoji = db.session.get(CustomEmoji, emoji_id)
+    if emoji is None or emoji.animated or emoji.thumbnail_url:
+        return
+    stored = _thumbnails(emoji.image_url)
+    if stored is None:
+        return
+    emoji.thumbnail_url = asset_url(stored.get(str(CHAT_THUMBNAIL_SIZE)) or stored['original'])
+    db.session.commit()
+
+@job('attachment_thumbnails')
+def generate_attachment_thumbnails(attachment_id):
+    attachment = db.session.get(MessageAttachment, attachment_id)
+    if attachment is None or attachment.proxy_url:
+        return
+    stored = _thumbnails(attachment.url)
+    if stored is None:
+        return
+    original = load_asset(stored['original'])
+    attachment.width, attachment.height = original.width, original.height
+    attachment.proxy_url = asset_url(stored.get(str(CHAT_THUMBNAIL_SIZE)) or stored['original'])
+    db.session.commit()
+
+def _is_image_attachment(attachment):
+    return (attachment.content_type or '').startswith('image/')
+
+# Jobs are inserted on the flush's own connection, so they commit or roll back with the rows
+@event.listens_for(Session, 'after_flush')
+def _queue_thumbnail_jobs(session, flush_context):
+    for obj in session.new:
+        if isinstance(obj, CustomEmoji):
+            enqueue('emoji_thumbnails', {'emoji_id': obj.id}, executor=session.connection())
+        elif isinstance(obj, MessageAttachment) and _is_image_attachment(obj):
+            enqueue('attachment_thumbnails', {'attachment_id': obj.id}, executor=session.connection())
+
+@app.cli.command('generate-thumbnails')
+def generate_thumbnails_command():
+    """Queue thumbnail jobs for existing emojis and image attachments that lack them"""
+    emoji_ids = db.session.scalars(
+        db.select(CustomEmoji.id).where(CustomEmoji.animated.isnot(True), CustomEmoji.thumbnail_url.is_(None))
+    ).all()
+    attachment_ids = db.session.scalars(
+        db.select(MessageAttachment.id).where(MessageAttachment.proxy_url.is_(None), MessageAttachment.content_type.like('image/%'))
+    ).all()
+    for emoji_id in emoji_ids:
+        enqueue('emoji_thumbnails', {'emoji_id': emoji_id})
+    for attachment_id in attachment_ids:
+        enqueue('attachment_thumbnails', {'attachment_id': attachment_id})
+    db.session.commit()
+    click.echo(f"queued {len(emoji_ids)} emojis and {len(attachment_ids)} attachments")
@@ -24,7 +24,7 @@ def hackkit(workspace_type):
     # Get user's servers for group workspaces
     servers = []
     if workspace_type == 'group':
-        servers = Server.query.filter_by(owner_id=current_user.id).all()
+        servers = Server.query.filter_by(owner_id=current_user.id, deleting=False).all()
     
     return render_template('tools/hackkit.html', 
                          workspace_type=workspace_type, 
@@ -102,7 +102,7 @@ def canva(workspace_type):
     
     servers = []
     if workspace_type == 'group':
-        servers = Server.query.filter_by(owner_id=current_user.id).all()
+        servers = Server.query.filter_by(owner_id=current_user.id, deleting=False).all()
     
     return render_template('tools/canva.html', 
                          workspace_type=workspace_type, 
@@ -179,7 +179,7 @@ def opera(session_type):
     
     servers = []
     if session_type == 'group':
-        servers = Server.query.filter_by(owner_id=current_user.id).all()
+        servers = Server.query.filter_by(owner_id=current_user.id, deleting=False).all()
     
     return render_template('tools/opera.html', 
                          session_type=session_type, 